@@ -11,8 +11,27 @@ from importlib import reload
 
 import support.arcpy_proxy as arcpy_proxy
 import support.config as config
+import support.parameters as parameters
 import support.reprojector as reprojector
+import support.metrics as metrics
+import support.session as session
+import support.poller as poller
+import support.json_files as json_files
+import support.token_cache as token_cache
+import support.downloader as downloader
+import support.unzipper as unzipper
+import support.sqlite_replica as sqlite_replica
+import support.replica_cache as replica_cache
+import support.service_cache as service_cache
+import support.sync_state as sync_state
+import support.row_keys as row_keys
+import support.catalog as catalog
+import support.field_maps as field_maps
+import support.append_scheduler as append_scheduler
+import support.attachments as attachments
+import support.attachment_index as attachment_index
 import support.extractor as extractor
+import support.query_extractor as query_extractor
 import support.transformer as transformer
 import support.loader as loader
 import support.messenger as messenger
@@ -20,10 +39,18 @@ import support.messenger as messenger
 NAME='ReSyncSurvey'
 VERSION = '1.0'
 
+def buildExtractor(configSupplied):
+    method = parameters.choiceParameter(configSupplied, parameters.EXTRACTION_METHOD, \
+                [parameters.REPLICA_EXTRACTION, parameters.QUERY_EXTRACTION], parameters.REPLICA_EXTRACTION)
+    if method == parameters.QUERY_EXTRACTION:
+        return query_extractor.AGOLSurveyQueryExtractor(configSupplied)
+    return extractor.AGOLSurveyReplicator(configSupplied)
+
+
 def buildReprojector(configSupplied):
     # ETL sub-component dependency injection
     return reprojector.SurveyReprojector(configSupplied).\
-                usingExtractor(extractor.AGOLSurveyReplicator(configSupplied)).\
+                usingExtractor(buildExtractor(configSupplied)).\
                 usingTransformer(transformer.FGDBReprojectionTransformer(configSupplied)).\
                 usingLoader(loader.ReprojectingSDEAppender(configSupplied))
 
@@ -43,9 +70,28 @@ def reloadModulesForArcGISPro():
     # https://gis.stackexchange.com/questions/91112/refreshing-imported-modules-in-arcgis-python-toolbox
     reload(messenger)
     reload(arcpy_proxy)
+    reload(parameters)
     reload(config)
     reload(reprojector)
+    reload(metrics)
+    reload(session)
+    reload(poller)
+    reload(json_files)
+    reload(token_cache)
+    reload(downloader)
+    reload(unzipper)
+    reload(sqlite_replica)
+    reload(replica_cache)
+    reload(service_cache)
+    reload(sync_state)
+    reload(row_keys)
+    reload(catalog)
+    reload(field_maps)
+    reload(append_scheduler)
+    reload(attachments)
+    reload(attachment_index)
     reload(extractor)
+    reload(query_extractor)
     reload(transformer)
     reload(loader)
 
@@ -12,6 +12,7 @@ import sys
 from . import env
 from . import da
 from . import management
+from . import conversion
 
 messages = []
 
@@ -30,6 +31,15 @@ def AddMessage(message):
     print(message)
 
 
+class ArcSDESQLExecute():
+    # https://pro.arcgis.com/en/pro-app/latest/arcpy/classes/arcsdesqlexecute.htm
+    def __init__(self, server = None, instance = None, database = None, user = None, password = None):
+        pass
+
+    def execute(self, sql_statement):
+        return True
+
+
 class Describe():
     # https://pro.arcgis.com/en/pro-app/latest/arcpy/functions/describe.htm
     # https://pro.arcgis.com/en/pro-app/latest/arcpy/functions/describe-object-properties.htm
@@ -40,6 +50,7 @@ class Describe():
         self.datatype = u'Workspace'
         self.children = []
         self.domains = []
+        self.isVersioned = False
 
     def __iter__(self):
         self.currentChildIndex  = 0
@@ -58,8 +69,9 @@ def Exists(workspace):
 
 
 class Field():
-    def __init__(self, name):
+    def __init__(self, name, type = 'String'):
         self.name = name
+        self.type = type
         self.domain = self.name
         self.editable = True
         self.required = True
@@ -126,6 +138,11 @@ def ListFeatureClasses(wild_card = None):
     return ["featureClass1", "featureClass2"]
 
 
+def ListIndexes(dataset, wild_card = None):
+    # https://pro.arcgis.com/en/pro-app/latest/arcpy/functions/listindexes.htm
+    return []
+
+
 def ListTables(wild_card = None, table_type = None):
     # https://pro.arcgis.com/en/pro-app/latest/arcpy/functions/listtables.htm
     return ["table1", "table2"]
@@ -143,5 +160,9 @@ def SpatialReference(CRS):
 def Statistics_analysis(tableName, workspace, analysisType):
     return None
 
+def ValidateTableName(name, workspace = None):
+    # https://pro.arcgis.com/en/pro-app/latest/arcpy/functions/validatetablename.htm
+    return name
+
 class ExecuteError(Exception):
     '''Raise some random ExecuteError'''
\ No newline at end of file
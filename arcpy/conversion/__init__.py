@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# arcpy.conversion -- Test stub stamding in for ESRI arcpy sub-module
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+# ---------------------------------------------------------------------------
+#
+
+def JSONToFeatures(in_json_file, out_features, geometry_type = None):
+    # https://pro.arcgis.com/en/pro-app/latest/tool-reference/conversion/json-to-features.htm
+    pass
@@ -10,7 +10,7 @@
 
 class Editor():
     # https://pro.arcgis.com/en/pro-app/latest/arcpy/data-access/editor.htm
-    def __init__(self, workspace):
+    def __init__(self, workspace, multiuser_mode = True):
         pass
     
     def __enter__(self):
@@ -46,8 +46,42 @@ class Cursor():
             raise StopIteration
 
 
-def UpdateCursor(FQtable, where_clause):
-    return Cursor()
+class InsertCursor():
+    # https://pro.arcgis.com/en/pro-app/latest/arcpy/data-access/insertcursor-class.htm
+    def __init__(self, in_table, field_names):
+        self.rows = []
+
+    def insertRow(self, row):
+        self.rows.append(row)
+        return len(self.rows)
+
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exception_type, exception_value, exception_traceback):
+        pass
+
+
+class UpdateCursor():
+    # https://pro.arcgis.com/en/pro-app/latest/arcpy/data-access/updatecursor-class.htm
+    def __init__(self, in_table, field_names, where_clause = None):
+        self.rows = []
+
+    def updateRow(self, row):
+        pass
+
+    def deleteRow(self):
+        pass
+
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exception_type, exception_value, exception_traceback):
+        pass
+
+    def __iter__(self):
+        return iter(self.rows)
+
 
-def SearchCursor(table, columnList):
+def SearchCursor(table, columnList, where_clause = None, spatial_reference = None, explode_to_points = False, sql_clause = (None, None)):
     return Cursor()
@@ -8,12 +8,22 @@
 # ---------------------------------------------------------------------------
 # 
 
-def AddField(table , field_name, field_type):
+def CalculateFields(in_table, expression_type, fields, code_block = None, enforce_domains = None):
+    # https://pro.arcgis.com/en/pro-app/latest/tool-reference/data-management/calculate-fields.htm
+    pass
+
+
+def AddField(table , field_name, field_type, field_precision = None, field_scale = None, field_length = None):
     # https://pro.arcgis.com/en/pro-app/latest/tool-reference/data-management/add-field.htm
     pass
 
 
-def Append(table, destination, schemaType, field_mapping):
+def AddIndex(in_table, fields, index_name = None, unique = None, ascending = None):
+    # https://pro.arcgis.com/en/pro-app/latest/tool-reference/data-management/add-attribute-index.htm
+    pass
+
+
+def Append(table, destination, schemaType = None, field_mapping = None):
     # See: https://pro.arcgis.com/en/pro-app/latest/tool-reference/data-management/append.htm
     pass
 
@@ -35,6 +45,11 @@ def CreateFileGDB(pathOnly, dbName):
     pass
 
 
+def CreateRelationshipClass(origin_table, destination_table, out_relationship_class, relationship_type, forward_label, backward_label, message_direction, cardinality, attributed, origin_primary_key, origin_foreign_key):
+    # https://pro.arcgis.com/en/pro-app/latest/tool-reference/data-management/create-relationship-class.htm
+    pass
+
+
 def CreateTable(outWorkspace, newTableName, template=None):
     pass
 
@@ -55,6 +70,11 @@ def DisableEditorTracking(table):
     pass
 
 
+def EnableAttachments(in_dataset):
+    # https://pro.arcgis.com/en/pro-app/latest/tool-reference/data-management/enable-attachments.htm
+    pass
+
+
 def GetCount(*tableNames):
     counts = []
     for tableName in tableNames:
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: support/append_scheduler.py
+# Purpose: To append replica tables concurrently, in worker processes, while respecting their relationships
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+from support.field_maps import fieldMappingsOf
+from support.sync_state import tableKeyOf
+
+import builtins
+import concurrent.futures
+import multiprocessing
+import os
+import sys
+
+import arcpy
+
+DEFAULT_APPEND_WORKERS = 1
+
+
+def appendDependenciesOf(relationshipClasses, tableList):
+    '''Returns {table: [tables it waits on]}, each related table waiting on the origin table of its relationship class'''
+    tableByKey = { tableKeyOf(table): table for table in tableList }
+    dependencies = { table: [] for table in tableList }
+    for dscRC in relationshipClasses:
+        # Attachment tables are appended with their origin table, not on their own.
+        if dscRC.isAttachmentRelationship:
+            continue
+        origin = tableByKey.get(tableKeyOf(dscRC.originClassNames[0]), None)
+        destination = tableByKey.get(tableKeyOf(dscRC.destinationClassNames[0]), None)
+        if origin != None and destination != None and origin != destination and origin not in dependencies[destination]:
+            dependencies[destination].append(origin)
+    return dependencies
+
+
+class AppendTask:
+    '''What a worker needs to append one replica table, as plain values that can cross a process boundary'''
+
+    def __init__(self, table, destinationFC, compiledFieldMap):
+        self.table = table
+        self.destinationFC = destinationFC
+        self.compiledFieldMap = compiledFieldMap
+
+
+class AppendResult:
+    def __init__(self, table, messages, failure=None):
+        self.table = table
+        self.messages = messages
+        self.failure = failure
+
+
+class AppendFailure:
+    '''What a worker process reports of a failed append: the error's type and message, and the arcpy messages it left'''
+
+    def __init__(self, exception):
+        self.typeName = type(exception).__name__
+        self.message = str(exception)
+        self.isExecuteError = isinstance(exception, arcpy.ExecuteError)
+        self.arcpyWarnings = arcpy.GetMessages(1) if self.isExecuteError else ''
+        self.arcpyErrors = arcpy.GetMessages(2) if self.isExecuteError else ''
+
+    def rebuild(self):
+        '''Returns an error matching the one raised in the worker, carrying the arcpy messages it left there'''
+        if self.isExecuteError:
+            # arcpy's messages belong to the process that ran the tool, so are read from the error, not from arcpy, here.
+            error = arcpy.ExecuteError(self.arcpyErrors or self.message)
+            error.arcpyWarnings = self.arcpyWarnings
+            error.arcpyErrors = self.arcpyErrors
+            return error
+
+        exceptionType = getattr(builtins, self.typeName, None)
+        if isinstance(exceptionType, type) and issubclass(exceptionType, Exception):
+            return exceptionType(self.message)
+        return Exception(f'{self.typeName}: {self.message}')
+
+
+def applyWorkerEnvironment(surveyGDB, outputCRS, geographicTransformations):
+    '''Gives a worker process the arcpy environment the loader gives its own, once, as the process starts'''
+    arcpy.env.workspace = surveyGDB
+    arcpy.env.outputCoordinateSystem = arcpy.SpatialReference(outputCRS)
+    arcpy.env.geographicTransformations = geographicTransformations
+
+
+def appendTable(task, messages):
+    '''Appends one replica table, adding its messages to messages rather than reporting them, and raising any error'''
+    messages.append(f'Appending data from table [{task.table}] to destination table [{task.destinationFC}]...')
+    arcpy.management.Append(task.table, task.destinationFC, 'NO_TEST', fieldMappingsOf(task.table, task.compiledFieldMap))
+    messages.append(f'Done Appending data from table [{task.table}] to destination table [{task.destinationFC}]')
+    return AppendResult(task.table, messages)
+
+
+def appendTableInWorker(task):
+    '''Appends one replica table in a worker process, returning its messages and any failure'''
+    # In a worker process there is no Messenger to hear from, and arcpy errors don't survive pickling, so what happened is carried back to the parent.
+    messages = []
+    try:
+        return appendTable(task, messages)
+    except Exception as ex:
+        return AppendResult(task.table, messages, AppendFailure(ex))
+
+
+def workerProcessContext():
+    # Inside ArcGIS Pro, sys.executable is the application, so workers are started with the Python it runs on instead.
+    context = multiprocessing.get_context('spawn')
+    if not os.path.basename(sys.executable).lower().startswith('python'):
+        context.set_executable(os.path.join(sys.exec_prefix, 'pythonw.exe' if os.name == 'nt' else 'python'))
+    return context
+
+
+class AppendScheduler:
+    '''Runs append tasks once the tables they wait on are appended, on a pool of worker processes, or in this process given one worker.
+
+    In this process, appends use the arcpy environment already applied; each worker process applies its own copy of it.
+
+    Results are yielded in the order appends finish, so the caller can carry on with a table while others are appended.
+    In this process, a failed append raises its error as is; a worker's failure is yielded, for the caller to rebuild and raise.
+    '''
+
+    def __init__(self, workerCount, surveyGDB, outputCRS, geographicTransformations):
+        self.workerCount = max(1, workerCount)
+        self.environment = (surveyGDB, outputCRS, geographicTransformations)
+
+    def run(self, tasks, dependencies):
+        if self.workerCount == 1:
+            yield from self.runInProcess(tasks, dependencies)
+        else:
+            yield from self.runInPool(tasks, dependencies)
+
+    def readyTables(self, tasks, dependencies, started, appended):
+        return [table for table in tasks.keys() if table not in started and all(parent in appended for parent in dependencies.get(table, []))]
+
+    def raiseIfUnfinished(self, tasks, started):
+        if len(started) < len(tasks):
+            raise Exception(f'Tables {sorted(set(tasks.keys()) - started)} wait on each other, so cannot be appended')
+
+    def runInProcess(self, tasks, dependencies):
+        started = set()
+        appended = set()
+        ready = self.readyTables(tasks, dependencies, started, appended)
+        while len(ready) > 0:
+            started.add(ready[0])
+            result = appendTable(tasks[ready[0]], [])
+            appended.add(result.table)
+            yield result
+            ready = self.readyTables(tasks, dependencies, started, appended)
+        self.raiseIfUnfinished(tasks, started)
+
+    def runInPool(self, tasks, dependencies):
+        started = set()
+        appended = set()
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.workerCount, mp_context=workerProcessContext(), \
+                    initializer=applyWorkerEnvironment, initargs=self.environment)
+        try:
+            running = self.submitReady(pool, tasks, dependencies, started, appended)
+            while len(running) > 0:
+                finished, running = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                results = [future.result() for future in finished]
+                appended.update(result.table for result in results if result.failure == None)
+
+                # Tables freed by these appends start before the results are handed back, keeping the workers busy.
+                running |= self.submitReady(pool, tasks, dependencies, started, appended)
+                for result in results:
+                    yield result
+            self.raiseIfUnfinished(tasks, started)
+        finally:
+            # Should the caller stop on a failed append, tables not yet started are left alone, and those
+            # under way are waited on, so none is still writing when the failed run's appends are cleaned up.
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def submitReady(self, pool, tasks, dependencies, started, appended):
+        submitted = set()
+        for table in self.readyTables(tasks, dependencies, started, appended):
+            started.add(table)
+            submitted.add(pool.submit(appendTableInWorker, tasks[table]))
+        return submitted
@@ -10,10 +10,16 @@
 import support.time as time
 from support.messenger import Messenger
 import arcpy
+import os
 
 def __reload__(state):
     ArcpyProxy().reset()
 
+
+def matchesPrefix(table, prefix):
+    #The full table name (i.e. GDB.SCHEMA.NAME) may be given, so the prefix is in the last part
+    return prefix == '' or table.split('.')[-1].split('_')[0] == prefix
+
 class ArcpyProxy():
     _instance = None
 
@@ -107,15 +113,78 @@ class ArcpyProxy():
         if tables != None:
             allTables.extend(tables)
         
-        outTables = []
-        for t in allTables:
-            tableName = t.split('.')[-1]
-            nameParts = tableName.split('_')
-            if '__ATTACH' not in t:
-                if nameParts[0] == prefix or prefix == '':
-                    outTables.append(t)
-
-        return outTables
+        return [t for t in allTables if '__ATTACH' not in t and matchesPrefix(t, prefix)]
+
+    def getLastSynchronizationTime(self, sdeConnection, tableList):
+        '''Returns the latest SYS_TRANSFER_DATE across the destination tables, or None if none has been synchronised'''
+        if len(tableList) == 0:
+            return None
+
+        self.messenger.indent()
+
+        lastSync = None
+        tablesToScan = tableList
+        if not sdeConnection.endswith('.gdb'):
+            # Appends to a versioned table sit in its delta tables, unseen by SQL against the base table, so it is read through arcpy.
+            tablesToScan = [table for table in tableList if self.isVersioned(sdeConnection, table)]
+            tablesToQuery = [table for table in tableList if table not in tablesToScan]
+            if len(tablesToQuery) > 0:
+                lastSync, answered = self.queryLastSynchronizationTime(sdeConnection, tablesToQuery)
+                if not answered:
+                    tablesToScan = tableList
+
+        scannedSync = self.scanLastSynchronizationTime(sdeConnection, tablesToScan)
+        if lastSync == None or (scannedSync != None and scannedSync > lastSync):
+            lastSync = scannedSync
+
+        self.messenger.outdent()
+        return lastSync
+
+    def isVersioned(self, sdeConnection, table):
+        return arcpy.Describe(os.path.join(sdeConnection, table)).isVersioned
+
+    def queryLastSynchronizationTime(self, sdeConnection, tableList):
+        '''Asks the enterprise database for every table's maximum in one statement, answering (lastSync, True), or (None, False) if it could not'''
+        maxima = ' UNION ALL '.join([f'SELECT MAX(SYS_TRANSFER_DATE) AS sync_date FROM {table}' for table in tableList])
+        statement = f'SELECT MAX(sync_date) FROM ({maxima}) maxima'
+        self.messenger.debug(f'Querying last synchronisation time across [{len(tableList)}] tables in one statement')
+
+        try:
+            result = arcpy.ArcSDESQLExecute(sdeConnection).execute(statement)
+            return self.timestampOf(result), True
+        except Exception as ex:
+            self.messenger.warn(f'Could not query last synchronisation time directly [{ex}]. Scanning tables instead.')
+            return None, False
+
+    def timestampOf(self, result):
+        # A NULL maximum (or an empty result) comes back as None, True or an empty list, depending on the database.
+        while isinstance(result, list) and len(result) > 0:
+            result = result[0]
+        if result == None or result == True or result == []:
+            return None
+        if isinstance(result, str):
+            return time.fromTimestampText(result)
+        return result
+
+    def scanLastSynchronizationTime(self, sdeConnection, tableList):
+        '''Reads the newest SYS_TRANSFER_DATE of each table from the top of a descending, index-ordered cursor'''
+        originalWorkspace = arcpy.env.workspace
+        arcpy.env.workspace = sdeConnection
+
+        lastSync = None
+        for table in tableList:
+            self.messenger.debug(f'Checking sync on table [{table}]')
+            #Just use the last part of the table name
+            tableName = table.split(".")[-1]
+            with arcpy.da.SearchCursor(tableName, ['SYS_TRANSFER_DATE'], where_clause='SYS_TRANSFER_DATE IS NOT NULL', \
+                                       sql_clause=(None, 'ORDER BY SYS_TRANSFER_DATE DESC')) as rows:
+                for row in rows:
+                    if lastSync == None or row[0] > lastSync:
+                        lastSync = row[0]
+                    break
+
+        arcpy.env.workspace = originalWorkspace
+        return lastSync
 
     def GetMessages(self, severity):
         return arcpy.GetMessages(severity)
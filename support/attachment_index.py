@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: support/attachment_index.py
+# Purpose: To remember the content of attachments already stored in a destination, so repeats need not be stored again
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+from support.parameters import *
+from support.messenger import Messenger
+
+import hashlib
+import os
+import sqlite3
+
+ATTACHMENT_INDEX_FILE = 'attachment_index.sqlite'
+
+SCHEMA = [
+'''
+CREATE TABLE IF NOT EXISTS contents (
+    destination TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    attachment_table TEXT NOT NULL,
+    attachment_id INTEGER NOT NULL,
+    data_size INTEGER NOT NULL,
+    PRIMARY KEY (destination, content_hash)
+)
+''',
+'''
+CREATE TABLE IF NOT EXISTS attachment_references (
+    destination TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    rel_globalid TEXT NOT NULL,
+    att_name TEXT
+)
+'''
+]
+
+
+def attachmentHashOf(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class AttachmentIndex:
+    '''Content hashes of the attachments stored in one destination, with where each is stored, and the duplicates that refer to them.
+
+    What a run adds is held back until commit(), called once the load has succeeded, as appends that fail are removed again.
+    Without a cache directory, the index covers the current run only.
+    '''
+
+    def __init__(self, destination, cacheDirectory=None):
+        self.messenger = Messenger()
+        self.destination = os.path.normcase(os.path.abspath(destination))
+        self.stateFile = None if not cacheDirectory else os.path.join(cacheDirectory, ATTACHMENT_INDEX_FILE)
+        self.connection = None
+        self.seen = set()
+        self.stored = {}
+        self.references = []
+
+    def connect(self):
+        if self.stateFile == None:
+            return None
+        if self.connection == None:
+            os.makedirs(os.path.dirname(self.stateFile), exist_ok=True)
+            self.connection = sqlite3.connect(self.stateFile)
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+        return self.connection
+
+    def seenThisRun(self, contentHash):
+        return contentHash in self.seen
+
+    def storedCopyOf(self, contentHash):
+        '''Returns (attachment table, attachment id) of the copy stored by an earlier run, or None'''
+        connection = self.connect()
+        if connection == None:
+            return None
+        return connection.execute('SELECT attachment_table, attachment_id FROM contents WHERE destination = ? AND content_hash = ?', \
+            [self.destination, contentHash]).fetchone()
+
+    def forget(self, contentHash):
+        # The stored copy is gone from the destination, so the next attachment with this content is stored afresh.
+        connection = self.connect()
+        if connection != None:
+            with connection:
+                connection.execute('DELETE FROM contents WHERE destination = ? AND content_hash = ?', [self.destination, contentHash])
+
+    def markSeen(self, contentHash):
+        self.seen.add(contentHash)
+
+    def recordStored(self, contentHash, attachmentTable, attachmentId, dataSize):
+        self.stored[contentHash] = [attachmentTable, attachmentId, dataSize]
+
+    def recordReference(self, contentHash, relGlobalId, attachmentName):
+        self.references.append([contentHash, relGlobalId, attachmentName])
+
+    def referencedCopies(self):
+        '''Returns [REL_GLOBALID, attachment name, attachment table, attachment id] for each duplicate this run referred to a stored copy'''
+        referencedCopies = []
+        for contentHash, relGlobalId, attachmentName in self.references:
+            storedCopy = self.stored.get(contentHash, None)
+            storedCopy = storedCopy[:2] if storedCopy != None else self.storedCopyOf(contentHash)
+            if storedCopy == None:
+                self.messenger.warn(f'No stored copy found for the attachment [{attachmentName}] of [{relGlobalId}]. Its reference is dropped.')
+                continue
+            referencedCopies.append([relGlobalId, attachmentName] + list(storedCopy))
+        return referencedCopies
+
+    def commit(self):
+        '''Writes what this run stored and referenced to the index, in a single transaction'''
+        connection = self.connect()
+        if connection != None:
+            with connection:
+                connection.executemany('INSERT OR REPLACE INTO contents (destination, content_hash, attachment_table, attachment_id, data_size) VALUES (?, ?, ?, ?, ?)', \
+                    [[self.destination, contentHash] + stored for contentHash, stored in self.stored.items()])
+                connection.executemany('INSERT INTO attachment_references (destination, content_hash, rel_globalid, att_name) VALUES (?, ?, ?, ?)', \
+                    [[self.destination] + reference for reference in self.references])
+            self.messenger.debug(f'Indexed [{len(self.stored)}] attachments stored, and [{len(self.references)}] duplicates referring to them')
+
+        self.stored = {}
+        self.references = []
+
+    def close(self):
+        if self.connection != None:
+            self.connection.close()
+            self.connection = None
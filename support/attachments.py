@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: support/attachments.py
+# Purpose: To fetch survey attachments by URL, concurrently, into a temp FGDB
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+from support.parameters import *
+from support.messenger import Messenger
+from support.session import HttpSession
+from support.downloader import isRecoverable, IncompleteDownloadError, describeTransfer, MAX_RETRY_WAIT_SECONDS, DEFAULT_DOWNLOAD_RETRIES
+import support.metrics as metrics
+import support.time as time
+
+import concurrent.futures
+import os
+import urllib, urllib.parse
+
+import arcpy
+
+# Metric names
+
+ATTACHMENT_COUNT = 'AttachmentsFetched'
+ATTACHMENT_BYTES = 'AttachmentBytesFetched'
+
+DEFAULT_ATTACHMENT_WORKERS = 8
+
+# Downloads in flight or awaiting insertion, per worker, bounding the attachments held in memory at once.
+DOWNLOADS_AHEAD_PER_WORKER = 2
+
+ATTACHMENT_TABLE_SUFFIX = '__ATTACH'
+ATTACHMENT_FIELDS = ['REL_GLOBALID', 'CONTENT_TYPE', 'ATT_NAME', 'DATA_SIZE', 'DATA']
+
+
+def withToken(url, token):
+    separator = '&' if urllib.parse.urlsplit(url).query != '' else '?'
+    return f'{url}{separator}token={token}'
+
+
+class AttachmentFetcher:
+    '''Downloads the attachments of a survey layer on a bounded thread pool, writing them to the layer's __ATTACH table'''
+
+    def __init__(self, parametersSupplied):
+        self.messenger = Messenger()
+        self.session = HttpSession()
+        self.parameters = parametersSupplied
+        self.workerCount = max(1, intParameter(parametersSupplied, ATTACHMENT_WORKERS, DEFAULT_ATTACHMENT_WORKERS))
+        self.maxRetries = intParameter(parametersSupplied, DOWNLOAD_RETRIES, DEFAULT_DOWNLOAD_RETRIES)
+
+    def withContext(self, context):
+        self.context = context
+        return self
+
+    def fetchInto(self, surveyGDB, tableName, layerUrl, whereClause, token):
+        attachmentInfos = self.queryAttachmentInfos(layerUrl, whereClause, token)
+
+        self.messenger.info(f'Fetching [{len(attachmentInfos)}] attachments for [{tableName}] with [{self.workerCount}] concurrent downloads...')
+        self.messenger.indent()
+
+        featureClass = os.path.join(surveyGDB, tableName)
+        attachmentTable = f'{featureClass}{ATTACHMENT_TABLE_SUFFIX}'
+        if not arcpy.Exists(attachmentTable):
+            arcpy.management.EnableAttachments(featureClass)
+
+        bytesFetched = 0
+        startTime = time.monotonicSeconds()
+
+        # Downloads run concurrently; cursor writes stay on this thread, as arcpy cursors are not thread-safe.
+        # Only a window of downloads is submitted at a time, and each is let go once inserted, so memory stays bounded.
+        windowSize = self.workerCount * DOWNLOADS_AHEAD_PER_WORKER
+        pendingInfos = iter(attachmentInfos)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workerCount) as pool,\
+             arcpy.da.InsertCursor(attachmentTable, ATTACHMENT_FIELDS) as rows:
+            downloads = set()
+            while True:
+                for info in pendingInfos:
+                    downloads.add(pool.submit(self.fetchAttachment, info, token))
+                    if len(downloads) >= windowSize:
+                        break
+                if len(downloads) == 0:
+                    break
+
+                finished, downloads = concurrent.futures.wait(downloads, return_when=concurrent.futures.FIRST_COMPLETED)
+                for download in finished:
+                    info, data = download.result()
+                    rows.insertRow([info['parentGlobalId'], info.get('contentType', None), info['name'], len(data), data])
+                    bytesFetched += len(data)
+                    self.messenger.debug(f'Attachment [{info["name"]}] of [{info["parentGlobalId"]}] stored, [{len(data)}] bytes')
+                del finished
+
+        metrics.accumulate(self.context, ATTACHMENT_COUNT, len(attachmentInfos))
+        metrics.accumulate(self.context, ATTACHMENT_BYTES, bytesFetched)
+
+        self.messenger.outdent()
+        self.messenger.info(f'Fetched attachments for [{tableName}]: {describeTransfer(bytesFetched, time.monotonicSeconds() - startTime)}')
+
+    def queryAttachmentInfos(self, layerUrl, whereClause, token):
+        '''Lists the attachments of the layer's matching features, paging until the server has no more to report'''
+        # See: https://developers.arcgis.com/rest/services-reference/enterprise/query-attachments-feature-service-layer/
+        attachmentInfos = []
+        while True:
+            queryParameters = urllib.parse.urlencode({
+                'definitionExpression': whereClause or '1=1',
+                'returnUrl': 'true',
+                'resultOffset': len(attachmentInfos),
+                'f': 'json',
+                'token': token
+            }).encode('utf-8')
+            response = self.session.getJson(f'{layerUrl}/queryAttachments', queryParameters)
+
+            if 'error' in response.keys():
+                raise Exception(f'Querying attachments at [{layerUrl}] failed: [{response["error"]}]')
+
+            pageInfos = []
+            for group in response.get('attachmentGroups', []):
+                for info in group.get('attachmentInfos', []):
+                    info.setdefault('parentGlobalId', group['parentGlobalId'])
+                    pageInfos.append(info)
+            attachmentInfos.extend(pageInfos)
+
+            if not response.get('exceededTransferLimit', False):
+                return attachmentInfos
+            if len(pageInfos) == 0:
+                raise Exception(f'Querying attachments at [{layerUrl}] reported more records past offset [{len(attachmentInfos)}], but returned none')
+
+    def fetchAttachment(self, info, token):
+        '''Returns the attachment info and its bytes, retrying recoverable failures and bodies whose size differs from the size reported'''
+        attempt = 0
+        while True:
+            try:
+                with self.session.open(withToken(info['url'], token)) as response:
+                    data = response.read()
+                self.checkSizeReported(info, data)
+                return info, data
+            except Exception as ex:
+                if not (isRecoverable(ex) or isinstance(ex, IncompleteDownloadError)):
+                    raise
+                attempt += 1
+                if attempt > self.maxRetries:
+                    raise
+                time.sleep(min(2 ** attempt, MAX_RETRY_WAIT_SECONDS))
+
+    def checkSizeReported(self, info, data):
+        # queryAttachments reports each attachment's size, but no digest, so size is all a download can be checked against.
+        if info.get('size', None) != None and len(data) != info['size']:
+            raise IncompleteDownloadError(f'Attachment [{info["name"]}] arrived with [{len(data)}] bytes, expected [{info["size"]}]')
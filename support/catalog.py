@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: support/catalog.py
+# Purpose: To describe each workspace once per run, rather than on every step that asks
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+from support.messenger import Messenger
+import support.arcpy_proxy as arcpy_proxy
+
+import os
+import arcpy
+
+# Context keys
+
+CATALOG = 'WorkspaceCatalog'
+
+
+def catalogOf(context):
+    '''Returns the run's workspace catalog, held in the shared context'''
+    if CATALOG not in context.keys():
+        context[CATALOG] = WorkspaceCatalog()
+    return context[CATALOG]
+
+
+class WorkspaceSnapshot():
+    '''What one workspace holds, each part read from arcpy the first time it is asked for'''
+
+    def __init__(self, workspace):
+        self.workspace = workspace
+        self.tables = {}
+        self.descriptions = {}
+        self.fields = {}
+
+
+class WorkspaceCatalog():
+    '''Snapshots of the tables, descriptions, fields, domains and relationship classes of each workspace touched in a run.
+
+    Any step that changes a workspace's schema must invalidate it, or the table it changed, so the next reader sees the change.
+    '''
+
+    def __init__(self):
+        self.messenger = Messenger()
+        self.arcpyProxy = arcpy_proxy.ArcpyProxy()
+        self.snapshots = {}
+
+    def keyOf(self, workspace):
+        return os.path.normcase(os.path.normpath(workspace))
+
+    def snapshotOf(self, workspace):
+        key = self.keyOf(workspace)
+        if key not in self.snapshots.keys():
+            self.messenger.debug(f'Cataloguing workspace [{workspace}]')
+            self.snapshots[key] = WorkspaceSnapshot(workspace)
+        return self.snapshots[key]
+
+    def invalidate(self, workspace, table=None):
+        '''Forgets what was read of workspace, or of just one of its tables'''
+        if table == None:
+            self.snapshots.pop(self.keyOf(workspace), None)
+            return
+        snapshot = self.snapshotOf(workspace)
+        snapshot.descriptions.pop(table, None)
+        snapshot.fields.pop(table, None)
+
+    def surveyTables(self, workspace, prefix=''):
+        # Listed per prefix, keeping the wildcard that spares listing every table of a large enterprise geodatabase.
+        snapshot = self.snapshotOf(workspace)
+        if prefix not in snapshot.tables.keys():
+            snapshot.tables[prefix] = self.arcpyProxy.getSurveyTables(workspace, prefix)
+        return list(snapshot.tables[prefix])
+
+    def description(self, workspace):
+        return self.describe(workspace, None)
+
+    def describe(self, workspace, name):
+        '''Describes the workspace itself where name is None, otherwise the dataset name within it'''
+        snapshot = self.snapshotOf(workspace)
+        if name not in snapshot.descriptions.keys():
+            snapshot.descriptions[name] = arcpy.Describe(workspace if name == None else os.path.join(workspace, name))
+        return snapshot.descriptions[name]
+
+    def datatypeOf(self, workspace, table):
+        return self.describe(workspace, table).datatype
+
+    def domainsOf(self, workspace):
+        return self.description(workspace).domains
+
+    def relationshipClasses(self, workspace, prefix=''):
+        '''Returns the description of every relationship class in workspace whose name carries prefix'''
+        # Filtering by name first spares describing the unrelated relationship classes of a shared enterprise geodatabase.
+        return [self.describe(workspace, child.name) for child in self.description(workspace).children \
+                    if child.datatype == u'RelationshipClass' and arcpy_proxy.matchesPrefix(child.name, prefix)]
+
+    def fieldsOf(self, workspace, table):
+        snapshot = self.snapshotOf(workspace)
+        if table not in snapshot.fields.keys():
+            snapshot.fields[table] = arcpy.ListFields(os.path.join(workspace, table))
+        return snapshot.fields[table]
+
+    def fieldNamesOf(self, workspace, table):
+        return [field.name for field in self.fieldsOf(workspace, table)]
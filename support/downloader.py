@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: support/downloader.py
+# Purpose: To stream large HTTP responses to disk in fixed-size chunks
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+from support.parameters import *
+from support.messenger import Messenger
+from support.session import HttpSession
+import support.time as time
+
+import hashlib
+import http.client
+import io
+import os
+import re
+import socket
+import tempfile
+import urllib, urllib.error
+
+DEFAULT_DOWNLOAD_CHUNK_KB = 1024
+DEFAULT_DOWNLOAD_RETRIES = 5
+PROGRESS_REPORT_SECONDS = 5
+MAX_RETRY_WAIT_SECONDS = 30
+
+PARTIAL_FILE_SUFFIX = '.part'
+
+BYTES_PER_MB = 1024 * 1024
+
+HTTP_PARTIAL_CONTENT = 206
+HTTP_RANGE_NOT_SATISFIABLE = 416
+
+RETRYABLE_HTTP_CODES = [408, 429, HTTP_RANGE_NOT_SATISFIABLE]
+
+class IncompleteDownloadError(Exception):
+    '''Raised when a download finishes with fewer or more bytes than the server advertised'''
+
+
+class TruncatedDownloadError(IncompleteDownloadError):
+    '''Raised when the server closes the connection cleanly before sending all the bytes it advertised'''
+
+
+RECOVERABLE_ERRORS = (
+    TruncatedDownloadError,
+    urllib.error.URLError,
+    http.client.HTTPException,
+    ConnectionError,
+    socket.timeout,
+    TimeoutError
+)
+
+
+def describeTransfer(byteCount, elapsedSeconds):
+    megabytes = byteCount / BYTES_PER_MB
+    rate = megabytes / elapsedSeconds if elapsedSeconds > 0 else 0.0
+    return f'[{megabytes:.1f}] MB at [{rate:.2f}] MB/s'
+
+
+def isRecoverable(exception):
+    # Client errors (bad token, missing replica) won't be cured by asking again.
+    if isinstance(exception, urllib.error.HTTPError):
+        return exception.code >= 500 or exception.code in RETRYABLE_HTTP_CODES
+    return isinstance(exception, RECOVERABLE_ERRORS)
+
+
+def totalFromContentRange(contentRange):
+    # e.g. 'bytes 200-1000/1001' or 'bytes */1001'
+    if contentRange == None:
+        return None
+    match = re.match(r'bytes\s+(?:\d+-\d+|\*)/(\d+)', contentRange.strip())
+    if match == None:
+        return None
+    return int(match.group(1))
+
+
+class StreamingDownloader:
+    def __init__(self, parametersSupplied):
+        self.messenger = Messenger()
+        self.session = HttpSession()
+        self.parameters = parametersSupplied
+        self.chunkBytes = intParameter(parametersSupplied, DOWNLOAD_CHUNK_KB, DEFAULT_DOWNLOAD_CHUNK_KB) * 1024
+        self.maxRetries = intParameter(parametersSupplied, DOWNLOAD_RETRIES, DEFAULT_DOWNLOAD_RETRIES)
+        self.scratchDirectory = parametersSupplied.get(SCRATCH_DIRECTORY, None) or tempfile.gettempdir()
+
+        if self.chunkBytes <= 0:
+            raise SystemExit(f"Parameter [{DOWNLOAD_CHUNK_KB}] must be positive, but [{self.chunkBytes // 1024}] was supplied")
+
+    def partialFilePath(self, resumeKey):
+        '''The partial file lives in the scratch directory under a name derived from resumeKey, so a retry within this download can find it again'''
+        digest = hashlib.sha1(resumeKey.encode('utf-8')).hexdigest()
+        return os.path.join(self.scratchDirectory, f'resync_{digest}{PARTIAL_FILE_SUFFIX}')
+
+    def download(self, url, outFile, resumeKey=None):
+        '''
+        Streams the response body of url into outFile, holding no more than one chunk in memory.
+        Interrupted transfers are resumed from the partial file with HTTP Range requests, and the partial file
+        is deleted should the download finally fail, as each replica job has its own URL and will never resume it.
+        resumeKey identifies the partial file (defaults to url); keep secrets such as tokens out of it.
+        '''
+        partialFile = self.partialFilePath(resumeKey if resumeKey != None else url)
+
+        attempt = 0
+        while True:
+            try:
+                bytesExpected = self.downloadRemainder(url, partialFile)
+                break
+            except RECOVERABLE_ERRORS as ex:
+                if not isRecoverable(ex):
+                    self.removePartial(partialFile)
+                    raise
+                attempt += 1
+                if attempt > self.maxRetries:
+                    self.messenger.error(f'Download failed after [{self.maxRetries}] retries. Deleting partial file [{partialFile}].')
+                    self.removePartial(partialFile)
+                    raise
+                waitSeconds = min(2 ** attempt, MAX_RETRY_WAIT_SECONDS)
+                self.messenger.warn(f'Download interrupted [{ex}] with [{self.partialSize(partialFile)}] bytes saved. Resuming in [{waitSeconds}] seconds (retry {attempt} of {self.maxRetries})...')
+                time.sleep(waitSeconds)
+
+        bytesWritten = self.partialSize(partialFile)
+        if bytesExpected != None and bytesWritten > bytesExpected:
+            self.removePartial(partialFile)
+            raise IncompleteDownloadError(f'Downloaded [{bytesWritten}] bytes, but server advertised [{bytesExpected}] bytes for [{outFile}]')
+
+        os.replace(partialFile, outFile)
+        return bytesWritten
+
+    def removePartial(self, partialFile):
+        if os.path.exists(partialFile):
+            os.remove(partialFile)
+
+    def openResumable(self, url):
+        '''
+        Opens url as a stream that reconnects with HTTP Range requests from the bytes already read, should the connection drop.
+        Nothing read is written to disk; only the count of bytes read is kept, to resume from.
+        '''
+        return ResumableStream(self, url)
+
+    def partialSize(self, partialFile):
+        if not os.path.exists(partialFile):
+            return 0
+        return os.path.getsize(partialFile)
+
+    def downloadRemainder(self, url, partialFile):
+        '''Fetches whatever partialFile is still missing, returning the total size the server advertised (if any)'''
+        offset = self.partialSize(partialFile)
+
+        headers = {}
+        if offset > 0:
+            headers['Range'] = f'bytes={offset}-'
+            self.messenger.info(f'Resuming download from byte [{offset}]')
+
+        try:
+            response = self.session.open(url, headers=headers)
+        except urllib.error.HTTPError as ex:
+            if ex.code == HTTP_RANGE_NOT_SATISFIABLE:
+                # The partial file may already hold everything there is.
+                bytesExpected = totalFromContentRange(ex.headers.get('Content-Range'))
+                if bytesExpected == offset:
+                    return bytesExpected
+                self.messenger.warn(f'Partial file [{partialFile}] does not match the server copy. Restarting download.')
+                os.remove(partialFile)
+            raise
+
+        if offset > 0 and response.status != HTTP_PARTIAL_CONTENT:
+            self.messenger.warn(f'Server ignored range request (status [{response.status}]). Restarting download.')
+            offset = 0
+
+        bytesExpected = totalFromContentRange(response.headers.get('Content-Range'))
+        if bytesExpected == None and response.headers.get('Content-Length') != None:
+            bytesExpected = offset + int(response.headers.get('Content-Length'))
+
+        self.streamToFile(response, partialFile, offset)
+
+        # A connection closed early but cleanly reads as a short body, not an error; the partial file is resumed from.
+        bytesWritten = self.partialSize(partialFile)
+        if bytesExpected != None and bytesWritten < bytesExpected:
+            raise TruncatedDownloadError(f'Connection closed after [{bytesWritten}] of [{bytesExpected}] advertised bytes')
+        return bytesExpected
+
+    def streamToFile(self, response, outFile, offset=0):
+        self.messenger.debug(f'Streaming response to [{outFile}] in [{self.chunkBytes // 1024}] KB chunks')
+
+        buffer = bytearray(self.chunkBytes)
+        view = memoryview(buffer)
+
+        bytesWritten = 0
+        startTime = time.monotonicSeconds()
+        lastReportTime = startTime
+
+        with open(outFile, 'r+b' if offset > 0 else 'wb') as output:
+            output.seek(offset)
+            output.truncate()
+            while True:
+                bytesRead = response.readinto(buffer)
+                if not bytesRead:
+                    break
+                output.write(view[:bytesRead])
+                bytesWritten += bytesRead
+
+                now = time.monotonicSeconds()
+                if now - lastReportTime >= PROGRESS_REPORT_SECONDS:
+                    self.messenger.info(f'Downloaded {describeTransfer(bytesWritten, now - startTime)}...')
+                    lastReportTime = now
+
+        elapsedSeconds = time.monotonicSeconds() - startTime
+        self.messenger.info(f'Downloaded {describeTransfer(bytesWritten, elapsedSeconds)} in [{elapsedSeconds:.1f}] seconds')
+
+        return bytesWritten
+
+
+class ResumableStream:
+    '''Reads a response, reconnecting from the offset already read when the connection drops'''
+
+    def __init__(self, downloader, url):
+        self.downloader = downloader
+        self.messenger = downloader.messenger
+        self.url = url
+        self.bytesRead = 0
+        self.bytesExpected = None
+        self.response = None
+        self.finished = False
+
+    def readinto(self, buffer):
+        if self.finished:
+            return 0
+
+        attempt = 0
+        while True:
+            try:
+                bytesReceived = self.receiveInto(buffer)
+                break
+            except RECOVERABLE_ERRORS as ex:
+                self.closeResponse()
+                if not isRecoverable(ex):
+                    raise
+                attempt += 1
+                if attempt > self.downloader.maxRetries:
+                    self.messenger.error(f'Stream failed after [{self.downloader.maxRetries}] retries, with [{self.bytesRead}] bytes read.')
+                    raise
+                waitSeconds = min(2 ** attempt, MAX_RETRY_WAIT_SECONDS)
+                self.messenger.warn(f'Stream interrupted [{ex}] after [{self.bytesRead}] bytes. Reconnecting in [{waitSeconds}] seconds (retry {attempt} of {self.downloader.maxRetries})...')
+                time.sleep(waitSeconds)
+
+        if not bytesReceived:
+            self.finished = True
+            return 0
+
+        self.bytesRead += bytesReceived
+        return bytesReceived
+
+    def receiveInto(self, buffer):
+        if self.response == None:
+            if self.bytesExpected != None and self.bytesRead >= self.bytesExpected:
+                return 0
+            self.connect()
+
+        bytesReceived = self.response.readinto(buffer)
+        if not bytesReceived and self.bytesExpected != None and self.bytesRead < self.bytesExpected:
+            # A connection closed early but cleanly reads as a short body, not an error; reconnecting resumes it.
+            raise TruncatedDownloadError(f'Connection closed after [{self.bytesRead}] of [{self.bytesExpected}] advertised bytes')
+        return bytesReceived
+
+    def connect(self):
+        offset = self.bytesRead
+
+        headers = {}
+        if offset > 0:
+            headers['Range'] = f'bytes={offset}-'
+            self.messenger.info(f'Resuming stream from byte [{offset}]')
+
+        try:
+            self.response = self.downloader.session.open(self.url, headers=headers)
+        except urllib.error.HTTPError as ex:
+            if ex.code == HTTP_RANGE_NOT_SATISFIABLE and totalFromContentRange(ex.headers.get('Content-Range')) == offset:
+                # Everything there is has already been read.
+                self.bytesExpected = offset
+                self.response = io.BytesIO()
+                return
+            raise
+
+        if offset > 0 and self.response.status != HTTP_PARTIAL_CONTENT:
+            self.messenger.warn(f'Server ignored range request (status [{self.response.status}]). Skipping the [{offset}] bytes already read.')
+            self.skip(offset)
+            offset = 0
+
+        self.bytesExpected = totalFromContentRange(self.response.headers.get('Content-Range'))
+        if self.bytesExpected == None and self.response.headers.get('Content-Length') != None:
+            self.bytesExpected = offset + int(self.response.headers.get('Content-Length'))
+
+    def skip(self, byteCount):
+        buffer = bytearray(min(byteCount, self.downloader.chunkBytes))
+        while byteCount > 0:
+            bytesSkipped = self.response.readinto(memoryview(buffer)[:min(byteCount, len(buffer))])
+            if not bytesSkipped:
+                raise TruncatedDownloadError(f'Connection closed with [{byteCount}] of the bytes already read still to skip')
+            byteCount -= bytesSkipped
+
+    def closeResponse(self):
+        if self.response != None:
+            self.response.close()
+            self.response = None
+
+    def close(self):
+        self.closeResponse()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, exception_traceback):
+        self.close()
@@ -10,12 +10,26 @@
 
 from support.parameters import *
 from support.messenger import Messenger
+from support.downloader import StreamingDownloader, isRecoverable, DEFAULT_DOWNLOAD_CHUNK_KB
+from support.unzipper import StreamingUnzipper, UnsupportedZipStreamError, CorruptZipStreamError, TruncatedZipStreamError
+from support.session import HttpSession
+from support.poller import PollScheduler
+from support.token_cache import TokenCache
+from support.sqlite_replica import SQLiteReplica
+from support.replica_cache import replicaCacheFor
+from support.service_cache import ServiceDefinitionCache
+from support.sync_state import syncStateFor, establishWatermarks, overallWatermarkOf
+from support.attachments import AttachmentFetcher
+from support.catalog import catalogOf
+import support.arcpy_proxy as arcpy_proxy
+import support.metrics as metrics
 import support.time as time
 
+import json
 import os
-import urllib, urllib.parse, urllib.request
+import shutil
+import urllib, urllib.parse
 import getpass
-import json
 import tempfile
 import uuid
 import zipfile
@@ -25,11 +39,32 @@ import arcpy
 # Context keys
 
 TOKEN = 'Token'
+TOKEN_EXPIRY = 'TokenExpiry'
 SERVICE_INFO = 'ServiceInfo'
 SECTION = 'ProcessSection'
+LAST_SYNC_TIME = 'LastSynchronisationTime'
+PROCESS_TIME = 'ProcessTime'
+EXISTING_TABLES = 'ExistingTables'
+REPLICA_LAYERS = 'ReplicaLayers'
+TABLE_WATERMARKS = 'TableWatermarks'
+
+# Metric names
+
+REPLICA_POLL_COUNT = 'ReplicaJobPolls'
+REPLICA_POLL_WAIT_SECONDS = 'ReplicaJobWaitSeconds'
+REPLICA_LAYERS_PRUNED = 'ReplicaLayersPruned'
 
 TOKEN_EXPIRY_MINUTES = 60
-POLL_WAIT_SECONDS = 10
+TOKEN_REFRESH_MARGIN_SECONDS = 120
+
+INVALID_TOKEN_CODES = [498, 499]
+
+DEFAULT_POLL_MAX_WAIT_SECONDS = 30
+DEFAULT_REPLICA_TIMEOUT_MINUTES = 240
+
+MOBILE_GEODATABASE_NAME = 'survey.geodatabase'
+
+DEFAULT_SERVICE_CACHE_MINUTES = 60
 
 from abc import ABC, abstractmethod
 
@@ -61,8 +96,27 @@ class AGOLSurveyReplicator(Extractor):
     def __init__(self, parametersSupplied):
         self.context = {}
         self.messenger = Messenger()
+        self.session = HttpSession()
+        self.arcpyProxy = arcpy_proxy.ArcpyProxy()
         self.parameters = parametersSupplied
 
+        self.attachmentsByUrl = choiceParameter(parametersSupplied, ATTACHMENT_TRANSFER, \
+            [ATTACHMENTS_IN_REPLICA, ATTACHMENTS_BY_URL], ATTACHMENTS_IN_REPLICA) == ATTACHMENTS_BY_URL
+        self.replicaFormat = choiceParameter(parametersSupplied, REPLICA_FORMAT, \
+            [FILEGDB_REPLICA, SQLITE_REPLICA], FILEGDB_REPLICA)
+        self.layersInfo = None
+
+        self.tokenCache = None
+        self.tokenFromCache = False
+        self.serviceCache = None
+        self.serviceInfoRevalidated = True
+        if parametersSupplied.get(CACHE_DIRECTORY, None):
+            self.tokenCache = TokenCache(parametersSupplied[CACHE_DIRECTORY])
+            serviceCacheMinutes = intParameter(parametersSupplied, SERVICE_CACHE_MINUTES, DEFAULT_SERVICE_CACHE_MINUTES)
+            self.serviceCache = ServiceDefinitionCache(parametersSupplied[CACHE_DIRECTORY], serviceCacheMinutes * 60)
+        self.replicaCache = replicaCacheFor(parametersSupplied)
+        self.syncState = syncStateFor(parametersSupplied)
+
     def withContext(self, context):
         self.context = context
         return self
@@ -71,8 +125,27 @@ class AGOLSurveyReplicator(Extractor):
         self.messenger.info(f'Replicating survey at [{self.parameters[SERVICE_URL]}]')
         self.messenger.indent()
 
+        self.establishSynchronisationWatermark()
+
+        cachedReplicaPath = self.retrieveUnloadedReplica()
+        if cachedReplicaPath != None:
+            self.messenger.outdent()
+            self.messenger.info(f'Retrying the load of a cached replica of [{self.parameters[SERVICE_URL]}]')
+            return cachedReplicaPath
+
         self.logIntoSurvey()
-        replicatedSurveyPath = self.downloadSurvey() 
+
+        layerList = []
+        if self.surveyEditedSinceLastSync():
+            layerList = self.selectLayersToReplicate()
+
+        if len(layerList) == 0:
+            self.messenger.outdent()
+            self.messenger.info(f'No changes to survey at [{self.parameters[SERVICE_URL]}] since last synchronisation')
+            return None
+
+        self.context[REPLICA_LAYERS] = layerList
+        replicatedSurveyPath = self.downloadSurvey(layerList) 
 
         self.messenger.outdent()
         self.messenger.info(f'Done replicating survey at [{self.parameters[SERVICE_URL]}]')
@@ -96,24 +169,195 @@ class AGOLSurveyReplicator(Extractor):
         self.messenger.info(f'Service confirmed as having Sync capability.')
         self.messenger.outdent()
 
+    def establishSynchronisationWatermark(self):
+        '''Finds when the destination was last synchronised, so the replica can be limited to newer records'''
+        self.messenger.info(f'Establishing last synchronisation time via [{self.parameters[SDE_CONNECTION]}]')
+        self.messenger.indent()
+
+        existingDestinationTables = catalogOf(self.context).surveyTables(self.parameters[SDE_CONNECTION], self.parameters[PREFIX])
+        self.context[EXISTING_TABLES] = existingDestinationTables
+
+        # The replica is scoped by the earliest table watermark; the transformer trims each table to its own.
+        self.context[TABLE_WATERMARKS] = establishWatermarks(self.syncState, self.arcpyProxy, \
+            self.parameters[SDE_CONNECTION], self.parameters[PREFIX], existingDestinationTables)
+        self.context[LAST_SYNC_TIME] = overallWatermarkOf(self.context[TABLE_WATERMARKS])
+
+        if self.context[LAST_SYNC_TIME] != None:
+            self.messenger.info(f'Last synchronisation time established [{time.createTimestampText(self.context[LAST_SYNC_TIME])}]')
+        else:
+            self.messenger.info(f'No prior synchronisation found. Replicating full survey history.')
+
+        self.messenger.outdent()
+
+    def retrieveUnloadedReplica(self):
+        '''Returns a copy of a replica that failed to load against the current watermark, adopting its process time, or None'''
+        if self.replicaCache == None:
+            return None
+
+        cachedReplica = self.replicaCache.unloadedReplica(self.parameters[SERVICE_URL], self.context[LAST_SYNC_TIME])
+        if cachedReplica == None:
+            return None
+
+        replicaPath, layerList, processTime = cachedReplica
+        self.messenger.info(f'Found an unloaded replica from [{time.createTimestampText(processTime)}] in the replica cache')
+
+        # The replica only holds records created up to its own process time, so timestamps must not claim any later.
+        self.context[PROCESS_TIME] = processTime
+        self.context[REPLICA_LAYERS] = layerList
+        return replicaPath
+
+    def surveyEditedSinceLastSync(self):
+        '''Compares the service's last edit date to the watermark, answering True when unsure'''
+        if self.context.get(LAST_SYNC_TIME, None) == None:
+            return True
+
+        lastEditDate = self.deriveLastEditDate()
+        if lastEditDate == None:
+            self.messenger.debug(f'No last edit date reported by [{self.parameters[SERVICE_URL]}]. Assuming changes.')
+            return True
+
+        lastSyncTime = time.asUTC(self.context[LAST_SYNC_TIME])
+        self.messenger.info(f'Survey last edited [{time.createTimestampText(lastEditDate)}], last synchronised [{time.createTimestampText(lastSyncTime)}]')
+        if lastEditDate <= lastSyncTime and not self.serviceInfoRevalidated:
+            self.messenger.debug(f'Edit date came from a cached service definition that may predate recent edits. Assuming changes.')
+            return True
+        return lastEditDate > lastSyncTime
+
+    def deriveLastEditDate(self):
+        # See: https://developers.arcgis.com/rest/services-reference/enterprise/feature-service/ (editingInfo)
+        editingInfo = self.context[SERVICE_INFO].get('editingInfo', {})
+        lastEditMilliseconds = editingInfo.get('dataLastEditDate', editingInfo.get('lastEditDate', None))
+
+        if lastEditMilliseconds == None:
+            lastEditMilliseconds = self.deriveLastEditDateFromLayers()
+        if lastEditMilliseconds == None:
+            return None
+
+        return time.fromEpochMilliseconds(lastEditMilliseconds)
+
+    def getLayersInfo(self):
+        if self.layersInfo == None:
+            requestUrl = f"{self.parameters[SERVICE_URL]}/layers?f=json&token={self.context[TOKEN]}"
+            self.messenger.debug(f'Requesting layer definitions via [{requestUrl}]')
+            self.layersInfo = self.session.getJson(requestUrl)
+        return self.layersInfo
+
+    def deriveLastEditDateFromLayers(self):
+        layersInfo = self.getLayersInfo()
+        layerDefinitions = layersInfo.get('layers', []) + layersInfo.get('tables', [])
+
+        lastEditDates = [l['editingInfo']['lastEditDate'] for l in layerDefinitions \
+                            if l.get('editingInfo', {}).get('lastEditDate', None) != None]
+        if len(lastEditDates) == 0 or len(lastEditDates) < len(layerDefinitions):
+            return None
+        return max(lastEditDates)
+
+    def selectLayersToReplicate(self):
+        '''Lists the layers and tables to replicate, leaving out those with no records since the last synchronisation'''
+        layerList = [str(l["id"]) for l in self.context[SERVICE_INFO]["layers"]]
+        tableList = [str(t["id"]) for t in self.context[SERVICE_INFO]["tables"]]
+        layerList.extend(tableList)
+
+        # A first run needs every layer to create the destination schema from.
+        if len(self.context.get(EXISTING_TABLES, [])) == 0 or self.context.get(LAST_SYNC_TIME, None) == None:
+            return layerList
+
+        self.messenger.info(f'Counting records per layer since last synchronisation...')
+        self.messenger.indent()
+
+        whereClause = self.generateCreationDateFilter()
+        selectedLayers = []
+        for layerId in layerList:
+            recordCount = self.countRecords(layerId, whereClause)
+            if recordCount == 0:
+                self.messenger.debug(f'Layer [{layerId}] has no new records. Leaving it out of the replica.')
+            else:
+                selectedLayers.append(layerId)
+
+        self.messenger.outdent()
+        self.messenger.info(f'Replicating [{len(selectedLayers)}] of [{len(layerList)}] layers')
+        metrics.record(self.context, REPLICA_LAYERS_PRUNED, len(layerList) - len(selectedLayers))
+
+        return selectedLayers
+
+    def countRecords(self, layerId, whereClause):
+        # See: https://developers.arcgis.com/rest/services-reference/enterprise/query-feature-service-layer/
+        queryParameters = urllib.parse.urlencode({
+            'where': whereClause,
+            'returnCountOnly': 'true',
+            'f': 'json',
+            'token': self.context[TOKEN]
+        })
+        response = self.session.getJson(f'{self.parameters[SERVICE_URL]}/{layerId}/query?{queryParameters}')
+
+        if 'count' not in response.keys():
+            # Better to replicate a layer needlessly than to miss its records.
+            self.messenger.debug(f'No record count for layer [{layerId}] in response [{response}]. Keeping it.')
+            return None
+        return int(response['count'])
+
     def retrieveLoginToken(self):
         self.messenger.info(f'Retrieving login token for [{self.parameters[SERVICE_URL]}]')
         self.messenger.indent()
         
         tokenTest = arcpy.GetSigninToken()
-        token = None
+        tokenResponse = None
         if tokenTest == None:
-            token = self.getPortalToken()
+            tokenResponse = self.getCachedOrPortalToken()
         else:
-            token = tokenTest['token']
+            tokenResponse = tokenTest
             
-        self.context[TOKEN] = token
+        self.context[TOKEN] = tokenResponse['token']
+        self.context[TOKEN_EXPIRY] = self.tokenExpiryOf(tokenResponse)
         self.messenger.info(f'Login token [{self.context[TOKEN]}] retrieved')
         
         self.messenger.outdent()
 
+    def tokenExpiryOf(self, tokenResponse):
+        # generateToken reports expiry in epoch milliseconds, GetSigninToken in epoch seconds.
+        expires = tokenResponse.get('expires', None)
+        if expires == None:
+            return time.epochSeconds() + TOKEN_EXPIRY_MINUTES * 60
+        expires = float(expires)
+        if expires > 1e11:
+            expires = expires / 1000
+        return expires
+
+    def refreshLoginTokenIfExpiring(self):
+        if TOKEN_EXPIRY not in self.context.keys():
+            return
+        if self.context[TOKEN_EXPIRY] - time.epochSeconds() > TOKEN_REFRESH_MARGIN_SECONDS:
+            return
+        self.messenger.info(f'Login token expires within [{TOKEN_REFRESH_MARGIN_SECONDS}] seconds. Refreshing...')
+        self.retrieveLoginToken()
+
+    def getCachedOrPortalToken(self):
+        self.tokenFromCache = False
+        if self.tokenCache == None:
+            return self.getPortalToken()
+
+        portal = self.parameters[PORTAL]
+        username = self.parameters.get(PORTAL_USER_NAME, None)
+
+        cachedResponse = self.tokenCache.get(portal, username)
+        if cachedResponse != None:
+            self.messenger.info(f'Reusing cached login token for [{username}] at [{portal}]')
+            self.tokenFromCache = True
+            return cachedResponse
+
+        tokenResponse = self.getPortalToken()
+        self.tokenCache.put(portal, username, tokenResponse['token'], self.tokenExpiryOf(tokenResponse))
+        return tokenResponse
+
+    def evictCachedToken(self):
+        self.tokenCache.evict(self.parameters[PORTAL], self.parameters.get(PORTAL_USER_NAME, None))
+        self.tokenFromCache = False
+
+    def isInvalidTokenResponse(self, response):
+        return 'error' in response.keys() and response['error'].get('code', None) in INVALID_TOKEN_CODES
+
     def getPortalToken(self):
-        '''Gets a token from ArcGIS Online/Portal with the given username/password'''
+        '''Gets a token response (token and expiry) from ArcGIS Online/Portal with the given username/password'''
         params = self.parameters
         
         tokenURL = f'{params[PORTAL]}/sharing/rest/generateToken?'
@@ -121,24 +365,58 @@ class AGOLSurveyReplicator(Extractor):
         self.messenger.info(f'Requesting login token via [{tokenURL}]')
         
         requestParams = self.generateTokenRequestParams()
-        response = urllib.request.urlopen(tokenURL, requestParams).read()
-        parsedResponse = json.loads(response)
+        parsedResponse = self.session.getJson(tokenURL, requestParams)
         if 'token' in parsedResponse.keys():
-            return parsedResponse['token']
+            return parsedResponse
         
         errorMessage = f'No login token returned from [{tokenURL}] for the credentials supplied'
-        self.messenger.debug(f'Response returned [{response}]')
+        self.messenger.debug(f'Response returned [{parsedResponse}]')
         self.messenger.error(errorMessage)
         raise Exception(errorMessage)
 
     def deriveServiceDefinition(self):
+        cachedEntry = self.getCachedServiceDefinition()
+        # A cached token is only proven good by a request, so it rules out skipping one.
+        if cachedEntry != None and not self.tokenFromCache and self.serviceCache.isUsableWithoutRequest(cachedEntry):
+            self.messenger.info(f'Reusing service definition cached for [{self.parameters[SERVICE_URL]}]')
+            self.context[SERVICE_INFO] = cachedEntry['definition']
+            self.serviceInfoRevalidated = False
+            return
+
+        etag, lastModified = None, None
+        if cachedEntry != None:
+            etag, lastModified = cachedEntry['etag'], cachedEntry['lastModified']
+
         requestUrl = f"{self.parameters[SERVICE_URL]}?f=json&token={self.context[TOKEN]}"
         self.messenger.info(f'Requesting service definition via [{requestUrl}]')
         
-        response = urllib.request.urlopen(requestUrl).read()
-        self.messenger.debug(f'Service definition response [{response}]')
+        serviceInfo, etag, lastModified = self.session.getJsonIfChanged(requestUrl, etag, lastModified)
+        self.serviceInfoRevalidated = True
+
+        if serviceInfo == None:
+            self.messenger.info(f'Service definition unchanged since cached')
+            self.context[SERVICE_INFO] = cachedEntry['definition']
+            self.serviceCache.put(self.parameters[SERVICE_URL], self.parameters.get(PORTAL_USER_NAME, None), cachedEntry['definition'], etag, lastModified)
+            return
+
+        self.context[SERVICE_INFO] = serviceInfo
+
+        if self.tokenFromCache and self.isInvalidTokenResponse(self.context[SERVICE_INFO]):
+            self.messenger.warn(f'Cached login token was rejected by [{self.parameters[SERVICE_URL]}]. Requesting a new one...')
+            self.evictCachedToken()
+            self.retrieveLoginToken()
+            self.deriveServiceDefinition()
+            return
+
+        if self.serviceCache != None and 'error' not in serviceInfo.keys():
+            self.serviceCache.put(self.parameters[SERVICE_URL], self.parameters.get(PORTAL_USER_NAME, None), serviceInfo, etag, lastModified)
 
-        self.context[SERVICE_INFO] = json.loads(response)
+        self.messenger.debug(f'Service definition lists [{len(serviceInfo.get("layers", []))}] layers and [{len(serviceInfo.get("tables", []))}] tables')
+
+    def getCachedServiceDefinition(self):
+        if self.serviceCache == None:
+            return None
+        return self.serviceCache.get(self.parameters[SERVICE_URL], self.parameters.get(PORTAL_USER_NAME, None))
 
     def generateTokenRequestParams(self):
         params = self.parameters
@@ -157,20 +435,22 @@ class AGOLSurveyReplicator(Extractor):
         
         return parameters
 
-    def downloadSurvey(self):
+    def downloadSurvey(self, layerList):
         self.messenger.info(f'Downloading survey replica...')
         self.messenger.indent()
         
-        replicationRequestUrl = self.generateReplicateRequestUrl()
-        resultUrl = self.pollForResponseUrl(replicationRequestUrl)
+        replicaJob = self.generateReplicateRequestUrl(layerList)
+        resultUrl = self.pollForResponseUrl(replicaJob)
         replicaFileGeodatabasePath = self.downloadReplicaFileGeodatabase(resultUrl)
+        if self.attachmentsByUrl:
+            self.fetchAttachments(replicaFileGeodatabasePath, self.attachmentTablesOf(replicaFileGeodatabasePath, layerList))
 
         self.messenger.info(f'Survey replica downloaded to file path [{replicaFileGeodatabasePath}]')
         self.messenger.outdent()
 
         return replicaFileGeodatabasePath
 
-    def generateReplicateRequestUrl(self):
+    def generateReplicateRequestUrl(self, layerList):
         # See https://developers.arcgis.com/rest/services-reference/enterprise/create-replica/
         createReplicaURL = f'{self.parameters[SERVICE_URL]}/createReplica/?f=json&token={self.context[TOKEN]}'
         self.messenger.info(f'Requesting Replica via [{createReplicaURL}]')
@@ -180,33 +460,71 @@ class AGOLSurveyReplicator(Extractor):
             "geometryType": "esriGeometryEnvelope",
             "inSR":4326,
             "transportType":"esriTransportTypeUrl",
-            "returnAttachments":True,
+            "returnAttachments":not self.attachmentsByUrl,
             "returnAttachmentsDatabyURL":False,
             "async":True,
             "syncModel":"none",
-            "dataFormat":"filegdb",
+            "dataFormat":self.replicaFormat,
         }
 
         if "syncCapabilities" in self.context[SERVICE_INFO]:
             if self.context[SERVICE_INFO]["syncCapabilities"]["supportsAttachmentsSyncDirection"] == True:
                 replicaParameters["attachmentsSyncDirection"] = "bidirectional"
-                
-        layerList = [str(l["id"]) for l in self.context[SERVICE_INFO]["layers"]]
-        tableList = [str(t["id"]) for t in self.context[SERVICE_INFO]["tables"]]
-        layerList.extend(tableList)
+
+
         replicaParameters["layers"] = ", ".join(layerList)
-        layerQueries = {}
+
+        layerQueries = self.generateLayerQueries(layerList)
+        if len(layerQueries) > 0:
+            replicaParameters["layerQueries"] = json.dumps(layerQueries)
         
         encodedUrlParams = urllib.parse.urlencode(replicaParameters).encode('utf-8')
         
-        createReplStream = urllib.request.urlopen(createReplicaURL, encodedUrlParams)
-        return createReplStream
-
-    def pollForResponseUrl(self, createReplStream):
+        return self.session.getJson(createReplicaURL, encodedUrlParams)
+
+    def generateCreationDateFilter(self):
+        # Mirrors the transformer's filterRecords, so the portal only packages records we would keep.
+        clauses = []
+        if self.context.get(LAST_SYNC_TIME, None) != None:
+            clauses.append(f"CreationDate > timestamp '{time.createTimestampText(self.context[LAST_SYNC_TIME])}'")
+        if self.context.get(PROCESS_TIME, None) != None:
+            clauses.append(f"CreationDate <= timestamp '{time.createTimestampText(self.context[PROCESS_TIME])}'")
+        return " AND ".join(clauses)
+
+    def generateLayerQueries(self, layerList):
+        whereClause = self.generateCreationDateFilter()
+        if whereClause == "":
+            return {}
+
+        self.messenger.info(f'Limiting replica to records matching [{whereClause}]')
+
+        # Survey123 repeats carry their own CreationDate, so each layer and table is filtered on its own
+        # rather than pulled in as related records of a filtered parent.
+        return { layerId: {
+                    "queryOption": "useFilter",
+                    "where": whereClause,
+                    "useGeometry": False,
+                    "includeRelated": False
+                } for layerId in layerList }
+
+    def attachmentTablesOf(self, surveyGDB, layerList):
+        layersInfo = self.getLayersInfo()
+        layerDefinitions = layersInfo.get('layers', []) + layersInfo.get('tables', [])
+        return [(str(l['id']), arcpy.ValidateTableName(l['name'], surveyGDB)) for l in layerDefinitions \
+                    if l.get('hasAttachments', False) and str(l['id']) in layerList]
+
+    def fetchAttachments(self, surveyGDB, attachmentTables):
+        '''Fetches attachments by URL for each (layerId, tableName), for the same records the replica holds'''
+        fetcher = AttachmentFetcher(self.parameters).withContext(self.context)
+        for layerId, tableName in attachmentTables:
+            self.refreshLoginTokenIfExpiring()
+            fetcher.fetchInto(surveyGDB, tableName, f'{self.parameters[SERVICE_URL]}/{layerId}', \
+                self.generateCreationDateFilter(), self.context[TOKEN])
+
+    def pollForResponseUrl(self, thisJob):
         # This is asynchronous, so we get a jobId to check periodically for completion
         resultUrl = None
         
-        thisJob = json.loads(createReplStream.read())
         self.messenger.debug(f'Response received = [{thisJob}]')
 
         if not "statusUrl" in thisJob:
@@ -218,30 +536,33 @@ class AGOLSurveyReplicator(Extractor):
 
         resultUrl = ""
 
-        tokenExpirySeconds = TOKEN_EXPIRY_MINUTES * 60
-        maxPollAttempts = int(tokenExpirySeconds / POLL_WAIT_SECONDS)
-        pollCounter = 1
-        while resultUrl == "":
-            jobPollUrl = f"{jobUrl}?f=json&token={self.context[TOKEN]}"
-            self.messenger.debug(f'Polling replica job via = [{jobPollUrl}]')
-            checkReq = urllib.request.urlopen(jobPollUrl)
-
-            statusText = checkReq.read()
-
-            status = json.loads(statusText)
-            self.messenger.debug(f'Poll check #{pollCounter}, response = [{statusText}] ')
-
-            if "resultUrl" in status.keys():
-                resultUrl = status["resultUrl"]
-            if pollCounter > maxPollAttempts:
-                raise Exception('Took too long finish replica job')
-            if status["status"] == "Failed" or status["status"] == "CompletedWithErrors":
-                raise Exception(f'Create Replica Issues: [{status["status"]}]')
-            if status["status"] != "Completed":
-                pollCounter += 1
-                time.sleep(POLL_WAIT_SECONDS)  # TODO: Random expontantial backoff instead?
-
-        self.messenger.info(f'Result URL [{resultUrl}] obtained after [{pollCounter}] poll attempts')
+        timeoutMinutes = intParameter(self.parameters, REPLICA_TIMEOUT_MINUTES, DEFAULT_REPLICA_TIMEOUT_MINUTES)
+        maxWaitSeconds = intParameter(self.parameters, POLL_MAX_WAIT_SECONDS, DEFAULT_POLL_MAX_WAIT_SECONDS)
+        scheduler = PollScheduler(timeoutMinutes * 60, maxWaitSeconds)
+
+        try:
+            while resultUrl == "":
+                self.refreshLoginTokenIfExpiring()
+
+                jobPollUrl = f"{jobUrl}?f=json&token={self.context[TOKEN]}"
+                self.messenger.debug(f'Polling replica job via = [{jobPollUrl}]')
+                status = self.session.getJson(jobPollUrl)
+                scheduler.recordPoll()
+                self.messenger.debug(f'Poll check #{scheduler.pollCount}, response = [{status}] ')
+
+                if "resultUrl" in status.keys() and status["resultUrl"] != "":
+                    resultUrl = status["resultUrl"]
+                    break
+                if status["status"] == "Failed" or status["status"] == "CompletedWithErrors":
+                    raise Exception(f'Create Replica Issues: [{status["status"]}]')
+                if scheduler.deadlinePassed():
+                    raise Exception(f'Replica job did not finish within [{timeoutMinutes}] minutes')
+                scheduler.wait()
+        finally:
+            metrics.record(self.context, REPLICA_POLL_COUNT, scheduler.pollCount)
+            metrics.record(self.context, REPLICA_POLL_WAIT_SECONDS, round(scheduler.totalWaitSeconds, 1))
+
+        self.messenger.info(f'Result URL [{resultUrl}] obtained after [{scheduler.pollCount}] poll attempts and [{scheduler.totalWaitSeconds:.1f}] seconds waiting')
                 
         self.messenger.outdent()
         return resultUrl
@@ -251,28 +572,91 @@ class AGOLSurveyReplicator(Extractor):
         self.messenger.info(f'Retrieving cooked replica via [{tokenisedResultUrl}]')
         self.messenger.indent()
 
-        resultRequestUrl = urllib.request.urlopen(tokenisedResultUrl)
-        
         outDir = tempfile.mkdtemp()
+
+        if self.replicaFormat == SQLITE_REPLICA:
+            mobileGDBpath = self.downloadMobileGeodatabase(tokenisedResultUrl, resultUrl, outDir)
+            self.messenger.outdent()
+            return mobileGDBpath
+
+        unzippedSurveyGDBpath = self.unzipReplicaWhileDownloading(tokenisedResultUrl, outDir)
+        if unzippedSurveyGDBpath == None:
+            unzippedSurveyGDBpath = self.downloadThenUnzipReplica(tokenisedResultUrl, resultUrl, outDir)
+
+        self.messenger.info(f'Survey geodatabase unzipped to [{unzippedSurveyGDBpath}]')
+        self.messenger.outdent()
+        return unzippedSurveyGDBpath
+
+    def unzipReplicaWhileDownloading(self, tokenisedResultUrl, outDir):
+        '''Extracts replica members as their bytes arrive, returning None when the whole archive must be downloaded instead'''
+        chunkBytes = intParameter(self.parameters, DOWNLOAD_CHUNK_KB, DEFAULT_DOWNLOAD_CHUNK_KB) * 1024
+
+        # The stream reconnects from where it dropped, so a dropped connection needs no fallback to the whole archive.
+        try:
+            with StreamingDownloader(self.parameters).openResumable(tokenisedResultUrl) as response:
+                memberNames = StreamingUnzipper(chunkBytes).extract(response, outDir)
+        except Exception as ex:
+            if not (isinstance(ex, (UnsupportedZipStreamError, CorruptZipStreamError, TruncatedZipStreamError)) or isRecoverable(ex)):
+                raise
+            self.messenger.warn(f'Could not unzip replica while downloading [{ex}]. Downloading the whole archive instead.')
+            shutil.rmtree(outDir)
+            os.makedirs(outDir)
+            return None
+
+        # Get the name of the gdb directory by splitting the first part of the path of a zipped file
+        return os.path.join(outDir, memberNames[0].split(r'/')[0])
+
+    def downloadThenUnzipReplica(self, tokenisedResultUrl, resultUrl, outDir):
         outFile = os.path.join(outDir, f"{uuid.uuid4()}.zip")
 
         self.messenger.info(f'Writing replica bytestream to filepath [{outFile}]')
-        with open(outFile, 'wb') as output:
-            output.write(resultRequestUrl.read())
-        del(output) # force freeing of memory held by output variable. Is this important?
+        StreamingDownloader(self.parameters).download(tokenisedResultUrl, outFile, resumeKey=resultUrl)
+        self.verifyReplicaArchive(outFile)
 
         surveyGDB = ''
         with zipfile.ZipFile(outFile, 'r') as zipGDB:
             # Get the name of the gdb directory by splitting the first part of the path of a zipped file
             surveyGDB = zipGDB.namelist()[0].split(r'/')[0]
             zipGDB.extractall(outDir)
-            
-        unzippedSurveyGDBpath = os.path.join(outDir, surveyGDB)   
-        self.messenger.info(f'Survey geodatabase unzipped to [{unzippedSurveyGDBpath}]')
 
         os.remove(outFile) 
         self.messenger.info(f'Removed zipped replica file [{outFile}]')
 
-        self.messenger.outdent()
-        return unzippedSurveyGDBpath
-        
\ No newline at end of file
+        return os.path.join(outDir, surveyGDB)
+
+
+    def downloadMobileGeodatabase(self, tokenisedResultUrl, resultUrl, outDir):
+        # A sqlite replica arrives as a single, unzipped, mobile geodatabase file.
+        outFile = os.path.join(outDir, MOBILE_GEODATABASE_NAME)
+
+        self.messenger.info(f'Writing replica bytestream to filepath [{outFile}]')
+        StreamingDownloader(self.parameters).download(tokenisedResultUrl, outFile, resumeKey=resultUrl)
+        self.verifyReplicaDatabase(outFile)
+
+        self.messenger.info(f'Survey mobile geodatabase written to [{outFile}]')
+        return outFile
+
+    def verifyReplicaDatabase(self, databasePath):
+        self.messenger.info(f'Verifying integrity of replica database [{databasePath}]')
+
+        problem = SQLiteReplica(databasePath).integrityProblem()
+        if problem != None:
+            os.remove(databasePath)
+            errorMsg = f'Replica database [{databasePath}] failed integrity check with [{problem}]'
+            self.messenger.error(errorMsg)
+            raise Exception(errorMsg)
+
+    def verifyReplicaArchive(self, zipFilePath):
+        self.messenger.info(f'Verifying integrity of replica archive [{zipFilePath}]')
+
+        try:
+            with zipfile.ZipFile(zipFilePath, 'r') as zipGDB:
+                corruptMember = zipGDB.testzip()
+        except zipfile.BadZipFile as ex:
+            corruptMember = f'<{ex}>'
+
+        if corruptMember != None:
+            os.remove(zipFilePath)
+            errorMsg = f'Replica archive [{zipFilePath}] failed integrity check at [{corruptMember}]'
+            self.messenger.error(errorMsg)
+            raise Exception(errorMsg)
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: support/field_maps.py
+# Purpose: To match replica fields to destination fields once per schema, rather than on every run
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+from support.messenger import Messenger
+from support.json_files import writePrivateJson, readJson
+
+import arcpy
+import hashlib
+import json
+import os
+
+FIELD_MAP_CACHE_FILE = 'field_maps.json'
+
+UNMAPPED_FIELDS = ['SHAPE']
+
+
+def normalisedFieldName(name):
+    # Destination databases may change the case of a name, and add underscores to names they reserve.
+    return name.upper().rstrip('_')
+
+
+def schemaHashOf(originFieldNames, destinationFieldNames):
+    schemas = json.dumps([list(originFieldNames), list(destinationFieldNames)])
+    return hashlib.sha256(schemas.encode('utf-8')).hexdigest()
+
+
+def compileFieldMap(originFieldNames, destinationFieldNames):
+    '''Returns [origin field, destination field] for each origin field but SHAPE, with None where no single destination field matches.
+
+    A field matches its namesake, else the one destination field with the same normalised name, else the one
+    destination field containing its name, ignoring case.
+    '''
+    exactNames = set(destinationFieldNames)
+    normalisedIndex = {}
+    for name in destinationFieldNames:
+        normalisedIndex.setdefault(normalisedFieldName(name), []).append(name)
+    lowerNames = [(name.lower(), name) for name in destinationFieldNames]
+
+    fieldMap = []
+    for field in originFieldNames:
+        if field in UNMAPPED_FIELDS:
+            continue
+        if field in exactNames:
+            fieldMap.append([field, field])
+            continue
+
+        candidates = normalisedIndex.get(normalisedFieldName(field), [])
+        if len(candidates) != 1:
+            lowerField = field.lower()
+            candidates = [name for lowerName, name in lowerNames if lowerField in lowerName]
+        fieldMap.append([field, candidates[0] if len(candidates) == 1 else None])
+
+    return fieldMap
+
+
+def fieldMappingsOf(originTable, compiledFieldMap):
+    '''Builds the arcpy FieldMappings for Append from a compiled field map'''
+    fieldMappings = arcpy.FieldMappings()
+    for field, destinationField in compiledFieldMap:
+        thisFieldMap = arcpy.FieldMap()
+        thisFieldMap.addInputField(originTable, field)
+        if destinationField != None:
+            outField = thisFieldMap.outputField
+            outField.name = destinationField
+            thisFieldMap.outputField = outField
+        fieldMappings.addFieldMap(thisFieldMap)
+    return fieldMappings
+
+
+class FieldMapCache:
+    '''Holds the compiled field map of each destination table, with a hash of the schemas it was compiled from.
+
+    A table's entry is used only while both schemas hash the same, and is replaced when either changes.
+    Without a cache directory, field maps are compiled afresh each run.
+    '''
+
+    def __init__(self, cacheDirectory=None):
+        self.messenger = Messenger()
+        self.cacheFile = None if not cacheDirectory else os.path.join(cacheDirectory, FIELD_MAP_CACHE_FILE)
+        self.entries = None
+
+    def keyFor(self, destination, table):
+        return f'{os.path.normcase(os.path.abspath(destination))}|{table}'
+
+    def fieldMapFor(self, destination, table, originFieldNames, destinationFieldNames):
+        '''Returns the compiled field map for table, from the cache where its schemas are unchanged'''
+        if self.cacheFile == None:
+            return compileFieldMap(originFieldNames, destinationFieldNames)
+
+        if self.entries == None:
+            self.entries = readJson(self.cacheFile, {})
+
+        key = self.keyFor(destination, table)
+        schemaHash = schemaHashOf(originFieldNames, destinationFieldNames)
+        entry = self.entries.get(key, None)
+        if entry != None and entry['schemaHash'] == schemaHash:
+            return entry['fieldMap']
+
+        self.messenger.debug(f'Schemas of [{table}] have changed since its field map was cached. Compiling it afresh.')
+        fieldMap = compileFieldMap(originFieldNames, destinationFieldNames)
+        self.entries[key] = { 'schemaHash': schemaHash, 'fieldMap': fieldMap }
+        writePrivateJson(self.cacheFile, self.entries)
+        return fieldMap
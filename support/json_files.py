@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: support/json_files.py
+# Purpose: To read and atomically write the small JSON files the caches keep between runs
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+import json
+import os
+import tempfile
+
+# Effective on POSIX only; Windows ignores these modes, leaving files to the cache directory's ACL.
+PRIVATE_FILE_MODE = 0o600
+PRIVATE_DIRECTORY_MODE = 0o700
+
+
+def writePrivateBytes(filePath, data):
+    '''Atomically replaces filePath with data, readable and writable by the owner only where the platform honours file modes'''
+    directory = os.path.dirname(filePath)
+    os.makedirs(directory, mode=PRIVATE_DIRECTORY_MODE, exist_ok=True)
+
+    fileDescriptor, tempPath = tempfile.mkstemp(dir=directory, prefix='.resync_', suffix='.tmp')
+    try:
+        os.chmod(tempPath, PRIVATE_FILE_MODE)
+        with os.fdopen(fileDescriptor, 'wb') as tempFile:
+            tempFile.write(data)
+        os.replace(tempPath, filePath)
+    except Exception:
+        if os.path.exists(tempPath):
+            os.remove(tempPath)
+        raise
+
+
+def readBytes(filePath):
+    '''Returns the content of filePath, or None if it is absent or unreadable'''
+    if not os.path.exists(filePath):
+        return None
+    try:
+        with open(filePath, 'rb') as inFile:
+            return inFile.read()
+    except OSError:
+        return None
+
+
+def writePrivateJson(filePath, content):
+    writePrivateBytes(filePath, json.dumps(content).encode('utf-8'))
+
+
+def readJson(filePath, default):
+    data = readBytes(filePath)
+    if data == None:
+        return default
+    try:
+        return json.loads(data.decode('utf-8'))
+    except ValueError:
+        # A damaged cache is just a cold cache.
+        return default
@@ -9,18 +9,54 @@
 
 from support.parameters import *
 from support.messenger import Messenger
+from support.catalog import catalogOf
+from support.attachment_index import AttachmentIndex, attachmentHashOf
+from support.field_maps import FieldMapCache
+from support.append_scheduler import AppendScheduler, AppendTask, appendDependenciesOf, DEFAULT_APPEND_WORKERS
+from support.downloader import describeTransfer, BYTES_PER_MB
+from support.sqlite_replica import tableNameOf
+import support.time as time
+import support.metrics as metrics
 
 from abc import ABC, abstractmethod
-import re
+import contextlib
 
 import arcpy
 import os
+import zlib
 
 # Context keys
 
 SECTION = 'ProcessSection'
 CLEANUP_OPERATIONS = 'CleanupOperations'
 EXISTING_TABLES = 'ExistingTables'
+PROCESS_TIME = 'ProcessTime'
+LOADED_TABLES = 'LoadedTables'
+
+SYNCHRONISATION_FIELD = 'SYS_TRANSFER_DATE'
+REL_GLOBALID_FIELD = 'REL_GLOBALID'
+ATTACHMENT_DATA_FIELD = 'DATA'
+ATTACHMENT_NAME_FIELD = 'ATT_NAME'
+
+# Duplicate attachments left out in reference mode are listed here, against the stored copy each refers to.
+# Like attachment tables, its name holds '__ATTACH', keeping it out of the destination's survey tables.
+ATTACHMENT_REFERENCES_SUFFIX = '__ATTACH_REFS'
+ATTACHMENT_REFERENCE_FIELDS = [
+    [REL_GLOBALID_FIELD, 'GUID', None],
+    [ATTACHMENT_NAME_FIELD, 'TEXT', 250],
+    ['ATTACHMENT_TABLE', 'TEXT', 160],
+    ['ATTACHMENTID', 'LONG', None],
+    [SYNCHRONISATION_FIELD, 'DATE', None]
+]
+
+# Each attachment table assigns its own ObjectIDs and GlobalIDs.
+GENERATED_FIELD_TYPES = ['OID', 'GlobalID']
+
+DEFAULT_ATTACHMENT_BATCH_MB = 64
+
+ATTACHMENTS_APPENDED = 'AttachmentsAppended'
+ATTACHMENTS_DEDUPLICATED = 'AttachmentsDeduplicated'
+ATTACHMENT_BYTES_SAVED = 'AttachmentBytesSaved'
 
 class Loader(ABC):
     @abstractmethod
@@ -52,6 +88,11 @@ class ReprojectingSDEAppender(Loader):
         self.context = {}
         self.parameters = parametersSupplied
         self.messenger = Messenger()
+        self.fieldMapCache = FieldMapCache(parametersSupplied.get(CACHE_DIRECTORY, None))
+        self.dedupeMode = choiceParameter(parametersSupplied, ATTACHMENT_DEDUPE, [DEDUPE_OFF, DEDUPE_SKIP, DEDUPE_REFERENCE], DEDUPE_OFF)
+        self.attachmentIndex = None
+        if self.dedupeMode != DEDUPE_OFF:
+            self.attachmentIndex = AttachmentIndex(parametersSupplied[SDE_CONNECTION], parametersSupplied.get(CACHE_DIRECTORY, None))
 
 
     def withContext(self, context):
@@ -75,7 +116,13 @@ class ReprojectingSDEAppender(Loader):
 
         self.createDestinationDatabaseIfNeeded()
         self.createDestinationTablesIfNeeded(surveyGDB)
-        self.updateDestinationTables(surveyGDB)
+        try:
+            self.updateDestinationTables(surveyGDB)
+            if self.attachmentIndex != None:
+                self.attachmentIndex.commit()
+        finally:
+            if self.attachmentIndex != None:
+                self.attachmentIndex.close()
 
         self.messenger.outdent()
         self.messenger.info(f'Done appending data from [{surveyGDB}] to [{self.parameters[SDE_CONNECTION]}]')
@@ -119,11 +166,14 @@ class ReprojectingSDEAppender(Loader):
 
         self.messenger.info('Creating needed tables in destination workspace...')
 
-        surveyGDBdesc = arcpy.Describe(arcpy.env.workspace)
+        surveyGDBdesc = catalogOf(self.context).description(surveyGDB)
 
         self.migrateDomainsToDestination(surveyGDB, surveyGDBdesc)
         self.createDestinationFeatureClassesAndTables(surveyGDB, surveyGDBdesc)
-        self.createDestinationRelationships(surveyGDBdesc)
+        self.createDestinationRelationships(surveyGDB)
+
+        # Every table, domain and relationship class created changes what the destination holds.
+        catalogOf(self.context).invalidate(self.parameters[SDE_CONNECTION])
 
         self.messenger.info('Done creating needed tables in destination workspace')
 
@@ -159,10 +209,10 @@ class ReprojectingSDEAppender(Loader):
         destSpatialReference = arcpy.SpatialReference(self.parameters[DESTINATION_CRS])
         prefix = self.parameters[PREFIX]
 
-        allTables = self.getSurveyTables(surveyGDB)
+        allTables = catalogOf(self.context).surveyTables(surveyGDB)
         for table in allTables:
-            dsc = arcpy.Describe(table)
-            newTableName = f"{prefix}_{table}"
+            dsc = catalogOf(self.context).describe(surveyGDB, table)
+            newTableName = f"{prefix}_{tableNameOf(table)}"
             templateTable = os.path.join(surveyGDB, table)
 
             if dsc.datatype == u'FeatureClass':
@@ -178,13 +228,15 @@ class ReprojectingSDEAppender(Loader):
 
             self.messenger.debug("Attaching field domains to table...")
             self.messenger.indent()
-            tableFields = arcpy.ListFields(table)
+            tableFields = catalogOf(self.context).fieldsOf(surveyGDB, table)
             for field in tableFields:
                 if field.domain != '':
                     self.messenger.debug(f"Field [{newTableName}.{field.name}] being assigned domain [{field.domain}]")
                     arcpy.management.AssignDomainToField(newTable, field.name, field.domain)
             self.messenger.outdent()
 
+            self.addSynchronisationIndex(os.path.join(destWorkspace, newTableName), newTableName)
+
             if surveyGDBdesc.workspaceType == "RemoteDatabase":
                 self.messenger.debug(f"Registering new table [{newTableName}] as versioned...")
                 arcpy.RegisterAsVersioned_management(newTable)
@@ -197,7 +249,7 @@ class ReprojectingSDEAppender(Loader):
         self.messenger.outdent()
 
 
-    def createDestinationRelationships(self, surveyGDBdesc):
+    def createDestinationRelationships(self, surveyGDB):
         self.messenger.indent()
         self.messenger.info("Creating Relationships...")
 
@@ -211,15 +263,13 @@ class ReprojectingSDEAppender(Loader):
         destWorkspace = self.parameters[SDE_CONNECTION]
         prefix = self.parameters[PREFIX]
 
-        for child in [(c.name, c.datatype) for c in surveyGDBdesc.children if c.datatype == u'RelationshipClass']:
+        for dscRC in catalogOf(self.context).relationshipClasses(surveyGDB):
             self.messenger.indent()
 
-            dscRC = arcpy.Describe(child[0])
-            
             RCOriginTable = dscRC.originClassNames[0]
             RCDestTable = dscRC.destinationClassNames[0]
             
-            newOriginTable = f"{prefix}_{RCOriginTable}"
+            newOriginTable = f"{prefix}_{tableNameOf(RCOriginTable)}"
             newOriginPath = os.path.join(destWorkspace, newOriginTable)
 
             if dscRC.isAttachmentRelationship:
@@ -227,9 +277,9 @@ class ReprojectingSDEAppender(Loader):
                 self.messenger.info(f"Enabling attachment relationship for [{newOriginTable}]...")
                 arcpy.EnableAttachments_management(newOriginPath)
             else:
-                newDestTable = f"{prefix}_{RCDestTable}"
+                newDestTable = f"{prefix}_{tableNameOf(RCDestTable)}"
                 newDestPath = os.path.join(destWorkspace, newDestTable)
-                newRC = os.path.join(destWorkspace, f"{prefix}_{child[0]}")
+                newRC = os.path.join(destWorkspace, f"{prefix}_{tableNameOf(dscRC.name)}")
                 relationshipType = "COMPOSITE" if dscRC.isComposite else "SIMPLE"
                 fwd_label = dscRC.forwardPathLabel if dscRC.forwardPathLabel != '' else 'Repeat'
                 bck_label = dscRC.backwardPathLabel if dscRC.backwardPathLabel != '' else 'MainForm'
@@ -254,44 +304,6 @@ class ReprojectingSDEAppender(Loader):
         self.messenger.outdent()
 
 
-    # TODO: copied from transformer.py... consolidate.
-    def getSurveyTables(self, workspace, prefix=''):
-        originalWorkspace = arcpy.env.workspace
-        arcpy.env.workspace = workspace
-        
-        tables = self.getSurveyTablesFromCurrentWorkspace(prefix)
-
-        arcpy.env.workspace = originalWorkspace
-        return tables
-
-
-    def getSurveyTablesFromCurrentWorkspace(self, prefix):
-        #This is used in 2 contexts:
-        #Downloaded GDB - tables have no prefix
-        #Enterprise GDB - prefix is added to table name
-        #The full table name (i.e. GDB.SCHEMA.NAME) is returned, so prefix is in the middle
-        wildcard = '*{0}*'.format(prefix) if prefix != '' else '*'
-        #List the Feature Classes & Tables
-        #Tables also returns Attachment tables
-        featureClasses = arcpy.ListFeatureClasses(wildcard)
-        tables = arcpy.ListTables(wildcard)
-
-        #Loop through the tables, checking for:
-        #1) Is this an attachment table?
-        #2) Does the prefix actually match the prefix term exactly?
-        allTables = featureClasses
-        allTables.extend(tables)
-        outTables = []
-        for t in allTables:
-            tableName = t.split('.')[-1]
-            nameParts = tableName.split('_')
-            if '__ATTACH' not in t:
-                if nameParts[0] == prefix or prefix == '':
-                    outTables.append(t)
-
-        return outTables
-
-
     def updateDestinationTables(self, surveyGDB):
         self.context[SECTION] = 'Updating Tables'
 
@@ -301,6 +313,8 @@ class ReprojectingSDEAppender(Loader):
         self.context[CLEANUP_OPERATIONS]['append'] = appendTables
 
         self.appendTables(surveyGDB)
+        if self.dedupeMode == DEDUPE_REFERENCE:
+            self.writeAttachmentReferences()
 
         self.context[CLEANUP_OPERATIONS].pop('append', None)
         self.context[CLEANUP_OPERATIONS].pop('createTables', None)
@@ -312,90 +326,249 @@ class ReprojectingSDEAppender(Loader):
 
         arcpy.env.workspace = surveyGDB
         
-        tableList = self.getSurveyTables(surveyGDB)
+        catalog = catalogOf(self.context)
+        tableList = catalog.surveyTables(surveyGDB)
         attachmentList = self.getTablesWithAttachments(self.parameters[SDE_CONNECTION], self.parameters[PREFIX])
+        self.context[LOADED_TABLES] = []
 
+        tasks = {}
         for table in tableList:
             #Normalize table fields to get schemas in alignmnet- enable all editing, make nonrequired
-            fields = arcpy.ListFields(table)
+            fields = catalog.fieldsOf(surveyGDB, table)
             for field in fields:
                 if not field.editable:
                     field.editable = True
                 if field.required:
                     field.required = False
-            destinationName = f"{self.parameters[PREFIX]}_{table}"
+            destinationName = f"{self.parameters[PREFIX]}_{tableNameOf(table)}"
             destinationFC = os.path.join(self.parameters[SDE_CONNECTION], destinationName)
 
             self.messenger.debug(f'Processing replica [{table}] -> SDE [{destinationName}]...')
 
-            originFieldNames = [f.name for f in arcpy.ListFields(table)]
-            destFieldNames = [f.name for f in arcpy.ListFields(destinationFC)]
+            originFieldNames = catalog.fieldNamesOf(surveyGDB, table)
+            destFieldNames = catalog.fieldNamesOf(self.parameters[SDE_CONNECTION], destinationName)
             fieldMap = self.createFieldMap(table, originFieldNames, destFieldNames)
 
-            self.messenger.debug(f'Appending data from table [{table}] to destination table [{destinationFC}]...')
-            arcpy.management.Append(table, destinationFC, 'NO_TEST', fieldMap)
-            self.messenger.debug(f'Done Appending data from table [{table}] to destination table [{destinationFC}]')
+            tasks[table] = AppendTask(table, destinationFC, fieldMap)
+
+        # Related tables wait on their origin table; attachments, and the rest of each table's load, follow its append here.
+        workerCount = intParameter(self.parameters, APPEND_WORKERS, DEFAULT_APPEND_WORKERS)
+        dependencies = appendDependenciesOf(catalog.relationshipClasses(surveyGDB), tableList)
+        if workerCount > 1:
+            self.messenger.info(f'Appending [{len(tasks)}] tables with [{workerCount}] worker processes...')
+
+        scheduler = AppendScheduler(workerCount, surveyGDB, self.parameters[DESTINATION_CRS], self.parameters[DESTINATION_GEOGRAPHIC_TRANSFORMATIONS])
+        for result in scheduler.run(tasks, dependencies):
+            for message in result.messages:
+                self.messenger.debug(message)
+            if result.failure != None:
+                self.messenger.error(f'Append of table [{result.table}] failed in a worker process with [{result.failure.typeName}]')
+                raise result.failure.rebuild()
+
+            destinationName = f"{self.parameters[PREFIX]}_{tableNameOf(result.table)}"
+            destinationFC = tasks[result.table].destinationFC
 
             if destinationName in attachmentList:
-                self.appendAttachments(table, destinationFC)
+                self.appendAttachments(result.table, destinationFC)
+
+            self.context[LOADED_TABLES].append(destinationName)
 
         self.messenger.outdent()
         self.messenger.info('Done appending new data to destination workspace tables')
 
 
+    def addSynchronisationIndex(self, destinationFC, destinationName):
+        '''Indexes SYS_TRANSFER_DATE of a table just created, so the watermark lookup reads the newest entry of an index rather than scanning the table'''
+        # Some databases need index names unique across a schema, and short, so the name is derived from the table's.
+        indexName = f'SYNC_IDX_{zlib.crc32(destinationName.upper().encode("utf-8")):08X}'
+        self.messenger.debug(f'Adding index [{indexName}] on [{destinationFC}.{SYNCHRONISATION_FIELD}]')
+
+        # The index only speeds up the watermark lookup, so a table that can't take it (e.g. locked by readers) is loaded without it.
+        try:
+            arcpy.management.AddIndex(destinationFC, [SYNCHRONISATION_FIELD], indexName)
+        except arcpy.ExecuteError as ex:
+            self.messenger.warn(f'Could not add index [{indexName}] on [{destinationFC}.{SYNCHRONISATION_FIELD}] [{ex}]. Watermark lookups will scan it instead.')
+
     def getTablesWithAttachments(self, workspace, prefix):
         '''Lists the tables that have attachments, so that we can seperately process the attachments during migration'''
         self.messenger.info('Finding tables with attachments...')
 
-        originalWorkspace = arcpy.env.workspace
-        arcpy.env.workspace = workspace
-        dscW = arcpy.Describe(workspace)
         tableList = []
-        relClasses = [c.name for c in dscW.children if c.datatype == u'RelationshipClass']
-        for child in relClasses:
-            dbNameParts = child.split(".")
-            childParts = dbNameParts[-1].split("_")
-            if childParts[0] == prefix:
-                dscRC = arcpy.Describe(child)
-                if dscRC.isAttachmentRelationship:
-                    originTable = dscRC.originClassNames[0]
-                    originParts = originTable.split(".")
-                    tableList.append(originParts[-1])
-        arcpy.env.workspace = originalWorkspace
+        for dscRC in catalogOf(self.context).relationshipClasses(workspace, prefix):
+            if dscRC.isAttachmentRelationship:
+                originTable = dscRC.originClassNames[0]
+                originParts = originTable.split(".")
+                tableList.append(originParts[-1])
 
         self.messenger.info('Done finding tables with attachments')
         return tableList
 
  
+    def appendedKeysOf(self, outFC, GUIDFields, keys):
+        '''Maps each of keys to its destination GlobalID, reading only the rows stamped by this run where it can'''
+        # SYS_TRANSFER_DATE is indexed, so this reads the batch just appended rather than the table's whole history.
+        timestamp = time.createTimestampText(self.context[PROCESS_TIME])
+        outDict = self.keysMatching(outFC, GUIDFields, keys, f"{SYNCHRONISATION_FIELD} = timestamp '{timestamp}'")
+
+        missingKeys = keys - outDict.keys()
+        if len(missingKeys) > 0:
+            self.messenger.debug(f'[{len(missingKeys)}] appended keys not found by timestamp in [{outFC}]. Scanning the whole table for them.')
+            outDict.update(self.keysMatching(outFC, GUIDFields, missingKeys, None))
+        return outDict
+
+    def keysMatching(self, outFC, GUIDFields, keys, whereClause):
+        # Only the wanted keys are kept, so memory follows the batch, not the table.
+        outDict = {}
+        with arcpy.da.SearchCursor(outFC, GUIDFields, where_clause=whereClause) as outputSearch:
+            for row in outputSearch:
+                if row[0] in keys:
+                    outDict[row[0]] = row[1]
+        return outDict
+
+    def streamAttachments(self, inAttachTable, outAttachTable, lookup):
+        '''Inserts each replica attachment into outAttachTable, remapping REL_GLOBALID, holding no more than the attachment batch budget in memory'''
+        budgetBytes = max(1, intParameter(self.parameters, ATTACHMENT_BATCH_MB, DEFAULT_ATTACHMENT_BATCH_MB)) * BYTES_PER_MB
+        inFields, outFields = self.attachmentFieldsOf(inAttachTable, outAttachTable)
+
+        rowsWritten = 0
+        bytesWritten = 0
+        startTime = time.monotonicSeconds()
+        for batch, batchBytes in self.attachmentBatches(inAttachTable, inFields, lookup, budgetBytes):
+            with self.attachmentEditorFor(outAttachTable):
+                with arcpy.da.InsertCursor(outAttachTable, outFields) as insertCursor:
+                    for row, contentHash, dataSize in batch:
+                        attachmentId = insertCursor.insertRow(row)
+                        if contentHash != None:
+                            self.attachmentIndex.recordStored(contentHash, os.path.basename(outAttachTable), attachmentId, dataSize)
+
+            rowsWritten += len(batch)
+            bytesWritten += batchBytes
+            self.messenger.info(f'Appended [{rowsWritten}] attachments to [{outAttachTable}]: {describeTransfer(bytesWritten, time.monotonicSeconds() - startTime)}')
+
+        metrics.accumulate(self.context, ATTACHMENTS_APPENDED, rowsWritten)
+
+    def attachmentBatches(self, inAttachTable, inFields, lookup, budgetBytes):
+        # A batch closes once its attachment data reaches the budget, so a single larger attachment still travels alone.
+        upperFields = [name.upper() for name in inFields]
+        relIndex = upperFields.index(REL_GLOBALID_FIELD)
+        dataIndex = upperFields.index(ATTACHMENT_DATA_FIELD) if ATTACHMENT_DATA_FIELD in upperFields else None
+        nameIndex = upperFields.index(ATTACHMENT_NAME_FIELD) if ATTACHMENT_NAME_FIELD in upperFields else None
+
+        batch = []
+        batchBytes = 0
+        with arcpy.da.SearchCursor(inAttachTable, inFields) as attachments:
+            for row in attachments:
+                row = list(row)
+                row[relIndex] = lookup[row[relIndex]]
+                data = row[dataIndex] if dataIndex != None else None
+                dataSize = 0 if data == None else len(data)
+
+                contentHash = None
+                if self.attachmentIndex != None and data != None:
+                    contentHash = attachmentHashOf(data)
+                    if self.isStoredAlready(contentHash):
+                        self.skipDuplicate(contentHash, dataSize, row[relIndex], row[nameIndex] if nameIndex != None else None)
+                        continue
+                    self.attachmentIndex.markSeen(contentHash)
+
+                batch.append((row, contentHash, dataSize))
+                batchBytes += dataSize
+                if batchBytes >= budgetBytes:
+                    yield batch, batchBytes
+                    batch = []
+                    batchBytes = 0
+        if len(batch) > 0:
+            yield batch, batchBytes
+
+    def isStoredAlready(self, contentHash):
+        '''Answers whether the destination already holds an attachment with this content, stored this run or by an earlier one'''
+        if self.attachmentIndex.seenThisRun(contentHash):
+            return True
+
+        storedCopy = self.attachmentIndex.storedCopyOf(contentHash)
+        if storedCopy == None:
+            return False
+
+        attachmentTable, attachmentId = storedCopy
+        if self.attachmentExists(attachmentTable, attachmentId):
+            self.attachmentIndex.markSeen(contentHash)
+            return True
+
+        self.messenger.debug(f'Indexed attachment [{attachmentTable}:{attachmentId}] is no longer in the destination. Storing its content again.')
+        self.attachmentIndex.forget(contentHash)
+        return False
+
+    def attachmentExists(self, attachmentTable, attachmentId):
+        workspace = self.parameters[SDE_CONNECTION]
+        oidField = [field.name for field in catalogOf(self.context).fieldsOf(workspace, attachmentTable) if field.type == 'OID'][0]
+        with arcpy.da.SearchCursor(os.path.join(workspace, attachmentTable), [oidField], where_clause=f'{oidField} = {attachmentId}') as cursor:
+            for row in cursor:
+                return True
+        return False
+
+    def skipDuplicate(self, contentHash, dataSize, relGlobalId, attachmentName):
+        # In reference mode the feature's claim on the stored copy is written to the destination; in skip mode it is dropped.
+        if self.dedupeMode == DEDUPE_REFERENCE:
+            self.attachmentIndex.recordReference(contentHash, relGlobalId, attachmentName)
+        metrics.accumulate(self.context, ATTACHMENTS_DEDUPLICATED, 1)
+        metrics.accumulate(self.context, ATTACHMENT_BYTES_SAVED, dataSize)
+
+    def writeAttachmentReferences(self):
+        '''Writes the duplicates left out this run to the destination's attachment references table, each against its stored copy'''
+        referencedCopies = self.attachmentIndex.referencedCopies()
+        if len(referencedCopies) == 0:
+            return
+
+        referencesName = f'{self.parameters[PREFIX]}{ATTACHMENT_REFERENCES_SUFFIX}'
+        referencesTable = os.path.join(self.parameters[SDE_CONNECTION], referencesName)
+        self.createAttachmentReferencesTableIfNeeded(referencesTable, referencesName)
+
+        # Stamped like any appended row, so a run that fails from here on has its references cleaned up with the rest.
+        self.context[CLEANUP_OPERATIONS]['append'] = list(self.context[CLEANUP_OPERATIONS].get('append', [])) + [referencesName]
+        timestamp = time.asNaiveUTC(self.context[PROCESS_TIME]).replace(microsecond=0)
+        with self.attachmentEditorFor(referencesTable):
+            with arcpy.da.InsertCursor(referencesTable, [field[0] for field in ATTACHMENT_REFERENCE_FIELDS]) as insertCursor:
+                for referencedCopy in referencedCopies:
+                    insertCursor.insertRow(referencedCopy + [timestamp])
+
+        self.messenger.info(f'Recorded [{len(referencedCopies)}] references to stored attachments in [{referencesTable}]')
+
+    def createAttachmentReferencesTableIfNeeded(self, referencesTable, referencesName):
+        if arcpy.Exists(referencesTable):
+            return
+
+        self.messenger.info(f'Creating attachment references table [{referencesTable}]')
+        arcpy.management.CreateTable(self.parameters[SDE_CONNECTION], referencesName)
+        for fieldName, fieldType, fieldLength in ATTACHMENT_REFERENCE_FIELDS:
+            arcpy.management.AddField(referencesTable, fieldName, fieldType, field_length=fieldLength)
+        catalogOf(self.context).invalidate(self.parameters[SDE_CONNECTION])
+
+    def attachmentFieldsOf(self, inAttachTable, outAttachTable):
+        '''Returns the replica and destination names of the attachment fields both tables hold, in the same order'''
+        outNames = { field.name.upper(): field.name for field in arcpy.ListFields(outAttachTable) if field.type not in GENERATED_FIELD_TYPES }
+        inNames = [field.name for field in arcpy.ListFields(inAttachTable) \
+                      if field.type not in GENERATED_FIELD_TYPES and field.name.upper() in outNames.keys()]
+        return inNames, [outNames[name.upper()] for name in inNames]
+
+    def attachmentEditorFor(self, outAttachTable):
+        # Versioned tables accept inserts only within an edit session; unversioned tables are written directly, as Append did.
+        workspace = self.parameters[SDE_CONNECTION]
+        if catalogOf(self.context).describe(workspace, os.path.basename(outAttachTable)).isVersioned:
+            return arcpy.da.Editor(workspace)
+        return contextlib.nullcontext()
+
     def createFieldMap(self, originTable, originFieldNames, destinationFieldNames):
         '''Matches up fields between tables, even if some minor alteration (capitalization, underscores) occured during creation'''
         self.messenger.indent()
         self.messenger.debug(f'Creating field map for table [{originTable}]...')
 
-        fieldMappings = arcpy.FieldMappings()
-        for field in originFieldNames:
-            if field != 'SHAPE':
-                thisFieldMap = arcpy.FieldMap()
-                thisFieldMap.addInputField(originTable, field)
-                if field in destinationFieldNames:
-                    #Easy case- it came over w/o issue
-                    outField = thisFieldMap.outputField
-                    outField.name = field
-                    thisFieldMap.outputField = outField
-                    #arcpy.AddMessage("\t".join([field, field]))
-                else:
-                    #Use regular expression to search case insensitve and added _ to names
-                    candidates = [x for i, x in enumerate(destinationFieldNames) if re.search('{0}\W*'.format(field), x, re.IGNORECASE)]
-                    if len(candidates) == 1:
-                        outField = thisFieldMap.outputField
-                        outField.name = candidates[0]
-                        thisFieldMap.outputField = outField
-                fieldMappings.addFieldMap(thisFieldMap)
+        # Compiled to plain values, so the FieldMappings can be built wherever the table is appended.
+        compiledFieldMap = self.fieldMapCache.fieldMapFor(self.parameters[SDE_CONNECTION], originTable, originFieldNames, destinationFieldNames)
 
         self.messenger.debug(f'Done creating field map for table [{originTable}]')
         self.messenger.outdent()
 
-        return fieldMappings
+        return compiledFieldMap
 
 
     def appendAttachments(self, inFC, outFC, keyField='rowid', valueField = 'globalid'):
@@ -405,8 +578,6 @@ class ReprojectingSDEAppender(Loader):
         # 1) scan through both GlobalID and rowID of the old and new features and build a conversion dictionary
         GUIDFields = [keyField, valueField]
         inDict = {}
-        outDict = {}
-        lookup = {}
         
         inAttachTable = f"{inFC}__ATTACH"
         with arcpy.da.SearchCursor(inFC, GUIDFields) as inputSearch:
@@ -414,34 +585,15 @@ class ReprojectingSDEAppender(Loader):
                 inDict[row[0]] = row[1]
 
         outAttachTable = f"{outFC}__ATTACH"
-        with arcpy.da.SearchCursor(outFC, GUIDFields) as outputSearch:
-            for row in outputSearch:
-                outDict[row[0]] = row[1]
-        for key, inValue in inDict.items():
-            if key not in outDict.keys():
-                raise Exception(f'missing key: {key}')
-            lookup[inValue] = outDict[key]
-
-        # 2) Copy the attachment table to an in-memory layer
-        tempTableName = r'in_memory\AttachTemp'
-        
-        self.messenger.debug(f'Copying attachment table [{inAttachTable}] rows to [{tempTableName}]...')
-        tempTable = arcpy.management.CopyRows(inAttachTable, tempTableName)
-
-        # 3) update the attachment table with new GlobalIDs
-        self.messenger.debug(f'Updating table [{tempTableName}] with new GlobalIDs...')
-        with arcpy.da.UpdateCursor(tempTable, ['REL_GLOBALID']) as uRows:
-            for uRow in uRows:
-                uRow[0] = lookup[uRow[0]]
-                uRows.updateRow(uRow)
-
-        # 4) Append to destination attachment table
-        self.messenger.debug(f'Appending table [{tempTableName}] to [{outAttachTable}]...')
-        
-        arcpy.management.Append(tempTable, outAttachTable, 'NO_TEST')
-
-        self.messenger.debug(f'Deleting table [{tempTableName}]...')
-        arcpy.management.Delete(tempTable)
+        outDict = self.appendedKeysOf(outFC, GUIDFields, inDict.keys())
+        missingKeys = inDict.keys() - outDict.keys()
+        if len(missingKeys) > 0:
+            raise Exception(f'missing key: {next(iter(missingKeys))}')
+        lookup = { inValue: outDict[key] for key, inValue in inDict.items() }
+
+        # 2) Stream the attachments to the destination attachment table, with new GlobalIDs, a batch at a time
+        self.messenger.debug(f'Streaming attachments from [{inAttachTable}] to [{outAttachTable}]...')
+        self.streamAttachments(inAttachTable, outAttachTable, lookup)
 
         self.messenger.debug(f'Done appending attachments for [{outFC}]...')
         self.messenger.outdent()
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: support/metrics.py
+# Purpose: To collect per-run metrics in the shared context for reporting
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+# Context keys
+
+METRICS = 'Metrics'
+
+
+def record(context, name, value):
+    context.setdefault(METRICS, {})[name] = value
+
+
+def accumulate(context, name, amount):
+    metrics = context.setdefault(METRICS, {})
+    metrics[name] = metrics.get(name, 0) + amount
+
+
+def valueOf(context, name, default=None):
+    return context.get(METRICS, {}).get(name, default)
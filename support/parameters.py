@@ -17,6 +17,12 @@ PROCESS_TIME = 'ProcessTime'
 SECTION = 'ProcessSection'
 CLEANUP_OPERATIONS = 'CleanupOperations'
 EXISTING_TABLES = 'ExistingTables'
+TOKEN_EXPIRY = 'TokenExpiry'
+METRICS = 'Metrics'
+REPLICA_LAYERS = 'ReplicaLayers'
+REPLICA_HASH = 'ReplicaContentHash'
+TABLE_WATERMARKS = 'TableWatermarks'
+LOADED_TABLES = 'LoadedTables'
 
 # parameter keys
 
@@ -33,6 +39,43 @@ PORTAL_PASSWORD = 'password'
 DESTINATION_CRS = 'destination_crs'
 DESTINATION_GEOGRAPHIC_TRANSFORMATIONS = 'destination_geo_transforms'
 SERVICE_URL = 'service_url'
+DOWNLOAD_CHUNK_KB = 'download_chunk_kb'
+DOWNLOAD_RETRIES = 'download_retries'
+SCRATCH_DIRECTORY = 'scratch_dir'
+POLL_MAX_WAIT_SECONDS = 'poll_max_wait_seconds'
+REPLICA_TIMEOUT_MINUTES = 'replica_timeout_minutes'
+CACHE_DIRECTORY = 'cache_dir'
+EXTRACTION_METHOD = 'extraction_method'
+QUERY_WORKERS = 'query_workers'
+ATTACHMENT_TRANSFER = 'attachment_transfer'
+ATTACHMENT_WORKERS = 'attachment_workers'
+REPLICA_FORMAT = 'replica_format'
+REPLICA_CACHE_MB = 'replica_cache_mb'
+SERVICE_CACHE_MINUTES = 'service_cache_minutes'
+ATTACHMENT_BATCH_MB = 'attachment_batch_mb'
+ATTACHMENT_DEDUPE = 'attachment_dedupe'
+APPEND_WORKERS = 'append_workers'
+
+# extraction methods
+
+REPLICA_EXTRACTION = 'replica'
+QUERY_EXTRACTION = 'query'
+
+# attachment transfers
+
+ATTACHMENTS_IN_REPLICA = 'replica'
+ATTACHMENTS_BY_URL = 'url'
+
+# attachment dedupe modes
+
+DEDUPE_OFF = 'off'
+DEDUPE_SKIP = 'skip'
+DEDUPE_REFERENCE = 'reference'
+
+# replica formats
+
+FILEGDB_REPLICA = 'filegdb'
+SQLITE_REPLICA = 'sqlite'
 
 MANDATORY_PARAMETERS = [
     SDE_CONNECTION,
@@ -46,9 +89,43 @@ MANDATORY_PARAMETERS = [
 
 OPTIONAL_PARAMETERS = [
     PORTAL_USER_NAME,
-    PORTAL_PASSWORD
+    PORTAL_PASSWORD,
+    DOWNLOAD_CHUNK_KB,
+    DOWNLOAD_RETRIES,
+    SCRATCH_DIRECTORY,
+    POLL_MAX_WAIT_SECONDS,
+    REPLICA_TIMEOUT_MINUTES,
+    CACHE_DIRECTORY,
+    EXTRACTION_METHOD,
+    QUERY_WORKERS,
+    ATTACHMENT_TRANSFER,
+    ATTACHMENT_WORKERS,
+    REPLICA_FORMAT,
+    REPLICA_CACHE_MB,
+    SERVICE_CACHE_MINUTES,
+    ATTACHMENT_BATCH_MB,
+    ATTACHMENT_DEDUPE,
+    APPEND_WORKERS
 ]
 
+def intParameter(params, option, default):
+    value = params.get(option, None)
+    if value == None or str(value).strip() == '':
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise SystemExit(f"Parameter [{option}] expects a whole number, but [{value}] was supplied")
+
+def choiceParameter(params, option, choices, default):
+    value = params.get(option, None)
+    if value == None or str(value).strip() == '':
+        return default
+    value = str(value).strip().lower()
+    if value not in choices:
+        raise SystemExit(f"Parameter [{option}] expects one of {choices}, but [{value}] was supplied")
+    return value
+
 def produceParameters():
     rawParams = []
 
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: support/poller.py
+# Purpose: To pace polling of long-running portal jobs with jittered backoff
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+import support.time as time
+
+import random
+
+DEFAULT_INITIAL_WAIT_SECONDS = 0.5
+DEFAULT_MAX_WAIT_SECONDS = 30
+DEFAULT_BACKOFF_FACTOR = 2.0
+
+
+class PollScheduler:
+    '''
+    Exponential backoff with "equal jitter": each wait is drawn from the upper half of
+    the current backoff window, so quick jobs are noticed quickly and slow ones aren't hammered.
+    '''
+    def __init__(self, deadlineSeconds, maxWaitSeconds=DEFAULT_MAX_WAIT_SECONDS):
+        self.initialWaitSeconds = DEFAULT_INITIAL_WAIT_SECONDS
+        self.maxWaitSeconds = maxWaitSeconds
+        self.backoffFactor = DEFAULT_BACKOFF_FACTOR
+        self.deadlineSeconds = deadlineSeconds
+        self.random = random.Random()
+
+        self.pollCount = 0
+        self.totalWaitSeconds = 0.0
+        self.startTime = time.monotonicSeconds()
+
+    def recordPoll(self):
+        self.pollCount += 1
+
+    def nextWaitSeconds(self):
+        window = min(self.maxWaitSeconds, self.initialWaitSeconds * self.backoffFactor ** max(self.pollCount - 1, 0))
+        return self.random.uniform(window / 2, window)
+
+    def elapsedSeconds(self):
+        return time.monotonicSeconds() - self.startTime
+
+    def deadlinePassed(self):
+        return self.elapsedSeconds() >= self.deadlineSeconds
+
+    def wait(self):
+        waitSeconds = min(self.nextWaitSeconds(), max(self.deadlineSeconds - self.elapsedSeconds(), 0))
+        time.sleep(waitSeconds)
+        self.totalWaitSeconds += waitSeconds
+        return waitSeconds
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: support/query_extractor.py
+# Purpose: To extract a survey out of AGOL into a temp FGDB via paged layer queries
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+from support.parameters import *
+from support.extractor import AGOLSurveyReplicator
+import support.metrics as metrics
+
+import collections
+import concurrent.futures
+import json
+import math
+import os
+import tempfile
+import urllib, urllib.parse
+
+import arcpy
+
+# Context keys
+
+TOKEN = 'Token'
+
+# Metric names
+
+QUERY_PAGE_COUNT = 'QueryPages'
+QUERY_RECORD_COUNT = 'QueryRecords'
+
+DEFAULT_QUERY_WORKERS = 4
+DEFAULT_PAGE_SIZE = 1000
+
+# Pages fetched ahead of the one being written, per worker, bounding the pages held while they wait their turn.
+PAGES_AHEAD_PER_WORKER = 2
+
+SURVEY_GDB_NAME = 'survey.gdb'
+
+CARDINALITIES = {
+    'esriRelCardinalityOneToOne': 'ONE_TO_ONE',
+    'esriRelCardinalityOneToMany': 'ONE_TO_MANY',
+    'esriRelCardinalityManyToMany': 'MANY_TO_MANY'
+}
+
+
+class AGOLSurveyQueryExtractor(AGOLSurveyReplicator):
+    '''Pages through each layer's /query endpoint instead of waiting on an async createReplica job'''
+
+    def __init__(self, parametersSupplied):
+        AGOLSurveyReplicator.__init__(self, parametersSupplied)
+        self.workerCount = max(1, intParameter(parametersSupplied, QUERY_WORKERS, DEFAULT_QUERY_WORKERS))
+
+    def logIntoSurvey(self):
+        # Queries need no Sync capability, as no replica is created; the service must answer queries instead.
+        self.retrieveLoginToken()
+        self.checkServiceHasQueryEnabled()
+
+    def checkServiceHasQueryEnabled(self):
+        self.messenger.info(f'Checking service has Query capability...')
+        self.messenger.indent()
+
+        self.deriveServiceDefinition()
+        if 'Query' not in self.context[SERVICE_INFO]['capabilities']:
+            errorMsg = f'Query Capabilities not enabled for survey [{self.parameters[SERVICE_URL]}]'
+            self.messenger.error(errorMsg)
+            raise Exception(errorMsg)
+
+        self.messenger.info(f'Service confirmed as having Query capability.')
+        self.messenger.outdent()
+
+    def downloadSurvey(self, layerList):
+        self.messenger.info(f'Querying survey layers with [{self.workerCount}] concurrent requests...')
+        self.messenger.indent()
+
+        outDir = tempfile.mkdtemp()
+        arcpy.management.CreateFileGDB(outDir, SURVEY_GDB_NAME)
+        surveyGDB = os.path.join(outDir, SURVEY_GDB_NAME)
+
+        layerDefinitions = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workerCount) as pool:
+            for layerId in layerList:
+                self.refreshLoginTokenIfExpiring()
+                layerDefinitions[layerId] = self.extractLayer(pool, layerId, outDir, surveyGDB)
+
+        self.createRelationships(surveyGDB, layerDefinitions)
+
+        self.messenger.info(f'Survey layers written to [{surveyGDB}]')
+        self.messenger.outdent()
+
+        return surveyGDB
+
+    def getLayerDefinition(self, layerId):
+        requestUrl = f"{self.parameters[SERVICE_URL]}/{layerId}?f=json&token={self.context[TOKEN]}"
+        self.messenger.debug(f'Requesting layer definition via [{requestUrl}]')
+        return self.session.getJson(requestUrl)
+
+    def extractLayer(self, pool, layerId, outDir, surveyGDB):
+        definition = self.getLayerDefinition(layerId)
+        tableName = arcpy.ValidateTableName(definition['name'], surveyGDB)
+        definition['tableName'] = tableName
+
+        whereClause = self.generateCreationDateFilter() or '1=1'
+        pageSize = self.pageSizeOf(definition)
+        pageCount = 1
+        if pageSize != None:
+            pageCount = max(1, math.ceil(self.countLayerRecords(layerId, whereClause) / pageSize))
+
+        self.messenger.info(f'Querying layer [{layerId}] into [{tableName}] over [{pageCount}] page(s)...')
+        self.messenger.indent()
+
+        def fetchPage(pageNumber):
+            return pool.submit(self.queryPage, layerId, definition, whereClause, pageNumber * (pageSize or 0), pageSize)
+
+        jsonPath = os.path.join(outDir, f'{tableName}.json')
+        recordCount = self.writeFeatureSet(jsonPath, fetchPage, pageCount)
+
+        self.messenger.debug(f'Converting [{recordCount}] records from [{jsonPath}]')
+        arcpy.conversion.JSONToFeatures(jsonPath, os.path.join(surveyGDB, tableName))
+        os.remove(jsonPath)
+
+        if definition.get('hasAttachments', False):
+            self.fetchAttachments(surveyGDB, [(layerId, tableName)])
+
+        metrics.accumulate(self.context, QUERY_PAGE_COUNT, pageCount)
+        metrics.accumulate(self.context, QUERY_RECORD_COUNT, recordCount)
+
+        self.messenger.outdent()
+        return definition
+
+    def pageSizeOf(self, definition):
+        if not definition.get('advancedQueryCapabilities', {}).get('supportsPagination', True):
+            # Without resultOffset support we get one page, and warn if the service truncated it.
+            return None
+        return definition.get('maxRecordCount', DEFAULT_PAGE_SIZE) or DEFAULT_PAGE_SIZE
+
+    def countLayerRecords(self, layerId, whereClause):
+        recordCount = self.countRecords(layerId, whereClause)
+        if recordCount == None:
+            raise Exception(f'Could not count records for layer [{layerId}] at [{self.parameters[SERVICE_URL]}]')
+        return recordCount
+
+    def queryPage(self, layerId, definition, whereClause, offset, pageSize):
+        # See: https://developers.arcgis.com/rest/services-reference/enterprise/query-feature-service-layer/
+        queryParameters = {
+            'where': whereClause,
+            'outFields': '*',
+            'returnGeometry': 'true',
+            'orderByFields': f"{definition.get('objectIdField', 'objectid')} ASC",
+            'f': 'json',
+            'token': self.context[TOKEN]
+        }
+        if pageSize != None:
+            queryParameters['resultOffset'] = offset
+            queryParameters['resultRecordCount'] = pageSize
+
+        # POSTed, as the where clause and token can push a GET past URL length limits.
+        requestData = urllib.parse.urlencode(queryParameters).encode('utf-8')
+        page = self.session.getJson(f'{self.parameters[SERVICE_URL]}/{layerId}/query', requestData)
+
+        if 'error' in page.keys():
+            raise Exception(f'Query of layer [{layerId}] at offset [{offset}] failed: [{page["error"]}]')
+        if page.get('exceededTransferLimit', False) and pageSize == None:
+            self.messenger.warn(f'Layer [{layerId}] does not support paging and truncated its results')
+        return page
+
+    def writeFeatureSet(self, jsonPath, fetchPage, pageCount):
+        '''Streams pages, in order, into a single Esri JSON feature set.
+
+        Only a window of pages is fetched ahead of the one being written, so pages finishing out of order hold no
+        more than that window in memory while they wait their turn.
+        '''
+        windowSize = self.workerCount * PAGES_AHEAD_PER_WORKER
+        window = collections.deque()
+        nextPage = 0
+
+        recordCount = 0
+        with open(jsonPath, 'w', encoding='utf-8') as jsonFile:
+            for pageNumber in range(pageCount):
+                while nextPage < pageCount and len(window) < windowSize:
+                    window.append(fetchPage(nextPage))
+                    nextPage += 1
+                page = window.popleft().result()
+                features = page.pop('features', [])
+                if pageNumber == 0:
+                    header = json.dumps(page)
+                    jsonFile.write(header[:-1] + (', ' if len(page) > 0 else '') + '"features": [')
+                for feature in features:
+                    if recordCount > 0:
+                        jsonFile.write(', ')
+                    json.dump(feature, jsonFile)
+                    recordCount += 1
+            jsonFile.write(']}')
+        return recordCount
+
+    def createRelationships(self, surveyGDB, layerDefinitions):
+        '''Recreates the relationships between survey layers and their repeats, as a replica would carry them'''
+        tableNames = { str(d['id']): d['tableName'] for d in layerDefinitions.values() if 'id' in d.keys() }
+
+        for definition in layerDefinitions.values():
+            for relationship in definition.get('relationships', []):
+                if relationship.get('role', None) != 'esriRelRoleOrigin':
+                    continue
+
+                relatedId = str(relationship['relatedTableId'])
+                if relatedId not in tableNames.keys():
+                    continue
+
+                relatedDefinition = [d for d in layerDefinitions.values() if str(d.get('id', None)) == relatedId][0]
+                foreignKey = [r['keyField'] for r in relatedDefinition.get('relationships', []) if r['id'] == relationship['id']][0]
+
+                originPath = os.path.join(surveyGDB, definition['tableName'])
+                destinationPath = os.path.join(surveyGDB, tableNames[relatedId])
+                relationshipName = f"{definition['tableName']}_{tableNames[relatedId]}"
+                relationshipType = 'COMPOSITE' if relationship.get('composition', False) else 'SIMPLE'
+                cardinality = CARDINALITIES.get(relationship.get('cardinality', None), 'ONE_TO_MANY')
+
+                self.messenger.debug(f'Creating [{relationshipType}] relationship [{relationshipName}]')
+                arcpy.management.CreateRelationshipClass(originPath, destinationPath, os.path.join(surveyGDB, relationshipName), \
+                    relationshipType, 'Repeat', 'MainForm', 'NONE', cardinality, 'NONE', relationship['keyField'], foreignKey)
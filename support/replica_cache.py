@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: support/replica_cache.py
+# Purpose: To recognise replicas already loaded, and keep unloaded ones for a retry
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+from support.parameters import *
+from support.messenger import Messenger
+from support.json_files import writePrivateJson, readJson
+import support.time as time
+
+import datetime
+import hashlib
+import os
+import shutil
+import tempfile
+
+REPLICA_CACHE_DIRECTORY = 'replicas'
+REPLICA_CACHE_INDEX = 'index.json'
+
+HASH_CHUNK_BYTES = 1024 * 1024
+
+DEFAULT_REPLICA_CACHE_MB = 2048
+
+# A replica that keeps failing to load is likely broken (a schema change, a corrupt download), so stop retrying it.
+MAX_REPLICA_LOAD_ATTEMPTS = 2
+MAX_REPLICA_AGE_SECONDS = 7 * 24 * 60 * 60
+
+
+def replicaCacheFor(parametersSupplied):
+    '''Returns the replica cache configured by cache_dir and replica_cache_mb, or None if there is no cache directory'''
+    if not parametersSupplied.get(CACHE_DIRECTORY, None):
+        return None
+    maxMegabytes = intParameter(parametersSupplied, REPLICA_CACHE_MB, DEFAULT_REPLICA_CACHE_MB)
+    return ReplicaCache(parametersSupplied[CACHE_DIRECTORY], maxMegabytes * 1024 * 1024)
+
+
+def contentHashOf(replicaPath):
+    '''Returns a sha256 over the relative paths and bytes of every file in a replica, whether a directory or a single file'''
+    digest = hashlib.sha256()
+
+    if os.path.isdir(replicaPath):
+        filePaths = sorted(os.path.join(root, name) for root, dirs, names in os.walk(replicaPath) for name in names)
+    else:
+        filePaths = [replicaPath]
+
+    for filePath in filePaths:
+        relativePath = os.path.relpath(filePath, replicaPath).replace(os.sep, '/')
+        digest.update(relativePath.encode('utf-8') + b'\0')
+        with open(filePath, 'rb') as replicaFile:
+            for chunk in iter(lambda: replicaFile.read(HASH_CHUNK_BYTES), b''):
+                digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def sizeOf(replicaPath):
+    if not os.path.isdir(replicaPath):
+        return os.path.getsize(replicaPath)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, dirs, names in os.walk(replicaPath) for name in names)
+
+
+def copyReplica(sourcePath, targetPath):
+    if os.path.isdir(sourcePath):
+        shutil.copytree(sourcePath, targetPath)
+    else:
+        os.makedirs(os.path.dirname(targetPath), exist_ok=True)
+        shutil.copy2(sourcePath, targetPath)
+
+
+def removeReplica(replicaPath):
+    if os.path.isdir(replicaPath):
+        shutil.rmtree(replicaPath, ignore_errors=True)
+    elif os.path.exists(replicaPath):
+        os.remove(replicaPath)
+
+
+def watermarkText(lastSyncTime):
+    return None if lastSyncTime == None else time.createTimestampText(lastSyncTime)
+
+
+class ReplicaCache:
+    '''Holds the latest replica of each service, keyed by service URL, with the layer set and content hash it was built from.
+
+    Once a replica is loaded only its hash is kept, to spot an identical replica next run. A replica
+    that failed to load keeps its files, so the next run can retry it without going back to the portal,
+    until it has failed MAX_REPLICA_LOAD_ATTEMPTS times or is older than MAX_REPLICA_AGE_SECONDS.
+    '''
+
+    def __init__(self, cacheDirectory, maxBytes):
+        self.messenger = Messenger()
+        self.cacheDirectory = os.path.join(cacheDirectory, REPLICA_CACHE_DIRECTORY)
+        self.indexFile = os.path.join(self.cacheDirectory, REPLICA_CACHE_INDEX)
+        self.maxBytes = maxBytes
+
+    def keyFor(self, serviceUrl):
+        return hashlib.sha256(serviceUrl.rstrip('/').lower().encode('utf-8')).hexdigest()
+
+    def entryFor(self, serviceUrl):
+        return readJson(self.indexFile, {}).get(self.keyFor(serviceUrl), None)
+
+    def alreadyLoaded(self, serviceUrl, layers, contentHash):
+        entry = self.entryFor(serviceUrl)
+        return entry != None and entry['loaded'] and entry['layers'] == sorted(layers) and entry['contentHash'] == contentHash
+
+    def unloadedReplica(self, serviceUrl, lastSyncTime):
+        '''Returns (a working copy of the replica, its layers, its process time) if one failed to load against this watermark, otherwise None'''
+        entry = self.entryFor(serviceUrl)
+        if entry == None or entry['loaded'] or entry['lastSyncTime'] != watermarkText(lastSyncTime):
+            return None
+
+        if self.exhausted(entry):
+            self.messenger.info(f'Discarding cached replica [{entry["path"]}] that failed to load [{entry.get("attempts", 1)}] time(s). Replicating afresh.')
+            self.forget(serviceUrl)
+            return None
+
+        cachedPath = os.path.join(self.cacheDirectory, entry['path'])
+        if not os.path.exists(cachedPath):
+            return None
+
+        # Transformation edits the replica in place, so hand out a copy and keep the original for another retry.
+        workingPath = os.path.join(tempfile.mkdtemp(), os.path.basename(entry['path']))
+        copyReplica(cachedPath, workingPath)
+        return workingPath, entry['layers'], datetime.datetime.fromisoformat(entry['processTime'])
+
+    def store(self, serviceUrl, layers, replicaPath, contentHash, lastSyncTime, processTime):
+        '''Keeps a copy of a replica about to be loaded, unless it is already held or would not fit'''
+        key = self.keyFor(serviceUrl)
+        entries = readJson(self.indexFile, {})
+
+        existing = entries.get(key, None)
+        if existing != None and not existing['loaded'] and existing['contentHash'] == contentHash:
+            existing['attempts'] = existing.get('attempts', 1) + 1
+            writePrivateJson(self.indexFile, entries)
+            return
+
+        self.discard(entries, key)
+
+        replicaBytes = sizeOf(replicaPath)
+        if replicaBytes > self.maxBytes:
+            self.messenger.debug(f'Replica of [{replicaBytes}] bytes exceeds the cache limit of [{self.maxBytes}] bytes. Not caching it.')
+            writePrivateJson(self.indexFile, entries)
+            return
+
+        self.evictToFit(entries, replicaBytes)
+
+        relativePath = os.path.join(key, os.path.basename(replicaPath))
+        copyReplica(replicaPath, os.path.join(self.cacheDirectory, relativePath))
+
+        entries[key] = {
+            'layers': sorted(layers),
+            'contentHash': contentHash,
+            'lastSyncTime': watermarkText(lastSyncTime),
+            'processTime': processTime.isoformat(),
+            'path': relativePath,
+            'bytes': replicaBytes,
+            'storedAt': time.epochSeconds(),
+            'attempts': 1,
+            'loaded': False
+        }
+        writePrivateJson(self.indexFile, entries)
+        self.messenger.debug(f'Cached replica [{replicaPath}] as [{relativePath}]')
+
+    def markLoaded(self, serviceUrl, layers, contentHash):
+        '''Records that a replica loaded, dropping its files and keeping its hash'''
+        key = self.keyFor(serviceUrl)
+        entries = readJson(self.indexFile, {})
+        self.discard(entries, key)
+
+        entries[key] = {
+            'layers': sorted(layers),
+            'contentHash': contentHash,
+            'bytes': 0,
+            'storedAt': time.epochSeconds(),
+            'loaded': True
+        }
+        writePrivateJson(self.indexFile, entries)
+
+    def exhausted(self, entry):
+        '''Answers whether an unloaded replica has failed too often, or been held too long, to retry'''
+        tooOld = time.epochSeconds() - entry['storedAt'] > MAX_REPLICA_AGE_SECONDS
+        return entry.get('attempts', 1) >= MAX_REPLICA_LOAD_ATTEMPTS or tooOld
+
+    def forget(self, serviceUrl):
+        entries = readJson(self.indexFile, {})
+        self.discard(entries, self.keyFor(serviceUrl))
+        writePrivateJson(self.indexFile, entries)
+
+    def discard(self, entries, key):
+        entry = entries.pop(key, None)
+        if entry != None and entry.get('path', None) != None:
+            removeReplica(os.path.join(self.cacheDirectory, key))
+
+    def evictToFit(self, entries, incomingBytes):
+        '''Drops the oldest cached replicas until incomingBytes fits within the limit'''
+        heldBytes = sum(entry['bytes'] for entry in entries.values())
+        for key, entry in sorted(entries.items(), key=lambda item: item[1]['storedAt']):
+            if heldBytes + incomingBytes <= self.maxBytes:
+                break
+            if entry['bytes'] == 0:
+                continue
+            self.messenger.debug(f'Evicting cached replica [{entry["path"]}] of [{entry["bytes"]}] bytes')
+            heldBytes -= entry['bytes']
+            self.discard(entries, key)
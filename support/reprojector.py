@@ -12,6 +12,8 @@ import support.arcpy_proxy as arcpy_proxy
 import support.extractor as extractor
 import support.transformer as transformer
 import support.loader as loader
+from support.replica_cache import replicaCacheFor, contentHashOf
+from support.sync_state import syncStateFor
 import support.time as time
 from support.messenger import Messenger
 
@@ -24,6 +26,8 @@ class SurveyReprojector:
         self.messenger = Messenger()
         self.arcpyProxy = arcpy_proxy.ArcpyProxy()
         self.abortingException = None
+        self.replicaCache = replicaCacheFor(parametersSupplied)
+        self.syncState = syncStateFor(parametersSupplied)
 
         self.initialiseContext()
         
@@ -42,6 +46,7 @@ class SurveyReprojector:
         self.context[SECTION] = 'Unspecified'
         self.context[LAST_SYNC_TIME] = None
         self.context[CLEANUP_OPERATIONS] = {}
+        self.context[METRICS] = {}
         self.messenger.debug(f'Context: [{self.context}]')
 
     def usingExtractor(self, extractor):
@@ -64,12 +69,24 @@ class SurveyReprojector:
             self.handleException(ex)
         finally:
             self.cleanup()
+            self.reportMetrics()
             self.abortIfRequired()
             
     def noDestinationCleanupRequired(self):
         self.context[CLEANUP_OPERATIONS].pop('append', None)
         self.context[CLEANUP_OPERATIONS].pop('createTables', None)
 
+    def reportMetrics(self):
+        runMetrics = self.context.get(METRICS, {})
+        if len(runMetrics) == 0:
+            return
+
+        self.messenger.info(f'Run metrics:')
+        self.messenger.indent()
+        for name, value in runMetrics.items():
+            self.messenger.info(f'{name} = [{value}]')
+        self.messenger.outdent()
+
     def abortIfRequired(self):
         if self.abortingException == None:
             return
@@ -84,15 +101,55 @@ class SurveyReprojector:
     def tryReprojection(self):
         self.context[SECTION] = 'Extraction'
         surveyGDB = self.extractor.extract()
+        if surveyGDB == None:
+            self.messenger.info(f'No changes to synchronise. Skipping transformation and loading.')
+            return
+
+        if self.replicaAlreadyLoaded(surveyGDB):
+            self.messenger.info(f'Replica is identical to the last one loaded. Skipping transformation and loading.')
+            self.arcpyProxy.Delete(surveyGDB)
+            return
 
         self.context[SECTION] = 'Transformation'
         self.transformer.transform(surveyGDB)
 
         self.context[SECTION] = 'Loading'
         self.loader.loadFrom(surveyGDB)
+        self.recordSynchronisation()
+        self.recordReplicaLoaded()
 
         self.arcpyProxy.Delete(surveyGDB)    
 
+    def replicaAlreadyLoaded(self, surveyGDB):
+        '''Answers whether the replica matches the last one loaded, otherwise caching it so a failed load can be retried'''
+        if self.replicaCache == None:
+            return False
+
+        layers = self.context.get(REPLICA_LAYERS, [])
+        self.context[REPLICA_HASH] = contentHashOf(surveyGDB)
+        self.messenger.debug(f'Replica content hash [{self.context[REPLICA_HASH]}]')
+
+        if self.replicaCache.alreadyLoaded(self.parameters[SERVICE_URL], layers, self.context[REPLICA_HASH]):
+            return True
+
+        self.replicaCache.store(self.parameters[SERVICE_URL], layers, surveyGDB, self.context[REPLICA_HASH], \
+            self.context[LAST_SYNC_TIME], self.context[PROCESS_TIME])
+        return False
+
+    def recordSynchronisation(self):
+        '''Advances the watermark of every table the load covered, in one transaction, now the load has succeeded'''
+        if self.syncState == None:
+            return
+
+        # Existing tables left out of the replica had no records since their watermark, so they are covered too.
+        tables = set(self.context.get(EXISTING_TABLES, [])) | set(self.context.get(LOADED_TABLES, []))
+        self.syncState.recordLoad(self.parameters[SDE_CONNECTION], self.parameters[PREFIX], sorted(tables), self.context[PROCESS_TIME])
+
+    def recordReplicaLoaded(self):
+        if self.replicaCache == None:
+            return
+        self.replicaCache.markLoaded(self.parameters[SERVICE_URL], self.context.get(REPLICA_LAYERS, []), self.context[REPLICA_HASH])
+
     def handleException(self, ex):
         exceptionType = type(ex).__name__
         self.messenger.error(f'Handling exception of type [{exceptionType}] in section [{self.context[SECTION]}]')
@@ -102,7 +159,8 @@ class SurveyReprojector:
         self.messenger.error(f'Arguments: [{ex.args}]')
 
         if self.arcpyProxy.isExecuteError(ex): 
-            warnings = self.arcpyProxy.GetMessages(1)
+            # An error rebuilt from a worker process carries the arcpy messages left there.
+            warnings = getattr(ex, 'arcpyWarnings', None) or self.arcpyProxy.GetMessages(1)
             splitWarnings = warnings.split('\n')
             if len(splitWarnings) > 0:
                 self.messenger.error('arcpy warning messages:')
@@ -111,7 +169,7 @@ class SurveyReprojector:
                     self.messenger.error(warning)
                 self.messenger.outdent()
             
-            errors = self.arcpyProxy.GetMessages(2)  
+            errors = getattr(ex, 'arcpyErrors', None) or self.arcpyProxy.GetMessages(2)
             splitErrors = errors.split('\n')
             if len(splitErrors) > 0:
                 self.messenger.error('arcpy error messages:')
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: support/row_keys.py
+# Purpose: To generate GUID row keys in bulk
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+import os
+
+GUID_BYTES = 16
+DEFAULT_KEY_BATCH_SIZE = 10000
+
+# See: https://www.rfc-editor.org/rfc/rfc4122#section-4.4 (version 4, variant 10xx)
+VERSION_NIBBLE = bytes((b & 0x0F) | 0x40 for b in range(256))
+VARIANT_BITS = bytes((b & 0x3F) | 0x80 for b in range(256))
+
+
+def guidBatch(count):
+    '''Returns count random GUIDs as '{xxxxxxxx-xxxx-4xxx-yxxx-xxxxxxxxxxxx}', the form uuid.uuid4() gives, from one os.urandom buffer'''
+    buffer = bytearray(os.urandom(GUID_BYTES * count))
+    buffer[6::GUID_BYTES] = buffer[6::GUID_BYTES].translate(VERSION_NIBBLE)
+    buffer[8::GUID_BYTES] = buffer[8::GUID_BYTES].translate(VARIANT_BITS)
+
+    digits = buffer.hex()
+    return [f'{{{digits[i:i + 8]}-{digits[i + 8:i + 12]}-{digits[i + 12:i + 16]}-{digits[i + 16:i + 20]}-{digits[i + 20:i + 32]}}}' \
+                for i in range(0, len(digits), GUID_BYTES * 2)]
+
+
+def rowKeys(batchSize=DEFAULT_KEY_BATCH_SIZE):
+    '''Yields GUID row keys without end, generating them batchSize at a time'''
+    while True:
+        yield from guidBatch(batchSize)
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: support/service_cache.py
+# Purpose: To reuse feature service definitions across runs, revalidating where the portal allows
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+from support.messenger import Messenger
+from support.json_files import writePrivateJson, readJson
+import support.time as time
+
+import hashlib
+import os
+
+SERVICE_CACHE_FILE = 'services.json'
+
+# The parts of a service definition the extractor reads; the rest (extents, spatial references, documentation) is dropped.
+SERVICE_DEFINITION_KEYS = ['capabilities', 'syncCapabilities', 'editingInfo', 'layers', 'tables']
+LAYER_SUMMARY_KEYS = ['id', 'name', 'geometryType']
+
+
+def summariseServiceDefinition(definition):
+    summary = { key: definition[key] for key in SERVICE_DEFINITION_KEYS if key in definition.keys() }
+    for key in ['layers', 'tables']:
+        if key in summary.keys():
+            summary[key] = [{ k: layer[k] for k in LAYER_SUMMARY_KEYS if k in layer.keys() } for layer in summary[key]]
+    return summary
+
+
+class ServiceDefinitionCache:
+    '''Holds a summary of each service definition with its ETag and Last-Modified validators.
+
+    Entries with validators are always revalidated with a conditional request. Entries without
+    them are trusted, unrevalidated, for ttlSeconds after they were fetched.
+    '''
+
+    def __init__(self, cacheDirectory, ttlSeconds):
+        self.messenger = Messenger()
+        self.cacheFile = os.path.join(cacheDirectory, SERVICE_CACHE_FILE)
+        self.ttlSeconds = ttlSeconds
+
+    def keyFor(self, serviceUrl, username):
+        # What a service lists can depend on who asks, so entries are per user.
+        identity = f'{serviceUrl.rstrip("/").lower()}|{username}'
+        return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+    def get(self, serviceUrl, username):
+        return readJson(self.cacheFile, {}).get(self.keyFor(serviceUrl, username), None)
+
+    def hasValidators(self, entry):
+        return entry['etag'] != None or entry['lastModified'] != None
+
+    def isUsableWithoutRequest(self, entry):
+        return not self.hasValidators(entry) and time.epochSeconds() - entry['fetchedAt'] < self.ttlSeconds
+
+    def put(self, serviceUrl, username, definition, etag, lastModified):
+        entries = readJson(self.cacheFile, {})
+        entries[self.keyFor(serviceUrl, username)] = {
+            'definition': summariseServiceDefinition(definition),
+            'etag': etag,
+            'lastModified': lastModified,
+            'fetchedAt': time.epochSeconds()
+        }
+        writePrivateJson(self.cacheFile, entries)
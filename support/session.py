@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: support/session.py
+# Purpose: Singleton HTTP client, pooling keep-alive connections per host
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+from support.messenger import Messenger
+
+import base64
+import gzip
+import http.client
+import io
+import json
+import ssl
+import threading
+import urllib, urllib.error, urllib.parse, urllib.request
+
+
+def __reload__(state):
+    HttpSession().reset()
+
+
+DEFAULT_TIMEOUT_SECONDS = 120
+MAX_REDIRECTS = 5
+
+REDIRECT_CODES = [301, 302, 303, 307, 308]
+NOT_MODIFIED = 304
+
+USER_AGENT = 'ReSyncSurvey'
+
+# Errors indicating the server quietly dropped an idle keep-alive connection.
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.CannotSendRequest,
+    ConnectionResetError,
+    ConnectionAbortedError,
+    BrokenPipeError
+)
+
+
+class PooledResponse():
+    '''Wraps an http.client.HTTPResponse, handing its connection back to the pool once the body is consumed'''
+
+    def __init__(self, session, poolKey, connection, response):
+        self._session = session
+        self._poolKey = poolKey
+        self._connection = connection
+        self._response = response
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, exception_traceback):
+        self.close()
+
+    def read(self, amount=None):
+        data = self._response.read(amount)
+        self.releaseIfConsumed()
+        return data
+
+    def readinto(self, buffer):
+        bytesRead = self._response.readinto(buffer)
+        self.releaseIfConsumed()
+        return bytesRead
+
+    def releaseIfConsumed(self):
+        if self._connection != None and self._response.isclosed():
+            self._session.release(self._poolKey, self._connection)
+            self._connection = None
+
+    def close(self):
+        # Abandoning a part-read body leaves the connection unusable, so it is dropped rather than pooled.
+        if self._connection != None and not self._response.isclosed():
+            self._connection.close()
+            self._connection = None
+        self._response.close()
+
+
+class HttpSession():
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(HttpSession, cls).__new__(cls)
+            cls._instance.lock = threading.Lock()
+            cls._instance.idleConnections = {}
+            cls._instance.reset()
+        return cls._instance
+
+    def reset(self):
+        self.messenger = Messenger()
+        self.timeoutSeconds = DEFAULT_TIMEOUT_SECONDS
+        self.close()
+
+    def close(self):
+        with self.lock:
+            for connections in self.idleConnections.values():
+                for connection in connections:
+                    connection.close()
+            self.idleConnections = {}
+
+    def getJson(self, url, data=None):
+        '''Requests url (POSTing data if supplied), negotiating gzip, and returns the parsed JSON body'''
+        with self.open(url, data, { 'Accept-Encoding': 'gzip' }) as response:
+            body = self.decodedBody(response)
+        return json.loads(body)
+
+    def getJsonIfChanged(self, url, etag=None, lastModified=None):
+        '''GETs url, sending any validators, and returns (parsed JSON, ETag, Last-Modified), or (None, etag, lastModified) if not modified'''
+        headers = { 'Accept-Encoding': 'gzip' }
+        if etag != None:
+            headers['If-None-Match'] = etag
+        if lastModified != None:
+            headers['If-Modified-Since'] = lastModified
+
+        with self.open(url, None, headers) as response:
+            body = self.decodedBody(response)
+            if response.status == NOT_MODIFIED:
+                return None, etag, lastModified
+            return json.loads(body), response.headers.get('ETag', None), response.headers.get('Last-Modified', None)
+
+    def decodedBody(self, response):
+        body = response.read()
+        if response.headers.get('Content-Encoding', '').lower() == 'gzip':
+            body = gzip.decompress(body)
+        return body
+
+    def open(self, url, data=None, headers=None):
+        '''Drop-in for urllib.request.urlopen that reuses pooled connections. Bodies should be read to the end.'''
+        method = 'POST' if data != None else 'GET'
+
+        for redirect in range(MAX_REDIRECTS + 1):
+            response = self.request(method, url, data, headers)
+
+            location = response.headers.get('Location')
+            if response.status in REDIRECT_CODES and location != None:
+                response.read()
+                url = urllib.parse.urljoin(url, location)
+                if response.status == 303 or (response.status in [301, 302] and method == 'POST'):
+                    method, data = 'GET', None
+                continue
+
+            if response.status >= 400:
+                body = response.read()
+                raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, io.BytesIO(body))
+
+            return response
+
+        raise urllib.error.HTTPError(url, response.status, f'More than [{MAX_REDIRECTS}] redirects', response.headers, None)
+
+    def request(self, method, url, data, headers):
+        parts = urllib.parse.urlsplit(url)
+        poolKey = (parts.scheme, parts.netloc)
+
+        requestHeaders = { 'User-Agent': USER_AGENT, 'Connection': 'keep-alive' }
+        if method == 'POST':
+            requestHeaders['Content-Type'] = 'application/x-www-form-urlencoded'
+        if headers != None:
+            requestHeaders.update(headers)
+
+        while True:
+            connection, reused = self.acquire(poolKey, parts)
+            try:
+                connectionHeaders = dict(requestHeaders, **getattr(connection, 'proxyHeaders', {}))
+                connection.request(method, self.requestTarget(connection, parts), body=data, headers=connectionHeaders)
+                response = connection.getresponse()
+                return PooledResponse(self, poolKey, connection, response)
+            except STALE_CONNECTION_ERRORS:
+                connection.close()
+                if not reused:
+                    raise
+                self.messenger.debug(f'Pooled connection to [{parts.netloc}] went stale. Reconnecting...')
+            except Exception:
+                connection.close()
+                raise
+
+    def requestTarget(self, connection, parts):
+        path = parts.path if parts.path != '' else '/'
+        if parts.query != '':
+            path = f'{path}?{parts.query}'
+        if getattr(connection, 'viaPlainProxy', False):
+            return f'{parts.scheme}://{parts.netloc}{path}'
+        return path
+
+    def acquire(self, poolKey, parts):
+        with self.lock:
+            connections = self.idleConnections.get(poolKey, [])
+            if len(connections) > 0:
+                return connections.pop(), True
+        return self.connect(parts), False
+
+    def release(self, poolKey, connection):
+        with self.lock:
+            self.idleConnections.setdefault(poolKey, []).append(connection)
+
+    def connect(self, parts):
+        self.messenger.debug(f'Opening keep-alive connection to [{parts.scheme}://{parts.netloc}]')
+
+        host = parts.hostname
+        port = parts.port
+        secure = parts.scheme == 'https'
+
+        proxy = self.proxyFor(parts.scheme, host)
+        if proxy == None:
+            if secure:
+                return http.client.HTTPSConnection(host, port, timeout=self.timeoutSeconds, context=ssl.create_default_context())
+            return http.client.HTTPConnection(host, port, timeout=self.timeoutSeconds)
+
+        proxyParts = urllib.parse.urlsplit(proxy if '://' in proxy else f'http://{proxy}')
+        proxyHeaders = {}
+        if proxyParts.username != None:
+            credentials = f'{urllib.parse.unquote(proxyParts.username)}:{urllib.parse.unquote(proxyParts.password or "")}'
+            proxyHeaders['Proxy-Authorization'] = 'Basic ' + base64.b64encode(credentials.encode('utf-8')).decode('ascii')
+
+        if secure:
+            connection = http.client.HTTPSConnection(proxyParts.hostname, proxyParts.port, timeout=self.timeoutSeconds, context=ssl.create_default_context())
+            connection.set_tunnel(host, port, headers=proxyHeaders)
+            return connection
+
+        connection = http.client.HTTPConnection(proxyParts.hostname, proxyParts.port, timeout=self.timeoutSeconds)
+        connection.viaPlainProxy = True
+        connection.proxyHeaders = proxyHeaders
+        return connection
+
+    def proxyFor(self, scheme, host):
+        # Honour the same proxy environment that urllib.request.urlopen does.
+        if urllib.request.proxy_bypass(host):
+            return None
+        return urllib.request.getproxies().get(scheme, None)
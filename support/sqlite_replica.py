@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: support/sqlite_replica.py
+# Purpose: To run set-based SQL directly against a mobile geodatabase replica
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+from support.messenger import Messenger
+import support.time as time
+
+import sqlite3
+
+MOBILE_GEODATABASE_SUFFIX = '.geodatabase'
+
+ATTACHMENT_TABLE_SUFFIX = '__ATTACH'
+
+
+def isSQLiteReplica(workspace):
+    return str(workspace).lower().endswith(MOBILE_GEODATABASE_SUFFIX)
+
+
+def tableNameOf(table):
+    # arcpy hands back mobile geodatabase tables as 'main.table'; the name alone is what destinations and SQLite use.
+    return table.split('.')[-1]
+
+
+def quoted(identifier):
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+class SQLiteReplica():
+    '''Edits the rows of a mobile geodatabase (SQLite) replica in bulk, leaving its schema to arcpy'''
+
+    def __init__(self, replicaPath):
+        self.messenger = Messenger()
+        self.replicaPath = replicaPath
+        self.connection = None
+
+    def __enter__(self):
+        self.connection = sqlite3.connect(self.replicaPath)
+        return self
+
+    def __exit__(self, exception_type, exception_value, exception_traceback):
+        if exception_type == None:
+            self.connection.commit()
+        else:
+            self.connection.rollback()
+        self.connection.close()
+        self.connection = None
+
+    def attachmentTableOf(self, table):
+        '''Returns the name of table's attachment table, or None where it has none'''
+        row = self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = ? COLLATE NOCASE", \
+            [tableNameOf(table) + ATTACHMENT_TABLE_SUFFIX]).fetchone()
+        return None if row == None else row[0]
+
+    def deleteRecordsOutside(self, table, lastSyncTime, processTime):
+        '''Deletes rows created after processTime, or at or before lastSyncTime (if any), with their attachments, returning the count of rows deleted'''
+        # julianday() compares dates whether they are held as ISO 8601 text or as julian day numbers.
+        excludeStatement = 'julianday(CreationDate) > julianday(?)'
+        bindings = [time.createTimestampText(processTime)]
+        if lastSyncTime != None:
+            excludeStatement = f'{excludeStatement} OR julianday(CreationDate) <= julianday(?)'
+            bindings.append(time.createTimestampText(lastSyncTime))
+
+        # Raw SQL bypasses the geodatabase's relationship rules, so attachments of deleted rows are deleted here too.
+        # The savepoint leaves the rows and their attachments as they were, should either delete fail.
+        tableName = quoted(tableNameOf(table))
+        attachmentTable = self.attachmentTableOf(table)
+        self.connection.execute('SAVEPOINT delete_records_outside')
+        try:
+            if attachmentTable != None:
+                attachmentCursor = self.connection.execute(f'DELETE FROM {quoted(attachmentTable)} WHERE REL_GLOBALID IN ' + \
+                    f'(SELECT GlobalID FROM {tableName} WHERE {excludeStatement})', bindings)
+                self.messenger.debug(f'Deleted [{attachmentCursor.rowcount}] attachments of records outside the sync window from [{attachmentTable}]')
+            cursor = self.connection.execute(f'DELETE FROM {tableName} WHERE {excludeStatement}', bindings)
+        except sqlite3.Error:
+            self.connection.execute('ROLLBACK TO delete_records_outside')
+            raise
+        finally:
+            self.connection.execute('RELEASE delete_records_outside')
+        return cursor.rowcount
+
+    def setColumn(self, table, column, timestamp):
+        '''Sets column to timestamp on every row of table in a single statement, returning the count updated'''
+        cursor = self.connection.execute(f'UPDATE {quoted(tableNameOf(table))} SET {quoted(column)} = ?', \
+            [time.createTimestampText(timestamp)])
+        return cursor.rowcount
+
+    def integrityProblem(self):
+        '''Returns None if the replica passes SQLite's quick check, otherwise a description of what failed'''
+        connection = sqlite3.connect(self.replicaPath)
+        try:
+            result = connection.execute('PRAGMA quick_check').fetchone()
+        except sqlite3.DatabaseError as ex:
+            return f'<{ex}>'
+        finally:
+            connection.close()
+
+        if result == None or result[0] != 'ok':
+            return str(result)
+        return None
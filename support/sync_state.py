@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: support/sync_state.py
+# Purpose: To remember per-table synchronisation watermarks locally between runs
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+from support.parameters import *
+from support.messenger import Messenger
+import support.time as time
+
+import os
+import sqlite3
+
+SYNC_STATE_FILE = 'sync_state.sqlite'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS watermarks (
+    destination TEXT NOT NULL,
+    prefix TEXT NOT NULL,
+    table_name TEXT NOT NULL,
+    last_sync TEXT NOT NULL,
+    PRIMARY KEY (destination, prefix, table_name)
+)
+'''
+
+
+def syncStateFor(parametersSupplied):
+    '''Returns the sync-state store kept under cache_dir, or None if there is no cache directory'''
+    if not parametersSupplied.get(CACHE_DIRECTORY, None):
+        return None
+    return SyncStateStore(parametersSupplied[CACHE_DIRECTORY])
+
+
+def tableKeyOf(table):
+    # Enterprise workspaces list 'db.owner.table'; only the table name is stable across connections.
+    return table.split('.')[-1].lower()
+
+
+def establishWatermarks(syncState, arcpyProxy, destination, prefix, tableList):
+    '''Returns {table key: last synchronisation time} for tableList, scanning the destination only for tables the sync state lacks'''
+    watermarks = {} if syncState == None else syncState.watermarksFor(destination, prefix, tableList)
+
+    missingTables = [table for table in tableList if tableKeyOf(table) not in watermarks.keys()]
+    if len(missingTables) > 0:
+        Messenger().debug(f'No stored synchronisation time for {missingTables}. Reading it from [{destination}].')
+        scannedTime = arcpyProxy.getLastSynchronizationTime(destination, missingTables)
+        for table in missingTables:
+            watermarks[tableKeyOf(table)] = scannedTime
+
+    return watermarks
+
+
+def overallWatermarkOf(watermarks):
+    '''The earliest of the per-table watermarks, or None if any table has never been synchronised'''
+    if len(watermarks) == 0 or None in watermarks.values():
+        return None
+    return min(watermarks.values())
+
+
+class SyncStateStore:
+    '''Per-table watermarks, keyed by destination workspace, prefix and table, written once a load succeeds'''
+
+    def __init__(self, cacheDirectory):
+        self.messenger = Messenger()
+        self.stateFile = os.path.join(cacheDirectory, SYNC_STATE_FILE)
+
+    def destinationKeyOf(self, destination):
+        return os.path.normcase(os.path.abspath(destination))
+
+    def connect(self):
+        os.makedirs(os.path.dirname(self.stateFile), exist_ok=True)
+        connection = sqlite3.connect(self.stateFile)
+        connection.execute(SCHEMA)
+        return connection
+
+    def watermarksFor(self, destination, prefix, tableList):
+        '''Returns {table key: last synchronisation time} for those tables in tableList with a watermark held'''
+        if len(tableList) == 0:
+            return {}
+
+        connection = self.connect()
+        try:
+            rows = connection.execute('SELECT table_name, last_sync FROM watermarks WHERE destination = ? AND prefix = ?', \
+                [self.destinationKeyOf(destination), prefix]).fetchall()
+        finally:
+            connection.close()
+
+        stored = { tableName: time.fromTimestampText(lastSync) for tableName, lastSync in rows }
+        return { tableKeyOf(table): stored[tableKeyOf(table)] for table in tableList if tableKeyOf(table) in stored.keys() }
+
+    def recordLoad(self, destination, prefix, tableList, processTime):
+        '''Sets the watermark of every table in tableList to processTime, in a single transaction'''
+        connection = self.connect()
+        try:
+            with connection:
+                connection.executemany('INSERT OR REPLACE INTO watermarks (destination, prefix, table_name, last_sync) VALUES (?, ?, ?, ?)', \
+                    [[self.destinationKeyOf(destination), prefix, tableKeyOf(table), time.createTimestampText(processTime)] for table in tableList])
+        finally:
+            connection.close()
+
+        self.messenger.debug(f'Recorded synchronisation time [{time.createTimestampText(processTime)}] for [{len(tableList)}] tables')
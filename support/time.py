@@ -14,6 +14,11 @@ def createTimestampText(datetimeInstance):
     return datetimeInstance.strftime(TIMESTAMP_FORMAT)
 
 
+def fromTimestampText(text):
+    # Databases render timestamps as 'YYYY-MM-DD HH:MM:SS', some with fractional seconds or a 'T' separator.
+    return datetime.datetime.fromisoformat(text.strip())
+
+
 def getUTCTimestamp(inputTimezone):
     inputTimezoneNow = getLocalisedTimestamp(inputTimezone)
     utcNow = inputTimezoneNow.astimezone(pytz.utc)
@@ -35,4 +40,26 @@ def dummyTimestamp():
 
 
 def sleep(seconds):
-    time.sleep(seconds)
\ No newline at end of file
+    time.sleep(seconds)
+
+
+def monotonicSeconds():
+    return time.monotonic()
+
+def epochSeconds():
+    return time.time()
+
+def fromEpochMilliseconds(milliseconds):
+    return datetime.datetime.fromtimestamp(milliseconds / 1000, tz=pytz.utc)
+
+
+def asUTC(datetimeInstance):
+    # Timestamps read back from the destination come without a timezone, but were written as UTC.
+    if datetimeInstance.tzinfo == None:
+        return pytz.utc.localize(datetimeInstance)
+    return datetimeInstance.astimezone(pytz.utc)
+
+
+def asNaiveUTC(datetimeInstance):
+    # arcpy cursors hand back dates without a timezone, holding the UTC values they were stored with.
+    return asUTC(datetimeInstance).replace(tzinfo=None)
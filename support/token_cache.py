@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: support/token_cache.py
+# Purpose: To reuse portal login tokens across runs and config sections
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+from support.messenger import Messenger
+import support.time as time
+
+from support.json_files import writePrivateBytes, readBytes
+
+import ctypes
+import hashlib
+import json
+import os
+
+TOKEN_CACHE_FILE = 'tokens.json'
+
+# Cached tokens are retired this long before the portal would expire them.
+TOKEN_CACHE_MARGIN_SECONDS = 300
+
+CRYPTPROTECT_UI_FORBIDDEN = 0x01
+
+
+class DataBlob(ctypes.Structure):
+    # See: https://learn.microsoft.com/en-us/windows/win32/api/dpapi/nf-dpapi-cryptprotectdata
+    _fields_ = [('cbData', ctypes.c_uint32), ('pbData', ctypes.POINTER(ctypes.c_char))]
+
+
+def applyDataProtection(cryptFunction, data):
+    buffer = ctypes.create_string_buffer(data, len(data))
+    dataIn = DataBlob(len(data), ctypes.cast(buffer, ctypes.POINTER(ctypes.c_char)))
+    dataOut = DataBlob()
+    if not cryptFunction(ctypes.byref(dataIn), None, None, None, None, CRYPTPROTECT_UI_FORBIDDEN, ctypes.byref(dataOut)):
+        raise OSError(f'Windows data protection failed: {ctypes.FormatError()}')
+    try:
+        return ctypes.string_at(dataOut.pbData, dataOut.cbData)
+    finally:
+        ctypes.windll.kernel32.LocalFree(dataOut.pbData)
+
+
+def protect(data):
+    '''Encrypts data for the current Windows account with DPAPI. Elsewhere, where file modes keep the file private, data is left as is'''
+    if os.name != 'nt':
+        return data
+    return applyDataProtection(ctypes.windll.crypt32.CryptProtectData, data)
+
+
+def unprotect(data):
+    if os.name != 'nt':
+        return data
+    return applyDataProtection(ctypes.windll.crypt32.CryptUnprotectData, data)
+
+
+def readTokens(filePath):
+    data = readBytes(filePath)
+    if data == None:
+        return {}
+    try:
+        return json.loads(unprotect(data).decode('utf-8'))
+    except (OSError, ValueError):
+        # A damaged cache, or one written by another account, is just a cold cache.
+        return {}
+
+
+def writeTokens(filePath, entries):
+    writePrivateBytes(filePath, protect(json.dumps(entries).encode('utf-8')))
+
+
+class TokenCache:
+    '''Login tokens per portal and user, encrypted for the running account with DPAPI on Windows, and kept owner-only elsewhere'''
+
+    def __init__(self, cacheDirectory):
+        self.messenger = Messenger()
+        self.cacheFile = os.path.join(cacheDirectory, TOKEN_CACHE_FILE)
+
+    def keyFor(self, portal, username):
+        identity = f'{portal.rstrip("/").lower()}|{username}'
+        return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+    def get(self, portal, username):
+        '''Returns the cached token response ({token, expires} in epoch seconds), or None if absent or nearly expired'''
+        entry = readTokens(self.cacheFile).get(self.keyFor(portal, username), None)
+        if entry == None:
+            return None
+
+        if entry['expires'] - time.epochSeconds() <= TOKEN_CACHE_MARGIN_SECONDS:
+            self.messenger.debug(f'Cached login token for [{username}] at [{portal}] is about to expire. Ignoring it.')
+            return None
+
+        return entry
+
+    def put(self, portal, username, token, expires):
+        entries = self.unexpiredEntries()
+        entries[self.keyFor(portal, username)] = { 'token': token, 'expires': expires }
+        writeTokens(self.cacheFile, entries)
+
+    def evict(self, portal, username):
+        entries = self.unexpiredEntries()
+        if entries.pop(self.keyFor(portal, username), None) != None:
+            writeTokens(self.cacheFile, entries)
+
+    def unexpiredEntries(self):
+        now = time.epochSeconds()
+        entries = readTokens(self.cacheFile)
+        return { key: entry for key, entry in entries.items() if entry['expires'] > now }
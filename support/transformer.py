@@ -9,12 +9,17 @@
 
 from support.parameters import *
 from support.messenger import Messenger
+from support.sqlite_replica import SQLiteReplica, isSQLiteReplica, tableNameOf
+from support.row_keys import rowKeys
+from support.catalog import catalogOf
+from support.sync_state import syncStateFor, establishWatermarks, overallWatermarkOf, tableKeyOf
 
 from abc import ABC, abstractmethod
 import support.time as time
 import support.arcpy_proxy as arcpy_proxy
+import support.metrics as metrics
 import os
-import uuid
+import sqlite3
 import arcpy
 
 # Context keys
@@ -23,6 +28,18 @@ LAST_SYNC_TIME = 'LastSynchronisationTime'
 PROCESS_TIME = 'ProcessTime'
 SECTION = 'ProcessSection'
 EXISTING_TABLES = 'ExistingTables'
+TABLE_WATERMARKS = 'TableWatermarks'
+
+# Metric names
+
+ROWS_KEPT = 'ReplicaRowsKept'
+ROWS_DELETED = 'ReplicaRowsDeleted'
+
+CREATION_DATE_FIELD = 'CreationDate'
+SYNCHRONISATION_FIELD = 'SYS_TRANSFER_DATE'
+KEY_FIELD = 'rowid'
+
+CALCULATION_CODE_BLOCK = 'import datetime'
 
 class Transformer(ABC):
     def withContext(self, context):
@@ -49,15 +66,14 @@ class FGDBReprojectionTransformer(Transformer):
         self.messenger = Messenger()
         self.arcpyProxy = arcpy_proxy.ArcpyProxy()
         self.parameters = parametersSupplied
+        self.syncState = syncStateFor(parametersSupplied)
 
     def transform(self, surveyGDB):
         self.messenger.info(f'Transforming survey at [{surveyGDB}]...')
         self.messenger.indent()
 
         self.checkExistingData(surveyGDB)
-        self.filterRecords(surveyGDB)
-        self.addTimeStamp(surveyGDB)
-        self.addKeyFields(surveyGDB)
+        self.transformTables(surveyGDB)
 
         self.messenger.outdent()
         self.messenger.info(f'Done transforming survey at [{surveyGDB}]')
@@ -66,21 +82,26 @@ class FGDBReprojectionTransformer(Transformer):
         self.messenger.info(f'Checking existing data via [{self.parameters[SDE_CONNECTION]}]')
         self.messenger.indent()
 
-        existingDestinationTables = self.arcpyProxy.getSurveyTables(self.parameters[SDE_CONNECTION], self.parameters[PREFIX])
+        # The extractor may already have looked, to scope its replica request to the last synchronisation.
+        watermarkEstablished = EXISTING_TABLES in self.context.keys()
+        if watermarkEstablished:
+            existingDestinationTables = self.context[EXISTING_TABLES]
+        else:
+            existingDestinationTables = catalogOf(self.context).surveyTables(self.parameters[SDE_CONNECTION], self.parameters[PREFIX])
         self.messenger.debug(f'Destination Survey Tables found = {existingDestinationTables}')
 
         usernamePrefix = ''
         destinationDB = self.parameters[SDE_CONNECTION]
         if not destinationDB.endswith('.gdb'):
-            username = arcpy.Describe(destinationDB).connectionProperties.user
+            username = catalogOf(self.context).description(destinationDB).connectionProperties.user
             usernamePrefix = f'{username}.'
 
         if len(existingDestinationTables) > 0:
-            existingExtractedTables = self.arcpyProxy.getSurveyTables(surveyGDB)
+            existingExtractedTables = catalogOf(self.context).surveyTables(surveyGDB)
         
             tablesMatched = 0
             for extractedTable in existingExtractedTables:
-                expectedDestinationTable = f'{usernamePrefix}{self.parameters[PREFIX]}_{extractedTable}'
+                expectedDestinationTable = f'{usernamePrefix}{self.parameters[PREFIX]}_{tableNameOf(extractedTable)}'
                 if expectedDestinationTable not in existingDestinationTables:
                     self.messenger.warn(f'Extracted table [{extractedTable}] has no equivalent [{expectedDestinationTable}] in destination workspace [{self.parameters[SDE_CONNECTION]}]')
                 else:
@@ -93,7 +114,8 @@ class FGDBReprojectionTransformer(Transformer):
                 self.messenger.error(errorMsg)
                 self.arcpyProxy.raiseExecuteError(errorMsg)
 
-            self.getLastSynchronizationTime(existingDestinationTables)
+            if not watermarkEstablished:
+                self.getLastSynchronizationTime(existingDestinationTables)
             if self.context[LAST_SYNC_TIME] != None:
                 self.messenger.info(f'Last synchronisation time established [{time.createTimestampText(self.context[LAST_SYNC_TIME])}]')
             else:
@@ -107,106 +129,159 @@ class FGDBReprojectionTransformer(Transformer):
         self.messenger.info(f'Done checking existing data via [{self.parameters[SDE_CONNECTION]}]')
 
     def getLastSynchronizationTime(self, tableList):
-        # Looks at the existing records in the SDE and returns the latest synchronization time
-        originalWorkspace = arcpy.env.workspace
-        arcpy.env.workspace = self.parameters[SDE_CONNECTION]
-
-        statTables = []
-        #Dummy value to compare time
-        lastSync = time.dummyTimestamp()
-        
-        self.messenger.indent()
-
-        for table in tableList:
-            #Skip if empty table (i.e., no rows)
-            self.messenger.debug(f'Checking sync on table [{table}]')
-            #Just use the last part of the table name
-            tableName = FGDBReprojectionTransformer.lastPartOfTableName(table)
-            rowCheck = arcpy.management.GetCount(tableName)
-            rowCount = int(rowCheck[0])
-            if rowCount > 0:
-                statTable = arcpy.Statistics_analysis(tableName, f'in_memory\stat_{tableName}', "SYS_TRANSFER_DATE MAX")
-                statTables.append(statTable)
-
-        for s in statTables:
-            with arcpy.da.SearchCursor(s, ['MAX_sys_transfer_date']) as rows:
-                for row in rows:
-                    thisDate = row[0]
-                    if thisDate > lastSync:
-                        lastSync = thisDate
-
-        for s in statTables:
-            arcpy.management.Delete(s)
-
-        if lastSync == time.dummyTimestamp():
-            self.context[LAST_SYNC_TIME] =  None
-        else:
-            self.context[LAST_SYNC_TIME] = lastSync
-
-        arcpy.env.workspace = originalWorkspace
-        self.messenger.outdent()
+        # Reads per-table watermarks from the sync state, falling back to the existing records in the SDE
+        self.context[TABLE_WATERMARKS] = establishWatermarks(self.syncState, self.arcpyProxy, \
+            self.parameters[SDE_CONNECTION], self.parameters[PREFIX], tableList)
+        self.context[LAST_SYNC_TIME] = overallWatermarkOf(self.context[TABLE_WATERMARKS])
+
+    def lastSyncTimeOf(self, table):
+        '''The watermark of the destination table a replica table loads into, or the overall one if it has none of its own'''
+        tableWatermarks = self.context.get(TABLE_WATERMARKS, {})
+        destinationKey = tableKeyOf(f'{self.parameters[PREFIX]}_{tableNameOf(table)}')
+        if destinationKey in tableWatermarks.keys():
+            return tableWatermarks[destinationKey]
+        return self.context.get(LAST_SYNC_TIME, None)
+
+    def windowOf(self, table):
+        '''The (exclusive, inclusive) CreationDate bounds of rows to keep, as naive UTC at whole seconds like the stored dates'''
+        lastSyncTime = self.lastSyncTimeOf(table)
+        if lastSyncTime != None:
+            lastSyncTime = time.asNaiveUTC(lastSyncTime).replace(microsecond=0)
+        return lastSyncTime, time.asNaiveUTC(self.context[PROCESS_TIME]).replace(microsecond=0)
 
 
     def lastPartOfTableName(table):
         return table.split(".")[-1]
 
-    def filterRecords(self, surveyGDB):
-        '''Filter the records to those that need to be updated'''
-        #Note - This excludes new entries that are *after* the timestamp
-        #       Depending on how active the survey is, there may have been new submissions
-        #           after the start of the script
-        #       We put in a max time to ensure consistency in operation from run to run and
-        #           table to table
-        
-        self.messenger.info(f'Filtering records to new set since last synchronised...')
-        self.messenger.indent()
-        
-        arcpy.env.workspace = surveyGDB
-        nowText = time.createTimestampText(self.context[PROCESS_TIME])
-        tableList = self.arcpyProxy.getSurveyTables(surveyGDB)
-        dateField = arcpy.AddFieldDelimiters(surveyGDB, "CreationDate")
-        excludeStatement = "CreationDate > date '{1}'".format(dateField, nowText)
-        if LAST_SYNC_TIME in self.context.keys() and self.context[LAST_SYNC_TIME] != None:
-            lastSyncText = time.createTimestampText(self.context[LAST_SYNC_TIME])
-            excludeStatement = f"{excludeStatement} OR CreationDate <= date '{lastSyncText}'"
-
-        self.messenger.info(f'Using view filter exclude statement [{excludeStatement}]')
-        self.messenger.indent()
-
-        i = 0
-        for table in tableList:
-            i = i + 1
-            thisName = f'filterView{str(i)}'
-            dsc = arcpy.Describe(table)
-            if dsc.datatype == u'FeatureClass' or dsc.datatype == u'FeatureLayer':
-                arcpy.management.MakeFeatureLayer(table, thisName, excludeStatement)
-                self.messenger.debug(f'Deleting features from [{table}] as per exclude statement')
-                arcpy.management.DeleteFeatures(thisName)
-            else:
-                arcpy.management.MakeTableView(table, thisName, excludeStatement)
-                self.messenger.debug(f'Deleting rows from table [{table}] as per exclude statement')
-                arcpy.management.DeleteRows(thisName)
-            arcpy.management.Delete(thisName)
-        self.messenger.outdent()
-        
-        self.messenger.outdent()
-        self.messenger.info(f'Done filtering records to new set since last synchronised...')
-
-    def addTimeStamp(self, surveyGDB):
-        # Disables editor tracking, adds and populates the timestamp field
-
-        self.messenger.info(f'Adding syncronization time to tables...')
+    def transformTables(self, surveyGDB):
+        '''Filters, timestamps and keys every replica table in one cursor pass per table, after adding the fields needed up front'''
+        self.messenger.info(f'Transforming replica tables in a single pass each...')
         self.messenger.indent()
 
         arcpy.env.workspace = surveyGDB
-        tableList = self.arcpyProxy.getSurveyTables(surveyGDB)
+        tableList = catalogOf(self.context).surveyTables(surveyGDB)
         self.messenger.debug(f'Survey table list: {tableList}')
 
+        keyedTables = self.tablesNeedingKeys(surveyGDB)
         self.addSynchronisationFields(surveyGDB, tableList)
-        self.setTimestampOnTables(surveyGDB, tableList)
-        
+        self.addKeyFields(surveyGDB, keyedTables)
+        self.rowKeys = rowKeys()
+
+        tablesToFilter = tableList
+        tablesToStamp = tableList
+        if isSQLiteReplica(surveyGDB):
+            tablesToFilter = self.filterRecordsWithSql(surveyGDB, tableList)
+            tablesToStamp = self.setTimestampWithSql(surveyGDB, tableList)
+
+        # Relationship classes may name their tables with or without the 'main.' a mobile geodatabase lists them under.
+        keyedTableKeys = set(tableKeyOf(table) for table in keyedTables)
+        tablesToCalculate = []
+        with arcpy.da.Editor(surveyGDB) as edit:
+            for table in tableList:
+                if self.transformTable(surveyGDB, table, table in tablesToFilter, table in tablesToStamp, tableKeyOf(table) in keyedTableKeys):
+                    tablesToCalculate.append(table)
+        del(edit)
+
+        # CalculateFields is a geoprocessing tool, so runs outside the edit session, with a cursor as the fallback.
+        tablesToWalk = [table for table in tablesToCalculate if not self.calculateTimestamp(os.path.join(surveyGDB, table), table)]
+        if tablesToWalk:
+            with arcpy.da.Editor(surveyGDB) as edit:
+                for table in tablesToWalk:
+                    self.transformTableWithCursor(os.path.join(surveyGDB, table), table, False, True, False)
+            del(edit)
+
         self.messenger.outdent()
-        self.messenger.info(f'Done adding syncronization time to tables...')
+        self.messenger.info(f'Done transforming replica tables')
+
+    def transformTable(self, surveyGDB, table, filtering, stamping, keying):
+        '''Walks a table with a cursor where rows need deleting or keying, answering True if it needs only stamping, left to a field calculation'''
+        if not (filtering or stamping or keying):
+            return False
+
+        FQtable = os.path.join(surveyGDB, table)
+        filtering = filtering and self.hasRowsOutsideWindow(FQtable, table)
+        if not (filtering or keying):
+            return stamping
+        self.transformTableWithCursor(FQtable, table, filtering, stamping, keying)
+        return False
+
+    def hasRowsOutsideWindow(self, FQtable, table):
+        # The replica request is usually filtered to the same window already, so this mostly finds nothing.
+        with arcpy.da.SearchCursor(FQtable, [CREATION_DATE_FIELD], where_clause=self.excludeStatementFor(table)) as rows:
+            return next(iter(rows), None) != None
+
+    def excludeStatementFor(self, table):
+        lastSyncTime, processTime = self.windowOf(table)
+        excludeStatement = f"{CREATION_DATE_FIELD} > date '{time.createTimestampText(processTime)}'"
+        if lastSyncTime != None:
+            excludeStatement = f"{excludeStatement} OR {CREATION_DATE_FIELD} <= date '{time.createTimestampText(lastSyncTime)}'"
+        return excludeStatement
+
+    def transferTimestamp(self):
+        # Whole seconds, as the SQL path writes, and as cleanupAppends and appendAttachments match on.
+        return time.asNaiveUTC(self.context[PROCESS_TIME]).replace(microsecond=0)
+
+    def calculateTimestamp(self, FQtable, table):
+        '''Sets the timestamp of every row in one CalculateFields operation, answering False if arcpy refuses'''
+        timestamp = self.transferTimestamp()
+        fieldExpressions = [[SYNCHRONISATION_FIELD, f'datetime.datetime({timestamp.year}, {timestamp.month}, {timestamp.day}, ' \
+            f'{timestamp.hour}, {timestamp.minute}, {timestamp.second})']]
+
+        try:
+            arcpy.management.CalculateFields(FQtable, 'PYTHON3', fieldExpressions, CALCULATION_CODE_BLOCK)
+        except arcpy.ExecuteError as ex:
+            self.messenger.warn(f'Could not calculate fields on [{table}] [{ex}]. Using a cursor instead.')
+            return False
+
+        kept = int(arcpy.management.GetCount(FQtable)[0])
+        self.messenger.debug(f'Table [{table}]: kept [{kept}] rows, deleted [0] rows')
+        metrics.accumulate(self.context, ROWS_KEPT, kept)
+        return True
+
+    def transformTableWithCursor(self, FQtable, table, filtering, stamping, keying):
+        '''Walks table once, deleting rows outside the synchronisation window, stamping and keying the rest'''
+        fields = [CREATION_DATE_FIELD, SYNCHRONISATION_FIELD, KEY_FIELD]
+        lastSyncTime, processTime = self.windowOf(table)
+        timestamp = self.transferTimestamp()
+        kept = 0
+        deleted = 0
+
+        with arcpy.da.UpdateCursor(FQtable, fields if keying else fields[:-1]) as rows:
+            for row in rows:
+                # Rows without a CreationDate can't be placed outside the window, so are kept, as a date filter would.
+                creationDate = row[0]
+                if filtering and creationDate != None and \
+                        (creationDate > processTime or (lastSyncTime != None and creationDate <= lastSyncTime)):
+                    rows.deleteRow()
+                    deleted += 1
+                    continue
+
+                if stamping:
+                    row[1] = timestamp
+                if keying and row[2] == None:
+                    row[2] = next(self.rowKeys)
+                rows.updateRow(row)
+                kept += 1
+
+        self.messenger.debug(f'Table [{table}]: kept [{kept}] rows, deleted [{deleted}] rows')
+        metrics.accumulate(self.context, ROWS_KEPT, kept)
+        metrics.accumulate(self.context, ROWS_DELETED, deleted)
+
+    def filterRecordsWithSql(self, surveyGDB, tableList):
+        '''Deletes unwanted records from a mobile geodatabase with one statement per table, returning the tables left for arcpy'''
+        tablesRemaining = []
+
+        with SQLiteReplica(surveyGDB) as replica:
+            for table in tableList:
+                try:
+                    deleted = replica.deleteRecordsOutside(table, self.lastSyncTimeOf(table), self.context[PROCESS_TIME])
+                    self.messenger.debug(f'Deleted [{deleted}] records from [{table}] via SQL')
+                    metrics.accumulate(self.context, ROWS_DELETED, deleted)
+                except sqlite3.Error as ex:
+                    self.messenger.warn(f'Could not filter [{table}] via SQL [{ex}]. Filtering with arcpy instead.')
+                    tablesRemaining.append(table)
+
+        return tablesRemaining
 
     def addSynchronisationFields(self, surveyGDB, tableList):
         self.messenger.info(f'Adding synchronisation fields on tables...')
@@ -219,45 +294,51 @@ class FGDBReprojectionTransformer(Transformer):
             arcpy.management.DisableEditorTracking(FQtable)
 
             self.messenger.debug(f'Adding synchronisation field on table [{table}]')
-            arcpy.management.AddField(FQtable, 'SYS_TRANSFER_DATE', 'DATE')
+            arcpy.management.AddField(FQtable, SYNCHRONISATION_FIELD, 'DATE')
+            catalogOf(self.context).invalidate(surveyGDB, table)
 
         self.messenger.outdent()
         self.messenger.info(f'Done adding synchronisation fields on tables')
 
-    def setTimestampOnTables(self, surveyGDB, tableList):
-        timestamp = self.context[PROCESS_TIME]
-
-        self.messenger.info(f'Setting timestamp [{time.createTimestampText(timestamp)}] on tables...')
-        self.messenger.indent()
+    def setTimestampWithSql(self, surveyGDB, tableList):
+        '''Sets the timestamp on a mobile geodatabase with one UPDATE per table, returning the tables left for arcpy'''
+        tablesRemaining = []
 
-        with arcpy.da.Editor(surveyGDB) as edit:
+        with SQLiteReplica(surveyGDB) as replica:
             for table in tableList:
-                FQtable = os.path.join(surveyGDB, table)
-                self.messenger.debug(f'Setting Timestamp on table [{table}]...')
-                with arcpy.da.UpdateCursor(FQtable, ['SYS_TRANSFER_DATE']) as rows:
-                    for row in rows:
-                        rows.updateRow([timestamp])
-        del(edit)
+                try:
+                    updated = replica.setColumn(table, SYNCHRONISATION_FIELD, self.context[PROCESS_TIME])
+                    self.messenger.debug(f'Set timestamp on [{updated}] records of [{table}] via SQL')
+                except sqlite3.Error as ex:
+                    self.messenger.warn(f'Could not set timestamp on [{table}] via SQL [{ex}]. Using arcpy instead.')
+                    tablesRemaining.append(table)
 
-        self.messenger.outdent()
-        self.messenger.info(f'Done setting timestamps on tables')
+        return tablesRemaining
 
-    def addKeyFields(self, workspace):
+    def tablesNeedingKeys(self, workspace):
         '''To enable transfer of attachments with repeats, we need an additional GUID field to serve as a lookup'''
         arcpy.env.workspace = workspace
-        dscW = arcpy.Describe(workspace)
         tableList = []
-        relClasses = [c.name for c in dscW.children if c.datatype == u'RelationshipClass']
-        for child in relClasses:
-            dscRC = arcpy.Describe(child)
+        for dscRC in catalogOf(self.context).relationshipClasses(workspace):
             if dscRC.isAttachmentRelationship:
                 originTable = dscRC.originClassNames[0]
-                originFieldNames = [f.name for f in arcpy.ListFields(originTable)]
-                if 'rowid' not in originFieldNames:
-                    arcpy.management.AddField(originTable, 'rowid', 'GUID')
-                    with arcpy.da.Editor(workspace) as edit:
-                        with arcpy.da.UpdateCursor(originTable, ['rowid']) as urows:
-                            for urow in urows:
-                                urow[0] = '{' + str(uuid.uuid4()) + '}'
-                                urows.updateRow(urow)
-                    del(edit)
+                if originTable not in tableList and not self.hasKeysPopulated(workspace, originTable):
+                    tableList.append(originTable)
+        return tableList
+
+    def hasKeysPopulated(self, workspace, table):
+        if not self.hasKeyField(workspace, table):
+            return False
+        with arcpy.da.SearchCursor(table, [KEY_FIELD], where_clause=f'{KEY_FIELD} IS NULL') as rows:
+            return next(iter(rows), None) == None
+
+    def hasKeyField(self, workspace, table):
+        return KEY_FIELD in catalogOf(self.context).fieldNamesOf(workspace, table)
+
+    def addKeyFields(self, workspace, tableList):
+        for table in tableList:
+            if self.hasKeyField(workspace, table):
+                continue
+            self.messenger.debug(f'Adding key field on table [{table}]')
+            arcpy.management.AddField(os.path.join(workspace, table), KEY_FIELD, 'GUID')
+            catalogOf(self.context).invalidate(workspace, table)
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: support/unzipper.py
+# Purpose: To extract a zip archive from a stream as its bytes arrive
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+from support.messenger import Messenger
+
+import os
+import struct
+import zlib
+
+# See: https://pkware.cachefly.net/webdocs/casestudies/APPNOTE.TXT
+
+LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+CENTRAL_DIRECTORY_SIGNATURE = b'PK\x01\x02'
+END_OF_CENTRAL_DIRECTORY_SIGNATURE = b'PK\x05\x06'
+DATA_DESCRIPTOR_SIGNATURE = b'PK\x07\x08'
+
+# signature, version, flags, method, time, date, crc32, compressed size, uncompressed size, name length, extra length
+LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+
+ZIP64_EXTRA_FIELD_ID = 0x0001
+ZIP64_SIZE_MARKER = 0xFFFFFFFF
+
+METHOD_STORED = 0
+METHOD_DEFLATED = 8
+
+FLAG_ENCRYPTED = 0x0001
+FLAG_DATA_DESCRIPTOR = 0x0008
+FLAG_UTF8_NAMES = 0x0800
+
+
+class UnsupportedZipStreamError(Exception):
+    '''Raised when an archive uses features that can only be read from a complete file'''
+
+
+class CorruptZipStreamError(Exception):
+    '''Raised when a streamed member fails its CRC check or the archive structure is not recognised'''
+
+
+class TruncatedZipStreamError(Exception):
+    '''Raised when the stream ends part-way through the archive'''
+
+
+class ChunkReader():
+    '''Reads a response in fixed-size chunks, allowing over-read bytes to be pushed back'''
+
+    def __init__(self, response, chunkBytes):
+        self.response = response
+        self.buffer = bytearray(chunkBytes)
+        self.pending = b''
+        self.bytesRead = 0
+
+    def readSome(self, limit):
+        if len(self.pending) > 0:
+            data, self.pending = self.pending[:limit], self.pending[limit:]
+            return data
+        view = memoryview(self.buffer)[:min(limit, len(self.buffer))]
+        count = self.response.readinto(view)
+        self.bytesRead += count or 0
+        return bytes(view[:count or 0])
+
+    def readExact(self, count):
+        data = b''
+        while len(data) < count:
+            more = self.readSome(count - len(data))
+            if len(more) == 0:
+                raise TruncatedZipStreamError(f'Stream ended after [{self.bytesRead}] bytes, expecting [{count - len(data)}] more')
+            data += more
+        return data
+
+    def unread(self, data):
+        self.pending = data + self.pending
+
+    def drain(self):
+        while len(self.readSome(len(self.buffer))) > 0:
+            pass
+
+
+class StreamingUnzipper():
+    '''Writes each member of a zip stream to disk once, as it arrives, verifying its CRC'''
+
+    def __init__(self, chunkBytes):
+        self.messenger = Messenger()
+        self.chunkBytes = chunkBytes
+
+    def extract(self, response, outDir):
+        '''Extracts the archive read from response into outDir, returning the member names in archive order'''
+        reader = ChunkReader(response, self.chunkBytes)
+        memberNames = []
+
+        while True:
+            signature = reader.readExact(4)
+            if signature == LOCAL_HEADER_SIGNATURE:
+                memberNames.append(self.extractMember(reader, outDir))
+            elif signature in [CENTRAL_DIRECTORY_SIGNATURE, END_OF_CENTRAL_DIRECTORY_SIGNATURE]:
+                # Everything after the last member is directory information we have no use for.
+                reader.drain()
+                break
+            else:
+                raise CorruptZipStreamError(f'Unexpected zip record signature [{signature}] after [{reader.bytesRead}] bytes')
+
+        if len(memberNames) == 0:
+            raise CorruptZipStreamError('Zip stream held no members')
+        return memberNames
+
+    def extractMember(self, reader, outDir):
+        (signature, version, flags, method, modTime, modDate, crc, compressedSize, uncompressedSize, nameLength, extraLength) = \
+            LOCAL_HEADER.unpack(LOCAL_HEADER_SIGNATURE + reader.readExact(LOCAL_HEADER.size - 4))
+
+        if flags & FLAG_ENCRYPTED:
+            raise UnsupportedZipStreamError('Encrypted zip members cannot be streamed')
+        if method not in [METHOD_STORED, METHOD_DEFLATED]:
+            raise UnsupportedZipStreamError(f'Zip compression method [{method}] cannot be streamed')
+        hasDescriptor = flags & FLAG_DATA_DESCRIPTOR != 0
+        if method == METHOD_STORED and hasDescriptor:
+            raise UnsupportedZipStreamError('Stored zip members of unknown size cannot be streamed')
+
+        name = reader.readExact(nameLength).decode('utf-8' if flags & FLAG_UTF8_NAMES else 'cp437')
+        extra = reader.readExact(extraLength)
+        zip64Field = self.zip64FieldOf(extra)
+        if compressedSize == ZIP64_SIZE_MARKER or uncompressedSize == ZIP64_SIZE_MARKER:
+            compressedSize = self.zip64CompressedSize(zip64Field, uncompressedSize)
+        if hasDescriptor:
+            compressedSize = None
+
+        targetPath = self.targetPathOf(outDir, name)
+        if name.endswith('/'):
+            os.makedirs(targetPath, exist_ok=True)
+            actualCrc = self.extractData(reader, None, method, compressedSize)
+        else:
+            os.makedirs(os.path.dirname(targetPath), exist_ok=True)
+            with open(targetPath, 'wb') as output:
+                actualCrc = self.extractData(reader, output, method, compressedSize)
+
+        if hasDescriptor:
+            crc = self.readDataDescriptorCrc(reader, zip64Field != None)
+
+        if actualCrc != crc:
+            raise CorruptZipStreamError(f'Zip member [{name}] failed CRC check')
+
+        self.messenger.debug(f'Extracted zip member [{name}]')
+        return name
+
+    def targetPathOf(self, outDir, name):
+        normalised = os.path.normpath(name)
+        if os.path.isabs(normalised) or normalised.startswith('..') or ':' in normalised:
+            raise CorruptZipStreamError(f'Zip member [{name}] would extract outside [{outDir}]')
+        return os.path.join(outDir, normalised)
+
+    def zip64FieldOf(self, extra):
+        offset = 0
+        while offset + 4 <= len(extra):
+            fieldId, fieldLength = struct.unpack_from('<HH', extra, offset)
+            if fieldId == ZIP64_EXTRA_FIELD_ID:
+                return extra[offset + 4:offset + 4 + fieldLength]
+            offset += 4 + fieldLength
+        return None
+
+    def zip64CompressedSize(self, zip64Field, uncompressedSize):
+        if zip64Field == None:
+            raise CorruptZipStreamError('Zip64 member is missing its extended size field')
+        # The uncompressed size comes first, but only when the header marks it as overflowing.
+        return struct.unpack_from('<Q', zip64Field, 8 if uncompressedSize == ZIP64_SIZE_MARKER else 0)[0]
+
+    def extractData(self, reader, output, method, compressedSize):
+        if method == METHOD_STORED:
+            return self.copyStored(reader, output, compressedSize)
+        return self.inflate(reader, output, compressedSize)
+
+    def copyStored(self, reader, output, size):
+        crc = 0
+        remaining = size
+        while remaining > 0:
+            data = reader.readSome(min(remaining, self.chunkBytes))
+            if len(data) == 0:
+                raise TruncatedZipStreamError(f'Stream ended with [{remaining}] bytes of a stored member outstanding')
+            if output != None:
+                output.write(data)
+            crc = zlib.crc32(data, crc)
+            remaining -= len(data)
+        return crc
+
+    def inflate(self, reader, output, compressedSize):
+        crc = 0
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        remaining = compressedSize
+        while not decompressor.eof:
+            limit = self.chunkBytes if remaining == None else min(remaining, self.chunkBytes)
+            data = reader.readSome(limit) if limit > 0 else b''
+            if len(data) == 0:
+                raise TruncatedZipStreamError('Stream ended part-way through a compressed member')
+            if remaining != None:
+                remaining -= len(data)
+            try:
+                inflated = decompressor.decompress(data)
+            except zlib.error as ex:
+                raise CorruptZipStreamError(f'Compressed member could not be inflated [{ex}]')
+            if output != None:
+                output.write(inflated)
+            crc = zlib.crc32(inflated, crc)
+
+        # The deflate stream knows where it ends; anything read past that belongs to the next record.
+        reader.unread(decompressor.unused_data)
+        return crc
+
+    def readDataDescriptorCrc(self, reader, isZip64):
+        crcOrSignature = reader.readExact(4)
+        if crcOrSignature == DATA_DESCRIPTOR_SIGNATURE:
+            crcOrSignature = reader.readExact(4)
+        reader.readExact(16 if isZip64 else 8)
+        return struct.unpack('<I', crcOrSignature)[0]
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: tests/support/test_append_scheduler.py
+# Purpose: Testing harness for support/append_scheduler.py
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+import pytest
+from unittest.mock import patch
+
+import arcpy
+
+from support.append_scheduler import AppendScheduler, AppendTask, appendDependenciesOf, appendTableInWorker
+
+
+class FakeRelationshipClass():
+    def __init__(self, origin, destination, isAttachmentRelationship=False):
+        self.originClassNames = [origin]
+        self.destinationClassNames = [destination]
+        self.isAttachmentRelationship = isAttachmentRelationship
+
+
+def tasksFor(tableList):
+    return { table: AppendTask(table, f'c:/tmp/some_destination.gdb/myprefix_{table}', [['OBJECTID', 'OBJECTID']]) for table in tableList }
+
+
+@pytest.mark.usefixtures("resetArcpy", "resetMessengerSingleton")
+class TestAppendScheduler:
+
+    def test_appendDependenciesOf_relates_repeats_to_their_origin(self):
+        # given
+
+        relationshipClasses = [
+            FakeRelationshipClass('survey', 'repeat'),
+            FakeRelationshipClass('main.repeat', 'main.nested_repeat'),
+            FakeRelationshipClass('survey', 'survey__ATTACH', isAttachmentRelationship=True)
+        ]
+
+        # when
+
+        dependencies = appendDependenciesOf(relationshipClasses, ['survey', 'repeat', 'nested_repeat', 'lookup'])
+
+        # then
+
+        assert dependencies == { 'survey': [], 'repeat': ['survey'], 'nested_repeat': ['repeat'], 'lookup': [] }
+
+    def test_AppendScheduler_in_process_appends_origins_first_and_stops_dependents_of_failures(self):
+        # given
+
+        appended = []
+
+        def fakeAppend(table, destination, schemaType, fieldMappings):
+            appended.append(table)
+            if table == 'repeat':
+                raise RuntimeError('table locked')
+
+        tasks = tasksFor(['nested_repeat', 'repeat', 'survey', 'lookup'])
+        dependencies = { 'nested_repeat': ['repeat'], 'repeat': ['survey'], 'survey': [], 'lookup': [] }
+
+        # when
+
+        with patch('support.append_scheduler.arcpy.management.Append', fakeAppend):
+            results = []
+            scheduler = AppendScheduler(1, 'replica.gdb', 'GDA2020_MGA_Zone_56', 'WGS_1984_2_To_GDA2020').run(tasks, dependencies)
+            with pytest.raises(RuntimeError, match='table locked'):
+                for result in scheduler:
+                    results.append(result)
+
+        # then
+
+        assert appended == ['survey', 'repeat']
+        assert [result.table for result in results] == ['survey']
+        assert len(results[0].messages) == 2
+
+    def test_appendTableInWorker_reports_failure_to_rebuild_in_parent(self):
+        # given
+
+        def fakeFailingAppend(table, destination, schemaType, fieldMappings):
+            raise arcpy.ExecuteError('ERROR 000224: Cannot insert features')
+
+        def fakeLockedAppend(table, destination, schemaType, fieldMappings):
+            raise PermissionError('table locked')
+
+        task = tasksFor(['survey'])['survey']
+
+        # when
+
+        with patch('support.append_scheduler.arcpy.management.Append', fakeFailingAppend):
+            executeResult = appendTableInWorker(task)
+        with patch('support.append_scheduler.arcpy.management.Append', fakeLockedAppend):
+            lockedResult = appendTableInWorker(task)
+
+        # then
+
+        assert len(executeResult.messages) == 1
+        rebuiltError = executeResult.failure.rebuild()
+        assert isinstance(rebuiltError, arcpy.ExecuteError)
+        assert str(rebuiltError) == 'error one\nerror two'
+        assert rebuiltError.arcpyWarnings == 'warning one\nwarning two'
+
+        rebuiltError = lockedResult.failure.rebuild()
+        assert type(rebuiltError) == PermissionError
+        assert str(rebuiltError) == 'table locked'
+
+    def test_AppendScheduler_in_pool_appends_every_table_after_its_origin(self):
+        # given
+
+        tasks = tasksFor(['repeat', 'survey', 'lookup', 'other_survey'])
+        dependencies = { 'repeat': ['survey'], 'survey': [], 'lookup': [], 'other_survey': [] }
+
+        # when
+
+        results = list(AppendScheduler(2, 'replica.gdb', 'GDA2020_MGA_Zone_56', 'WGS_1984_2_To_GDA2020').run(tasks, dependencies))
+
+        # then
+
+        finishOrder = [result.table for result in results]
+        assert sorted(finishOrder) == ['lookup', 'other_survey', 'repeat', 'survey']
+        assert finishOrder.index('survey') < finishOrder.index('repeat')
+        assert all(result.failure == None for result in results)
+
+    def test_AppendScheduler_refuses_tables_waiting_on_each_other(self):
+        # given
+
+        tasks = tasksFor(['survey', 'repeat'])
+        dependencies = { 'survey': ['repeat'], 'repeat': ['survey'] }
+
+        # when / then
+
+        with pytest.raises(Exception, match='wait on each other'):
+            list(AppendScheduler(1, 'replica.gdb', 'GDA2020_MGA_Zone_56', 'WGS_1984_2_To_GDA2020').run(tasks, dependencies))
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: tests/support/test_arcpy_proxy.py
+# Purpose: Testing harness for support/arcpy_proxy.py
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+import datetime
+
+import pytest
+from unittest.mock import patch
+
+import arcpy
+
+from support.arcpy_proxy import ArcpyProxy
+
+
+class FakeSQLExecute():
+    statements = []
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, statement):
+        FakeSQLExecute.statements.append(statement)
+        return '2024-06-01 08:30:00.123000'
+
+
+class FakeFailingSQLExecute(FakeSQLExecute):
+    def execute(self, statement):
+        raise arcpy.ExecuteError('ArcSDESQLExecute not supported')
+
+
+class FakeNewestFirstCursor(arcpy.da.Cursor):
+    newestPerTable = {
+        'prefix_survey': datetime.datetime(2024, 6, 1, 8, 30, 0),
+        'prefix_repeat': datetime.datetime(2024, 6, 2, 9, 0, 0),
+    }
+    requests = []
+
+    def __init__(self, table, fields, where_clause = None, sql_clause = None):
+        FakeNewestFirstCursor.requests.append((table, where_clause, sql_clause))
+        newest = FakeNewestFirstCursor.newestPerTable.get(table, None)
+        self.rows = [] if newest == None else [[newest], [newest - datetime.timedelta(days=1)]]
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+@pytest.mark.usefixtures("resetArcpy", "resetMessengerSingleton")
+class TestArcpyProxy:
+
+    def test_getLastSynchronizationTime_queries_enterprise_geodatabase_once(self):
+        # given
+
+        FakeSQLExecute.statements = []
+        tables = ['db.owner.prefix_survey', 'db.owner.prefix_repeat']
+
+        # when
+
+        with patch('support.arcpy_proxy.arcpy.ArcSDESQLExecute', FakeSQLExecute),\
+             patch('support.arcpy_proxy.arcpy.da.SearchCursor', FakeNewestFirstCursor):
+            lastSync = ArcpyProxy().getLastSynchronizationTime('c:/connections/survey.sde', tables)
+
+        # then
+
+        assert lastSync == datetime.datetime(2024, 6, 1, 8, 30, 0, 123000)
+        assert FakeSQLExecute.statements == [
+            'SELECT MAX(sync_date) FROM (SELECT MAX(SYS_TRANSFER_DATE) AS sync_date FROM db.owner.prefix_survey ' +
+            'UNION ALL SELECT MAX(SYS_TRANSFER_DATE) AS sync_date FROM db.owner.prefix_repeat) maxima'
+        ]
+
+    def test_getLastSynchronizationTime_scans_versioned_tables(self):
+        # given
+
+        FakeSQLExecute.statements = []
+        FakeNewestFirstCursor.requests = []
+        tables = ['db.owner.prefix_survey', 'db.owner.prefix_repeat']
+
+        class FakeDescription():
+            def __init__(self, path):
+                self.isVersioned = path.endswith('prefix_repeat')
+
+        # when
+
+        with patch('support.arcpy_proxy.arcpy.ArcSDESQLExecute', FakeSQLExecute),\
+             patch('support.arcpy_proxy.arcpy.Describe', FakeDescription),\
+             patch('support.arcpy_proxy.arcpy.da.SearchCursor', FakeNewestFirstCursor):
+            lastSync = ArcpyProxy().getLastSynchronizationTime('c:/connections/survey.sde', tables)
+
+        # then
+
+        assert FakeSQLExecute.statements == [
+            'SELECT MAX(sync_date) FROM (SELECT MAX(SYS_TRANSFER_DATE) AS sync_date FROM db.owner.prefix_survey) maxima'
+        ]
+        assert [table for table, where, sql in FakeNewestFirstCursor.requests] == ['prefix_repeat']
+        assert lastSync == datetime.datetime(2024, 6, 2, 9, 0, 0)
+
+    def test_getLastSynchronizationTime_scans_when_query_fails(self):
+        # given
+
+        FakeNewestFirstCursor.requests = []
+        tables = ['db.owner.prefix_survey', 'db.owner.prefix_repeat', 'db.owner.prefix_empty']
+
+        # when
+
+        with patch('support.arcpy_proxy.arcpy.ArcSDESQLExecute', FakeFailingSQLExecute),\
+             patch('support.arcpy_proxy.arcpy.da.SearchCursor', FakeNewestFirstCursor):
+            lastSync = ArcpyProxy().getLastSynchronizationTime('c:/connections/survey.sde', tables)
+
+        # then
+
+        assert lastSync == datetime.datetime(2024, 6, 2, 9, 0, 0)
+        assert [table for table, where, sql in FakeNewestFirstCursor.requests] == ['prefix_survey', 'prefix_repeat', 'prefix_empty']
+        assert all(sql == (None, 'ORDER BY SYS_TRANSFER_DATE DESC') for table, where, sql in FakeNewestFirstCursor.requests)
+
+    def test_getLastSynchronizationTime_scans_file_geodatabase(self):
+        # given
+
+        FakeSQLExecute.statements = []
+
+        # when
+
+        with patch('support.arcpy_proxy.arcpy.ArcSDESQLExecute', FakeSQLExecute),\
+             patch('support.arcpy_proxy.arcpy.da.SearchCursor', FakeNewestFirstCursor):
+            lastSync = ArcpyProxy().getLastSynchronizationTime('c:/tmp/destination.gdb', ['prefix_survey'])
+            neverSynchronised = ArcpyProxy().getLastSynchronizationTime('c:/tmp/destination.gdb', ['prefix_empty'])
+
+        # then
+
+        assert lastSync == datetime.datetime(2024, 6, 1, 8, 30, 0)
+        assert neverSynchronised == None
+        assert FakeSQLExecute.statements == []
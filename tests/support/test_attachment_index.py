@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: tests/support/test_attachment_index.py
+# Purpose: Testing harness for support/attachment_index.py
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+import pytest
+
+from support.attachment_index import AttachmentIndex, attachmentHashOf
+
+import sqlite3
+
+DESTINATION = 'c:/connections/survey.sde'
+
+
+@pytest.mark.usefixtures("resetArcpy", "resetMessengerSingleton")
+class TestAttachmentIndex:
+
+    def test_AttachmentIndex_holds_back_stored_copies_until_commit(self, tmp_path):
+        # given
+
+        contentHash = attachmentHashOf(b'photo')
+        indexUnderTest = AttachmentIndex(DESTINATION, str(tmp_path))
+        indexUnderTest.markSeen(contentHash)
+        indexUnderTest.recordStored(contentHash, 'prefix_survey__ATTACH', 7, 5)
+
+        # when
+
+        beforeCommit = AttachmentIndex(DESTINATION, str(tmp_path)).storedCopyOf(contentHash)
+        indexUnderTest.commit()
+        indexUnderTest.close()
+
+        # then
+
+        assert indexUnderTest.seenThisRun(contentHash)
+        assert beforeCommit == None
+        assert AttachmentIndex(DESTINATION, str(tmp_path)).storedCopyOf(contentHash) == ('prefix_survey__ATTACH', 7)
+        assert AttachmentIndex('c:/connections/other.sde', str(tmp_path)).storedCopyOf(contentHash) == None
+        assert not AttachmentIndex(DESTINATION, str(tmp_path)).seenThisRun(contentHash)
+
+    def test_AttachmentIndex_records_references_and_forgets_lost_copies(self, tmp_path):
+        # given
+
+        contentHash = attachmentHashOf(b'photo')
+        indexUnderTest = AttachmentIndex(DESTINATION, str(tmp_path))
+        indexUnderTest.recordStored(contentHash, 'prefix_survey__ATTACH', 7, 5)
+        indexUnderTest.recordReference(contentHash, '{REL-GUID}', 'photo.jpg')
+        indexUnderTest.commit()
+
+        # when
+
+        indexUnderTest.forget(contentHash)
+        indexUnderTest.close()
+
+        # then
+
+        assert AttachmentIndex(DESTINATION, str(tmp_path)).storedCopyOf(contentHash) == None
+        connection = sqlite3.connect(str(tmp_path / 'attachment_index.sqlite'))
+        assert connection.execute('SELECT content_hash, rel_globalid, att_name FROM attachment_references').fetchall() == \
+            [(contentHash, '{REL-GUID}', 'photo.jpg')]
+        connection.close()
+
+    def test_AttachmentIndex_without_cache_directory_covers_the_run_only(self):
+        # given
+
+        indexUnderTest = AttachmentIndex(DESTINATION)
+
+        # when
+
+        indexUnderTest.markSeen(attachmentHashOf(b'photo'))
+        indexUnderTest.commit()
+
+        # then
+
+        assert indexUnderTest.seenThisRun(attachmentHashOf(b'photo'))
+        assert indexUnderTest.storedCopyOf(attachmentHashOf(b'photo')) == None
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: tests/support/test_attachments.py
+# Purpose: Testing harness for support/attachments.py
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+from io import BytesIO
+
+import json
+import threading
+import urllib.parse
+
+from support.parameters import *
+
+import pytest
+from unittest.mock import patch
+
+from support.attachments import AttachmentFetcher
+from support.downloader import IncompleteDownloadError
+import support.metrics as metrics
+
+LAYER_URL = 'https://yaddayaddayadda.com/rest-of-url/0'
+
+
+class FakeHttpResponse(BytesIO):
+    def __init__(self, content, status = 200):
+        BytesIO.__init__(self, content)
+        self.status = status
+        self.headers = { 'Content-Length': str(len(content)) }
+
+
+class FakeAttachmentServer():
+    def __init__(self, attachments, failuresBeforeSuccess = 0, truncate = False, pageSize = None):
+        self.attachments = attachments
+        self.pageSize = pageSize
+        self.failuresBeforeSuccess = failuresBeforeSuccess
+        self.truncate = truncate
+        self.lock = threading.Lock()
+        self.active = 0
+        self.mostActive = 0
+        self.fetchAttempts = {}
+        self.definitionExpressions = []
+        self.resultOffsets = []
+
+    def open(self, url, prameters = None, headers = None):
+        parts = urllib.parse.urlsplit(url)
+        if parts.path.endswith('/queryAttachments'):
+            query = urllib.parse.parse_qs(prameters.decode('utf-8'))
+            self.definitionExpressions.append(query['definitionExpression'][0])
+            offset = int(query.get('resultOffset', ['0'])[0])
+            self.resultOffsets.append(offset)
+            pageEnd = len(self.attachments) if self.pageSize == None else offset + self.pageSize
+            groups = {}
+            for attachmentId, (parent, content) in list(self.attachments.items())[offset:pageEnd]:
+                groups.setdefault(parent, []).append({
+                    'id': attachmentId, 'name': f'photo{attachmentId}.jpg', 'contentType': 'image/jpeg',
+                    'size': len(content), 'url': f'{LAYER_URL}/attachments/{attachmentId}'
+                })
+            response = { 'attachmentGroups': [ { 'parentGlobalId': parent, 'attachmentInfos': infos } for parent, infos in groups.items() ],
+                         'exceededTransferLimit': pageEnd < len(self.attachments) }
+            return FakeHttpResponse(json.dumps(response).encode('utf-8'))
+
+        attachmentId = int(parts.path.split('/')[-1])
+        with self.lock:
+            self.active += 1
+            self.mostActive = max(self.mostActive, self.active)
+            attempts = self.fetchAttempts.get(attachmentId, 0) + 1
+            self.fetchAttempts[attachmentId] = attempts
+        try:
+            threading.Event().wait(0.01)
+            if attempts <= self.failuresBeforeSuccess:
+                raise ConnectionResetError('Connection reset by peer')
+            content = self.attachments[attachmentId][1]
+            return FakeHttpResponse(content[:-1] if self.truncate else content)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+class FakeInsertCursor():
+    instances = []
+
+    def __init__(self, in_table, field_names):
+        self.table = in_table
+        self.rows = []
+        FakeInsertCursor.instances.append(self)
+
+    def insertRow(self, row):
+        self.rows.append(row)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, exception_traceback):
+        pass
+
+
+def noSleep(seconds):
+    pass
+
+
+@pytest.mark.usefixtures("useTestDataDirectory", "resetArcpy", "resetMessengerSingleton")
+class TestAttachmentFetcher:
+
+    def test_AttachmentFetcher_fetches_concurrently_within_limit(self):
+        # given
+
+        attachments = { index: (f'{{parent-{index % 3}}}', f'photo bytes {index}'.encode('utf-8') * 100) for index in range(1, 13) }
+        fakeServer = FakeAttachmentServer(attachments)
+        FakeInsertCursor.instances = []
+        context = {}
+
+        with patch('support.attachments.HttpSession.open', fakeServer.open),\
+             patch('support.attachments.arcpy.da.InsertCursor', FakeInsertCursor):
+
+            fetcherUnderTest = AttachmentFetcher({ ATTACHMENT_WORKERS: '3' }).withContext(context)
+
+            # when
+
+            fetcherUnderTest.fetchInto('survey.gdb', 'survey', LAYER_URL, "CreationDate > timestamp '2024-06-01 08:30:00'", 'someToken')
+
+        # then
+
+        assert fakeServer.definitionExpressions == ["CreationDate > timestamp '2024-06-01 08:30:00'"]
+        assert fakeServer.resultOffsets == [0]
+        assert fakeServer.mostActive <= 3
+
+        insertedRows = FakeInsertCursor.instances[0].rows
+        assert FakeInsertCursor.instances[0].table.endswith('survey__ATTACH')
+        assert sorted(row[2] for row in insertedRows) == sorted(f'photo{index}.jpg' for index in attachments.keys())
+        assert all(row[4] == attachments[int(row[2][5:-4])][1] for row in insertedRows)
+        assert all(row[0] == attachments[int(row[2][5:-4])][0] for row in insertedRows)
+
+        assert metrics.valueOf(context, 'AttachmentsFetched') == 12
+        assert metrics.valueOf(context, 'AttachmentBytesFetched') == sum(len(content) for parent, content in attachments.values())
+
+    def test_AttachmentFetcher_pages_attachment_infos_and_bounds_downloads_ahead(self):
+        # given
+
+        attachments = { index: (f'{{parent-{index}}}', f'photo bytes {index}'.encode('utf-8')) for index in range(1, 26) }
+        fakeServer = FakeAttachmentServer(attachments, pageSize = 10)
+        FakeInsertCursor.instances = []
+        downloadsAheadOfInserts = []
+
+        class RecordingInsertCursor(FakeInsertCursor):
+            def insertRow(self, row):
+                FakeInsertCursor.insertRow(self, row)
+                with fakeServer.lock:
+                    downloadsAheadOfInserts.append(len(fakeServer.fetchAttempts) - len(self.rows))
+
+        with patch('support.attachments.HttpSession.open', fakeServer.open),\
+             patch('support.attachments.arcpy.da.InsertCursor', RecordingInsertCursor):
+
+            fetcherUnderTest = AttachmentFetcher({ ATTACHMENT_WORKERS: '2' }).withContext({})
+
+            # when
+
+            fetcherUnderTest.fetchInto('survey.gdb', 'survey', LAYER_URL, '', 'someToken')
+
+        # then
+
+        assert fakeServer.resultOffsets == [0, 10, 20]
+        assert sorted(row[2] for row in FakeInsertCursor.instances[0].rows) == sorted(f'photo{index}.jpg' for index in attachments.keys())
+        assert max(downloadsAheadOfInserts) < 2 * 2
+
+    def test_AttachmentFetcher_retries_dropped_downloads(self):
+        # given
+
+        attachments = { 1: ('{parent-1}', b'some photo') }
+        fakeServer = FakeAttachmentServer(attachments, failuresBeforeSuccess = 2)
+        FakeInsertCursor.instances = []
+
+        with patch('support.attachments.HttpSession.open', fakeServer.open),\
+             patch('support.attachments.arcpy.da.InsertCursor', FakeInsertCursor),\
+             patch('support.attachments.time.sleep', noSleep):
+
+            fetcherUnderTest = AttachmentFetcher({}).withContext({})
+
+            # when
+
+            fetcherUnderTest.fetchInto('survey.gdb', 'survey', LAYER_URL, '', 'someToken')
+
+        # then
+
+        assert fakeServer.fetchAttempts[1] == 3
+        assert FakeInsertCursor.instances[0].rows[0][4] == b'some photo'
+
+    def test_AttachmentFetcher_rejects_truncated_attachment(self):
+        # given
+
+        attachments = { 1: ('{parent-1}', b'some photo') }
+        fakeServer = FakeAttachmentServer(attachments, truncate = True)
+
+        with patch('support.attachments.HttpSession.open', fakeServer.open),\
+             patch('support.attachments.arcpy.da.InsertCursor', FakeInsertCursor),\
+             patch('support.attachments.time.sleep', noSleep):
+
+            fetcherUnderTest = AttachmentFetcher({ DOWNLOAD_RETRIES: '1' }).withContext({})
+
+            # when/then
+
+            with pytest.raises(IncompleteDownloadError):
+                fetcherUnderTest.fetchInto('survey.gdb', 'survey', LAYER_URL, '', 'someToken')
+
+        assert fakeServer.fetchAttempts[1] == 2
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: tests/support/test_catalog.py
+# Purpose: Testing harness for support/catalog.py
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+import pytest
+from unittest.mock import patch
+
+from support.catalog import WorkspaceCatalog, catalogOf
+
+import os
+import arcpy
+
+
+class FakeDescription():
+    def __init__(self, name, datatype = 'Workspace', children = []):
+        self.name = name
+        self.datatype = datatype
+        self.children = children
+
+
+class FakeWorkspace():
+    def __init__(self):
+        self.listCalls = 0
+        self.describeCalls = []
+        self.listFieldsCalls = []
+        self.descriptions = {
+            'replica.gdb': FakeDescription('replica.gdb', children=[
+                FakeDescription('survey__ATTACHREL', 'RelationshipClass'),
+                FakeDescription('other_rel', 'RelationshipClass'),
+                FakeDescription('survey', 'FeatureClass')
+            ])
+        }
+
+    def ListFeatureClasses(self, wildcard):
+        self.listCalls += 1
+        return ['survey']
+
+    def ListTables(self, wildcard):
+        return ['repeat', 'survey__ATTACH']
+
+    def Describe(self, name):
+        self.describeCalls.append(name)
+        return self.descriptions.get(name, FakeDescription(os.path.basename(name), 'Table'))
+
+    def ListFields(self, table):
+        self.listFieldsCalls.append(table)
+        return [arcpy.Field('objectid')]
+
+
+@pytest.mark.usefixtures("resetArcpy", "resetMessengerSingleton")
+class TestWorkspaceCatalog:
+
+    def test_WorkspaceCatalog_reads_each_workspace_once(self):
+        # given
+
+        fakeWorkspace = FakeWorkspace()
+        catalogUnderTest = catalogOf({})
+
+        with patch('support.catalog.arcpy.ListFeatureClasses', fakeWorkspace.ListFeatureClasses),\
+             patch('support.catalog.arcpy.ListTables', fakeWorkspace.ListTables),\
+             patch('support.catalog.arcpy.Describe', fakeWorkspace.Describe),\
+             patch('support.catalog.arcpy.ListFields', fakeWorkspace.ListFields):
+
+            # when
+
+            for attempt in range(3):
+                tables = catalogUnderTest.surveyTables('replica.gdb')
+                datatype = catalogUnderTest.datatypeOf('replica.gdb', 'repeat')
+                fieldNames = catalogUnderTest.fieldNamesOf('replica.gdb', 'repeat')
+
+        # then
+
+        assert tables == ['survey', 'repeat']
+        assert datatype == 'Table'
+        assert fieldNames == ['objectid']
+        assert fakeWorkspace.listCalls == 1
+        assert fakeWorkspace.describeCalls == [os.path.join('replica.gdb', 'repeat')]
+        assert fakeWorkspace.listFieldsCalls == [os.path.join('replica.gdb', 'repeat')]
+
+    def test_WorkspaceCatalog_rereads_what_was_invalidated(self):
+        # given
+
+        fakeWorkspace = FakeWorkspace()
+        catalogUnderTest = WorkspaceCatalog()
+
+        with patch('support.catalog.arcpy.ListFeatureClasses', fakeWorkspace.ListFeatureClasses),\
+             patch('support.catalog.arcpy.ListTables', fakeWorkspace.ListTables),\
+             patch('support.catalog.arcpy.ListFields', fakeWorkspace.ListFields):
+
+            catalogUnderTest.surveyTables('replica.gdb')
+            catalogUnderTest.fieldsOf('replica.gdb', 'survey')
+            catalogUnderTest.fieldsOf('replica.gdb', 'repeat')
+
+            # when
+
+            catalogUnderTest.invalidate('replica.gdb', 'survey')
+            catalogUnderTest.surveyTables('replica.gdb')
+            catalogUnderTest.fieldsOf('replica.gdb', 'survey')
+            catalogUnderTest.fieldsOf('replica.gdb', 'repeat')
+
+            catalogUnderTest.invalidate('replica.gdb')
+            catalogUnderTest.surveyTables('replica.gdb')
+
+        # then
+
+        assert fakeWorkspace.listCalls == 2
+        assert fakeWorkspace.listFieldsCalls == [os.path.join('replica.gdb', table) for table in ['survey', 'repeat', 'survey']]
+
+    def test_WorkspaceCatalog_describes_only_relationship_classes_with_prefix(self):
+        # given
+
+        fakeWorkspace = FakeWorkspace()
+        catalogUnderTest = WorkspaceCatalog()
+
+        with patch('support.catalog.arcpy.Describe', fakeWorkspace.Describe):
+
+            # when
+
+            relationshipClasses = catalogUnderTest.relationshipClasses('replica.gdb', 'survey')
+
+        # then
+
+        assert [dscRC.name for dscRC in relationshipClasses] == ['survey__ATTACHREL']
+        assert fakeWorkspace.describeCalls == ['replica.gdb', os.path.join('replica.gdb', 'survey__ATTACHREL')]
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: tests/support/test_downloader.py
+# Purpose: Testing harness for support/downloader.py
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+from io import BytesIO
+from pathlib import Path
+
+from support.parameters import *
+
+import pytest
+import urllib.error
+from unittest.mock import patch
+
+from support.downloader import StreamingDownloader, IncompleteDownloadError, TruncatedDownloadError
+
+REPLICA_URL = 'https://yaddayaddayadda.com/replicafiles/replica.zip'
+
+
+class FakeChunkTrackingResponse(BytesIO):
+    def __init__(self, content, status = 200, headers = None, failAfterBytes = None):
+        BytesIO.__init__(self, content)
+        self.status = status
+        self.headers = headers if headers != None else { 'Content-Length': str(len(content)) }
+        self.failAfterBytes = failAfterBytes
+        self.largestReadRequested = 0
+        self.readCount = 0
+
+    def readinto(self, buffer):
+        self.readCount += 1
+        self.largestReadRequested = max(self.largestReadRequested, len(buffer))
+        if self.failAfterBytes != None and self.tell() >= self.failAfterBytes:
+            raise ConnectionResetError('Connection reset by peer')
+        return BytesIO.readinto(self, buffer)
+
+
+class FakeFlakyServer():
+    '''Drops the first connection part-way through, by reset or by closing early, then honours Range requests'''
+    def __init__(self, content, dropAfterBytes, closeCleanly = False):
+        self.content = content
+        self.dropAfterBytes = dropAfterBytes
+        self.closeCleanly = closeCleanly
+        self.rangesRequested = []
+
+    def open(self, url, data = None, headers = None):
+        rangeHeader = headers.get('Range', None)
+        self.rangesRequested.append(rangeHeader)
+
+        if rangeHeader == None and self.closeCleanly:
+            return FakeChunkTrackingResponse(self.content[:self.dropAfterBytes], headers = { 'Content-Length': str(len(self.content)) })
+        if rangeHeader == None:
+            return FakeChunkTrackingResponse(self.content, failAfterBytes = self.dropAfterBytes)
+
+        start = int(rangeHeader.split('=')[1].rstrip('-'))
+        remainder = self.content[start:]
+        headers = {
+            'Content-Length': str(len(remainder)),
+            'Content-Range': f'bytes {start}-{len(self.content) - 1}/{len(self.content)}'
+        }
+        return FakeChunkTrackingResponse(remainder, status = 206, headers = headers)
+
+
+def noSleep(seconds):
+    pass
+
+
+@pytest.mark.usefixtures("useTestDataDirectory", "resetArcpy", "resetMessengerSingleton")
+class TestStreamingDownloader:
+
+    def test_StreamingDownloader_download_in_chunks(self, tmp_path):
+        # given
+
+        parameters = {
+            DOWNLOAD_CHUNK_KB: '1',
+            SCRATCH_DIRECTORY: str(tmp_path)
+        }
+
+        content = Path('fakeFileGeodatabase.zip').read_bytes() * 50
+        fakeResponse = FakeChunkTrackingResponse(content)
+        outFile = tmp_path.joinpath('replica.zip')
+
+        with patch('support.downloader.HttpSession.open', lambda url, data = None, headers = None: fakeResponse):
+            downloaderUnderTest = StreamingDownloader(parameters)
+
+            # when
+
+            bytesWritten = downloaderUnderTest.download(REPLICA_URL, outFile)
+
+        # then
+
+        assert bytesWritten == len(content)
+        assert outFile.read_bytes() == content
+        assert fakeResponse.largestReadRequested == 1024
+        assert fakeResponse.readCount > len(content) // 1024
+        assert list(tmp_path.glob('*.part')) == []
+
+    def test_StreamingDownloader_resumes_with_range_request(self, tmp_path):
+        # given
+
+        parameters = {
+            DOWNLOAD_CHUNK_KB: '1',
+            SCRATCH_DIRECTORY: str(tmp_path)
+        }
+
+        content = Path('fakeFileGeodatabase.zip').read_bytes() * 50
+        fakeServer = FakeFlakyServer(content, dropAfterBytes = 2048)
+        outFile = tmp_path.joinpath('replica.zip')
+
+        with patch('support.downloader.HttpSession.open', fakeServer.open),\
+             patch('support.downloader.time.sleep', noSleep):
+
+            downloaderUnderTest = StreamingDownloader(parameters)
+
+            # when
+
+            bytesWritten = downloaderUnderTest.download(REPLICA_URL, outFile)
+
+        # then
+
+        assert fakeServer.rangesRequested == [None, 'bytes=2048-']
+        assert bytesWritten == len(content)
+        assert outFile.read_bytes() == content
+
+    def test_StreamingDownloader_gives_up_after_retries(self, tmp_path):
+        # given
+
+        parameters = {
+            DOWNLOAD_RETRIES: '0',
+            SCRATCH_DIRECTORY: str(tmp_path)
+        }
+
+        fakeResponse = FakeChunkTrackingResponse(b'some replica bytes', failAfterBytes = 0)
+
+        with patch('support.downloader.HttpSession.open', lambda url, data = None, headers = None: fakeResponse):
+            downloaderUnderTest = StreamingDownloader(parameters)
+
+            # when/then
+
+            with pytest.raises(ConnectionResetError):
+                downloaderUnderTest.download(REPLICA_URL, tmp_path.joinpath('replica.zip'))
+
+    def test_StreamingDownloader_resumes_after_connection_closed_early(self, tmp_path):
+        # given
+
+        parameters = {
+            DOWNLOAD_CHUNK_KB: '1',
+            SCRATCH_DIRECTORY: str(tmp_path)
+        }
+
+        content = Path('fakeFileGeodatabase.zip').read_bytes() * 50
+        fakeServer = FakeFlakyServer(content, dropAfterBytes = 2000, closeCleanly = True)
+        outFile = tmp_path.joinpath('replica.zip')
+
+        with patch('support.downloader.HttpSession.open', fakeServer.open),\
+             patch('support.downloader.time.sleep', noSleep):
+
+            downloaderUnderTest = StreamingDownloader(parameters)
+
+            # when
+
+            bytesWritten = downloaderUnderTest.download(REPLICA_URL, outFile)
+
+        # then
+
+        assert fakeServer.rangesRequested == [None, 'bytes=2000-']
+        assert bytesWritten == len(content)
+        assert outFile.read_bytes() == content
+
+    def test_StreamingDownloader_deletes_partial_file_once_retries_run_out(self, tmp_path):
+        # given
+
+        parameters = {
+            DOWNLOAD_RETRIES: '0',
+            SCRATCH_DIRECTORY: str(tmp_path)
+        }
+
+        fakeResponse = FakeChunkTrackingResponse(b'truncated', headers = { 'Content-Length': '1000' })
+
+        with patch('support.downloader.HttpSession.open', lambda url, data = None, headers = None: fakeResponse):
+            downloaderUnderTest = StreamingDownloader(parameters)
+
+            # when/then
+
+            with pytest.raises(TruncatedDownloadError):
+                downloaderUnderTest.download(REPLICA_URL, tmp_path.joinpath('replica.zip'))
+
+        assert list(tmp_path.glob('*.part')) == []
+        assert not tmp_path.joinpath('replica.zip').exists()
+
+    def test_StreamingDownloader_rejects_long_download(self, tmp_path):
+        # given
+
+        fakeResponse = FakeChunkTrackingResponse(b'more than advertised', headers = { 'Content-Length': '4' })
+
+        with patch('support.downloader.HttpSession.open', lambda url, data = None, headers = None: fakeResponse):
+            downloaderUnderTest = StreamingDownloader({ SCRATCH_DIRECTORY: str(tmp_path) })
+
+            # when/then
+
+            with pytest.raises(IncompleteDownloadError):
+                downloaderUnderTest.download(REPLICA_URL, tmp_path.joinpath('replica.zip'))
+
+        assert list(tmp_path.glob('*.part')) == []
+
+    @pytest.mark.parametrize('closeCleanly', [False, True])
+    def test_StreamingDownloader_resumable_stream_reconnects_from_bytes_read(self, tmp_path, closeCleanly):
+        # given
+
+        parameters = {
+            DOWNLOAD_CHUNK_KB: '1',
+            SCRATCH_DIRECTORY: str(tmp_path)
+        }
+
+        content = Path('fakeFileGeodatabase.zip').read_bytes() * 50
+        fakeServer = FakeFlakyServer(content, dropAfterBytes = 3000, closeCleanly = closeCleanly)
+
+        with patch('support.downloader.HttpSession.open', fakeServer.open),\
+             patch('support.downloader.time.sleep', noSleep):
+
+            downloaderUnderTest = StreamingDownloader(parameters)
+
+            # when
+
+            with downloaderUnderTest.openResumable(REPLICA_URL) as stream:
+                streamed = b''
+                buffer = bytearray(1000)
+                while True:
+                    bytesRead = stream.readinto(buffer)
+                    if not bytesRead:
+                        break
+                    streamed += bytes(buffer[:bytesRead])
+
+        # then
+
+        assert fakeServer.rangesRequested == [None, 'bytes=3000-']
+        assert streamed == content
+        assert list(tmp_path.iterdir()) == []
+
+    def test_StreamingDownloader_resumable_stream_gives_up_after_retries(self, tmp_path):
+        # given
+
+        parameters = {
+            DOWNLOAD_CHUNK_KB: '1',
+            SCRATCH_DIRECTORY: str(tmp_path),
+            DOWNLOAD_RETRIES: '0'
+        }
+
+        content = Path('fakeFileGeodatabase.zip').read_bytes() * 50
+        fakeServer = FakeFlakyServer(content, dropAfterBytes = 3000)
+
+        with patch('support.downloader.HttpSession.open', fakeServer.open),\
+             patch('support.downloader.time.sleep', noSleep):
+
+            downloaderUnderTest = StreamingDownloader(parameters)
+
+            # when/then
+
+            with pytest.raises(ConnectionResetError):
+                with downloaderUnderTest.openResumable(REPLICA_URL) as stream:
+                    while stream.readinto(bytearray(1000)):
+                        pass
+
+        assert fakeServer.rangesRequested == [None]
+        assert list(tmp_path.iterdir()) == []
+
+    def test_StreamingDownloader_does_not_retry_client_errors(self, tmp_path):
+        # given
+
+        attempts = []
+
+        def forbidden(url, data = None, headers = None):
+            attempts.append(url)
+            raise urllib.error.HTTPError(REPLICA_URL, 403, 'Forbidden', {}, None)
+
+        with patch('support.downloader.HttpSession.open', forbidden):
+            downloaderUnderTest = StreamingDownloader({ SCRATCH_DIRECTORY: str(tmp_path) })
+
+            # when/then
+
+            with pytest.raises(urllib.error.HTTPError):
+                downloaderUnderTest.download(REPLICA_URL, tmp_path.joinpath('replica.zip'))
+
+        assert len(attempts) == 1
+
+    def test_StreamingDownloader_default_chunk_size(self):
+        # when
+
+        downloaderUnderTest = StreamingDownloader({})
+
+        # then
+
+        assert downloaderUnderTest.chunkBytes == 1024 * 1024
+
+    def test_StreamingDownloader_invalid_chunk_size(self):
+        # when/then
+
+        with pytest.raises(SystemExit, match=r'\[download_chunk_kb\] expects a whole number'):
+            StreamingDownloader({ DOWNLOAD_CHUNK_KB: 'lots' })
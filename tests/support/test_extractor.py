@@ -10,7 +10,12 @@
 from io import BytesIO
 from os import replace
 
+import datetime
+import json
+import sqlite3
+import urllib.parse
 import uuid
+import zipfile
 
 from support.parameters import *
 
@@ -20,7 +25,14 @@ from unittest.mock import patch
 from urllib.request import HTTPSHandler
 from pathlib import Path
 
+import arcpy
+
 from support.extractor import AGOLSurveyReplicator
+from support.token_cache import TokenCache
+from support.replica_cache import ReplicaCache, contentHashOf
+from support.service_cache import ServiceDefinitionCache
+import support.metrics as metrics
+import support.time as time
 
 class FakeZipFile():
     def __init__(self):
@@ -37,6 +49,13 @@ class FakeZipFile():
         pass
 
 
+class FakeHttpResponse(BytesIO):
+    def __init__(self, content, status = 200):
+        BytesIO.__init__(self, content)
+        self.status = status
+        self.headers = { 'Content-Length': str(len(content)) }
+
+
 # See: https://developers.arcgis.com/rest/services-reference/enterprise/feature-service/
 class FakeGoodCredentialsHttpsHandler(HTTPSHandler):
 
@@ -63,7 +82,7 @@ class FakeGoodCredentialsHttpsHandler(HTTPSHandler):
         self.serviceInfo = serviceInfo
         return self
 
-    def open(self,url, prameters = None):
+    def open(self,url, prameters = None, headers = None):
         if url.startswith(f'{self.params[PORTAL]}/sharing/rest/generateToken?'):
             tokenJson = '{ "token": "' +self.tokenUUID + '" }' 
             responseUtf8 = tokenJson.encode('utf-8')
@@ -84,7 +103,169 @@ class FakeGoodCredentialsHttpsHandler(HTTPSHandler):
             responseUtf8 = Path('fakeFileGeodatabase.zip').read_bytes()
         else:
             responseUtf8 = '{}'.encode('utf-8')
-        return BytesIO(responseUtf8)
+        return FakeHttpResponse(responseUtf8)
+
+
+class FakeSlowJobShortTokenHttpsHandler(FakeGoodCredentialsHttpsHandler):
+    '''Hands out tokens that are about to expire, and takes a few polls to finish the replica job'''
+
+    def __init__(self, pollsBeforeCompletion):
+        FakeGoodCredentialsHttpsHandler.__init__(self)
+        self.pollsBeforeCompletion = pollsBeforeCompletion
+
+    def open(self,url, prameters = None, headers = None):
+        if url.startswith(f'{self.params[PORTAL]}/sharing/rest/generateToken?'):
+            self.generateTokenCallCount = self.generateTokenCallCount + 1
+            expiresMilliseconds = int((time.epochSeconds() + 60) * 1000)
+            tokenJson = '{ "token": "' + self.tokenUUID + '", "expires": ' + str(expiresMilliseconds) + ' }'
+            return FakeHttpResponse(tokenJson.encode('utf-8'))
+        if url == f'{self.jobUrl}?f=json&token={self.tokenUUID}' and self.jobPollCallCount < self.pollsBeforeCompletion:
+            self.jobPollCallCount = self.jobPollCallCount + 1
+            return FakeHttpResponse('{"status":"ExportingData"}'.encode('utf-8'))
+        return FakeGoodCredentialsHttpsHandler.open(self, url, prameters, headers)
+
+
+def noSleep(seconds):
+    pass
+
+
+class FakeCorruptReplicaHttpsHandler(FakeGoodCredentialsHttpsHandler):
+
+    def open(self,url, prameters = None, headers = None):
+        if url == f'{self.resultFileUrl}?token={self.tokenUUID}':
+            self.resultCallCount = self.resultCallCount + 1
+            return FakeHttpResponse(b'PK\x03\x04 definitely not a file geodatabase')
+        return FakeGoodCredentialsHttpsHandler.open(self, url, prameters, headers)
+
+
+class FakeReplicaRequestCapturingHttpsHandler(FakeGoodCredentialsHttpsHandler):
+
+    def open(self,url, prameters = None, headers = None):
+        if url == f'{self.params[SERVICE_URL]}/createReplica/?f=json&token={self.tokenUUID}':
+            self.replicaRequest = urllib.parse.parse_qs(prameters.decode('utf-8'))
+        return FakeGoodCredentialsHttpsHandler.open(self, url, prameters, headers)
+
+
+class FakeMobileReplicaHttpsHandler(FakeReplicaRequestCapturingHttpsHandler):
+    '''Serves the replica result as an unzipped file, as the portal does for sqlite replicas'''
+
+    def withResultFile(self, resultBytes):
+        self.resultBytes = resultBytes
+        return self
+
+    def open(self,url, prameters = None, headers = None):
+        if url == f'{self.resultFileUrl}?token={self.tokenUUID}':
+            self.resultCallCount = self.resultCallCount + 1
+            return FakeHttpResponse(self.resultBytes)
+        return FakeReplicaRequestCapturingHttpsHandler.open(self, url, prameters, headers)
+
+
+class FakeRevalidatingServiceHttpsHandler(FakeGoodCredentialsHttpsHandler):
+    '''Tags the service definition with an ETag, answering 304 Not Modified when it is sent back'''
+
+    def open(self,url, prameters = None, headers = None):
+        if url == f"{self.params[SERVICE_URL]}?f=json&token={self.tokenUUID}":
+            self.serviceInfoCallCount = self.serviceInfoCallCount + 1
+            if (headers or {}).get('If-None-Match', None) == '"v1"':
+                response = FakeHttpResponse(b'', status = 304)
+            else:
+                response = FakeHttpResponse(self.serviceInfo.encode('utf-8'))
+            response.headers['ETag'] = '"v1"'
+            return response
+        return FakeGoodCredentialsHttpsHandler.open(self, url, prameters, headers)
+
+
+class FakeLayerCountingHttpsHandler(FakeReplicaRequestCapturingHttpsHandler):
+
+    def withRecordCounts(self, recordCounts):
+        self.recordCounts = recordCounts
+        self.countQueries = []
+        return self
+
+    def open(self,url, prameters = None, headers = None):
+        parts = urllib.parse.urlsplit(url)
+        if parts.path.endswith('/query'):
+            query = urllib.parse.parse_qs(parts.query)
+            layerId = parts.path.split('/')[-2]
+            self.countQueries.append((layerId, query['where'][0]))
+            return FakeHttpResponse(json.dumps({ 'count': self.recordCounts[layerId] }).encode('utf-8'))
+        return FakeReplicaRequestCapturingHttpsHandler.open(self, url, prameters, headers)
+
+
+class FakeLayerDefinitionsHttpsHandler(FakeReplicaRequestCapturingHttpsHandler):
+
+    def withLayersInfo(self, layersInfo):
+        self.layersInfo = layersInfo
+        self.layersInfoCallCount = 0
+        return self
+
+    def open(self,url, prameters = None, headers = None):
+        if url == f'{self.params[SERVICE_URL]}/layers?f=json&token={self.tokenUUID}':
+            self.layersInfoCallCount = self.layersInfoCallCount + 1
+            return FakeHttpResponse(json.dumps(self.layersInfo).encode('utf-8'))
+        return FakeReplicaRequestCapturingHttpsHandler.open(self, url, prameters, headers)
+
+
+def epochMilliseconds(datetimeInstance):
+    return int(datetimeInstance.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+
+
+class FakeStaleTokenHttpsHandler(FakeGoodCredentialsHttpsHandler):
+    '''Rejects a token the portal has since revoked'''
+
+    def __init__(self, staleToken):
+        FakeGoodCredentialsHttpsHandler.__init__(self)
+        self.staleToken = staleToken
+
+    def open(self,url, prameters = None, headers = None):
+        if url == f"{self.params[SERVICE_URL]}?f=json&token={self.staleToken}":
+            return FakeHttpResponse('{"error":{"code":498,"message":"Invalid token."}}'.encode('utf-8'))
+        return FakeGoodCredentialsHttpsHandler.open(self, url, prameters, headers)
+
+
+class FakeTruncatedFirstReplicaHttpsHandler(FakeGoodCredentialsHttpsHandler):
+    '''Drops the first replica download part-way through a member'''
+
+    def open(self,url, prameters = None, headers = None):
+        if url == f'{self.resultFileUrl}?token={self.tokenUUID}' and self.resultCallCount == 0:
+            self.resultCallCount = self.resultCallCount + 1
+            return FakeHttpResponse(Path('fakeFileGeodatabase.zip').read_bytes()[:60])
+        return FakeGoodCredentialsHttpsHandler.open(self, url, prameters, headers)
+
+
+class FakeDroppedReplicaConnectionHttpsHandler(FakeGoodCredentialsHttpsHandler):
+    '''Resets the first replica connection part-way through, then honours Range requests'''
+
+    def __init__(self):
+        FakeGoodCredentialsHttpsHandler.__init__(self)
+        self.rangesRequested = []
+
+    def open(self,url, prameters = None, headers = None):
+        if url != f'{self.resultFileUrl}?token={self.tokenUUID}':
+            return FakeGoodCredentialsHttpsHandler.open(self, url, prameters, headers)
+
+        self.resultCallCount = self.resultCallCount + 1
+        content = Path('fakeFileGeodatabase.zip').read_bytes()
+        rangeHeader = (headers or {}).get('Range', None)
+        self.rangesRequested.append(rangeHeader)
+        if rangeHeader == None:
+            return FakeDroppingHttpResponse(content, dropAfterBytes = 100)
+
+        start = int(rangeHeader.split('=')[1].rstrip('-'))
+        response = FakeHttpResponse(content[start:], status = 206)
+        response.headers['Content-Range'] = f'bytes {start}-{len(content) - 1}/{len(content)}'
+        return response
+
+
+class FakeDroppingHttpResponse(FakeHttpResponse):
+    def __init__(self, content, dropAfterBytes):
+        FakeHttpResponse.__init__(self, content)
+        self.dropAfterBytes = dropAfterBytes
+
+    def readinto(self, buffer):
+        if self.tell() >= self.dropAfterBytes:
+            raise ConnectionResetError('Connection reset by peer')
+        return BytesIO.readinto(self, memoryview(buffer)[:self.dropAfterBytes - self.tell()])
 
 
 class FakeBadCredentialsHttpsHandler(HTTPSHandler):
@@ -102,14 +283,14 @@ class FakeBadCredentialsHttpsHandler(HTTPSHandler):
         self.serviceInfo = serviceInfo
         return self
 
-    def open(self,url, prameters = None):
+    def open(self,url, prameters = None, headers = None):
         if url.startswith(f'{self.params[PORTAL]}/sharing/rest/generateToken?'):
             responseText =  '{"error":{"code":400,"message":"Unable to generate token.","details":["Invalid username or password."]}}'
             responseUtf8 = responseText.encode('utf-8')  
             self.generateTokenCallCount = self.generateTokenCallCount + 1
         else:
             responseUtf8 = '{}'.encode('utf-8')
-        return BytesIO(responseUtf8)
+        return FakeHttpResponse(responseUtf8)
 
 
 @pytest.mark.usefixtures("useTestDataDirectory", "resetArcpy", "resetMessengerSingleton")    
@@ -136,8 +317,7 @@ class TestAGOLSurveyReplicator:
 
         fakeZipFile = FakeZipFile()
 
-        #TODO:  Can I shrink this to just referencing fakeZipFile once?
-        with patch('support.extractor.urllib.request.urlopen', fakeHandler.open),\
+        with patch('support.extractor.HttpSession.open', fakeHandler.open),\
              patch('support.extractor.zipfile.ZipFile.namelist', fakeZipFile.namelist),\
              patch('support.extractor.zipfile.ZipFile.extractall', fakeZipFile.extractall):
             
@@ -145,7 +325,7 @@ class TestAGOLSurveyReplicator:
 
             # when
 
-            replicatorUnderTest.extract()
+            replicatedSurvey = replicatorUnderTest.extract()
 
             # then
 
@@ -155,8 +335,680 @@ class TestAGOLSurveyReplicator:
             assert fakeHandler.jobPollCallCount == 1
             assert fakeHandler.resultCallCount == 1                
 
-            assert fakeZipFile.namelistReturned == 1
-            assert fakeZipFile.extracted == 1
+            # Unzipped as it streamed in, so no zip file was written and reopened.
+            assert fakeZipFile.namelistReturned == 0
+            assert fakeZipFile.extracted == 0
+
+            assert replicatedSurvey.endswith('fakeFileGeodatabase.gdb')
+            assert Path(replicatedSurvey).joinpath('a00000001.gdbtable').exists()
+            assert list(Path(replicatedSurvey).parent.glob('*.zip')) == []
+
+
+    def test_AGOLSurveyReplicator_falls_back_to_whole_archive(self):
+        # given
+           
+        parameters = {
+            PORTAL: 'https://www.not.really.arcgis.com',
+            PORTAL_USER_NAME: 'TheUser',
+            PORTAL_PASSWORD: 'NopeNopeNopeNope',
+            SERVICE_URL: 'https://yaddayaddayadda.com/rest-of-url',
+
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'blob.gdb',
+            DESTINATION_CRS: 'WSG84-to-GDA2020-standin',
+        }
+
+        validServiceInfo = Path('syncEnabledFeatureServiceInfo.json').read_text()
+        fakeHandler = FakeTruncatedFirstReplicaHttpsHandler().forParameters(parameters).withServiceInfo(validServiceInfo)
+
+        with patch('support.extractor.HttpSession.open', fakeHandler.open):
+            replicatorUnderTest = AGOLSurveyReplicator(parameters)
+
+            # when
+
+            replicatedSurvey = replicatorUnderTest.extract()
+
+        # then
+
+        assert fakeHandler.resultCallCount == 2
+        assert Path(replicatedSurvey).joinpath('a00000001.gdbtable').read_bytes() == \
+            zipfile.ZipFile('fakeFileGeodatabase.zip').read('fakeFileGeodatabase.gdb/a00000001.gdbtable')
+        assert list(Path(replicatedSurvey).parent.glob('*.zip')) == []
+
+
+    def test_AGOLSurveyReplicator_resumes_dropped_replica_stream(self, tmp_path):
+        # given
+           
+        parameters = {
+            PORTAL: 'https://www.not.really.arcgis.com',
+            PORTAL_USER_NAME: 'TheUser',
+            PORTAL_PASSWORD: 'NopeNopeNopeNope',
+            SERVICE_URL: 'https://yaddayaddayadda.com/rest-of-url',
+            SCRATCH_DIRECTORY: str(tmp_path),
+
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'blob.gdb',
+            DESTINATION_CRS: 'WSG84-to-GDA2020-standin',
+        }
+
+        validServiceInfo = Path('syncEnabledFeatureServiceInfo.json').read_text()
+        fakeHandler = FakeDroppedReplicaConnectionHttpsHandler().forParameters(parameters).withServiceInfo(validServiceInfo)
+        fakeZipFile = FakeZipFile()
+
+        with patch('support.extractor.HttpSession.open', fakeHandler.open),\
+             patch('support.downloader.time.sleep', lambda seconds: None),\
+             patch('support.extractor.zipfile.ZipFile.namelist', fakeZipFile.namelist):
+
+            replicatorUnderTest = AGOLSurveyReplicator(parameters)
+
+            # when
+
+            replicatedSurvey = replicatorUnderTest.extract()
+
+        # then
+
+        assert fakeHandler.rangesRequested == [None, 'bytes=100-']
+        assert fakeZipFile.namelistReturned == 0
+        assert Path(replicatedSurvey).joinpath('a00000001.gdbtable').read_bytes() == \
+            zipfile.ZipFile('fakeFileGeodatabase.zip').read('fakeFileGeodatabase.gdb/a00000001.gdbtable')
+        assert list(tmp_path.glob('*.part')) == []
+
+
+    def test_AGOLSurveyReplicator_polls_with_backoff_and_refreshes_token(self):
+        # given
+
+        parameters = {
+            PORTAL: 'https://www.not.really.arcgis.com',
+            PORTAL_USER_NAME: 'TheUser',
+            PORTAL_PASSWORD: 'NopeNopeNopeNope',
+            SERVICE_URL: 'https://yaddayaddayadda.com/rest-of-url',
+
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'blob.gdb',
+            DESTINATION_CRS: 'WSG84-to-GDA2020-standin',
+        }
+
+        context = {}
+
+        validServiceInfo = Path('syncEnabledFeatureServiceInfo.json').read_text()
+        fakeHandler = FakeSlowJobShortTokenHttpsHandler(pollsBeforeCompletion = 2).forParameters(parameters).withServiceInfo(validServiceInfo)
+
+        with patch('support.extractor.HttpSession.open', fakeHandler.open),\
+             patch('support.poller.time.sleep', noSleep):
+
+            replicatorUnderTest = AGOLSurveyReplicator(parameters).withContext(context)
+
+            # when
+
+            replicatorUnderTest.extract()
+
+        # then
+
+        assert fakeHandler.jobPollCallCount == 3
+        assert fakeHandler.generateTokenCallCount == 4  # initial login, then a refresh before each poll
+
+        assert metrics.valueOf(context, 'ReplicaJobPolls') == 3
+        assert metrics.valueOf(context, 'ReplicaJobWaitSeconds') <= 1.5
+
+
+    def test_AGOLSurveyReplicator_reuses_cached_token(self, tmp_path):
+        # given
+
+        parameters = {
+            PORTAL: 'https://www.not.really.arcgis.com',
+            PORTAL_USER_NAME: 'TheUser',
+            PORTAL_PASSWORD: 'NopeNopeNopeNope',
+            SERVICE_URL: 'https://yaddayaddayadda.com/rest-of-url',
+            CACHE_DIRECTORY: str(tmp_path),
+
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'blob.gdb',
+            DESTINATION_CRS: 'WSG84-to-GDA2020-standin',
+        }
+
+        validServiceInfo = Path('syncEnabledFeatureServiceInfo.json').read_text()
+        fakeHandler = FakeGoodCredentialsHttpsHandler().forParameters(parameters).withServiceInfo(validServiceInfo)
+
+        with patch('support.extractor.HttpSession.open', fakeHandler.open):
+            AGOLSurveyReplicator(parameters).extract()
+
+            # when
+
+            secondContext = {}
+            AGOLSurveyReplicator(parameters).withContext(secondContext).extract()
+
+        # then
+
+        assert fakeHandler.generateTokenCallCount == 1
+        assert fakeHandler.serviceInfoCallCount == 2
+        assert secondContext[TOKEN] == fakeHandler.tokenUUID
+
+
+    def test_AGOLSurveyReplicator_revalidates_cached_service_definition(self, tmp_path):
+        # given
+
+        parameters = {
+            PORTAL: 'https://www.not.really.arcgis.com',
+            PORTAL_USER_NAME: 'TheUser',
+            PORTAL_PASSWORD: 'NopeNopeNopeNope',
+            SERVICE_URL: 'https://yaddayaddayadda.com/rest-of-url',
+            CACHE_DIRECTORY: str(tmp_path),
+
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'blob.gdb',
+            DESTINATION_CRS: 'WSG84-to-GDA2020-standin',
+        }
+
+        validServiceInfo = Path('syncEnabledFeatureServiceInfo.json').read_text()
+        fakeHandler = FakeRevalidatingServiceHttpsHandler().forParameters(parameters).withServiceInfo(validServiceInfo)
+
+        with patch('support.extractor.HttpSession.open', fakeHandler.open):
+            AGOLSurveyReplicator(parameters).extract()
+
+            # when
+
+            secondContext = {}
+            AGOLSurveyReplicator(parameters).withContext(secondContext).extract()
+
+        # then
+
+        assert fakeHandler.serviceInfoCallCount == 2
+        assert fakeHandler.replicateJobCallCount == 2
+        assert secondContext[SERVICE_INFO]['capabilities'] == json.loads(validServiceInfo)['capabilities']
+        assert 'fullExtent' not in secondContext[SERVICE_INFO].keys()
+        assert any(message.endswith('Service definition unchanged since cached') for message in arcpy.messages)
+
+    def test_AGOLSurveyReplicator_reuses_unvalidated_service_definition_within_ttl(self, tmp_path):
+        # given
+
+        parameters = {
+            PORTAL: 'https://www.not.really.arcgis.com',
+            PORTAL_USER_NAME: 'TheUser',
+            PORTAL_PASSWORD: 'NopeNopeNopeNope',
+            SERVICE_URL: 'https://yaddayaddayadda.com/rest-of-url',
+            CACHE_DIRECTORY: str(tmp_path),
+            SERVICE_CACHE_MINUTES: '30',
+
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'blob.gdb',
+            DESTINATION_CRS: 'WSG84-to-GDA2020-standin',
+        }
+
+        validServiceInfo = Path('syncEnabledFeatureServiceInfo.json').read_text()
+        ServiceDefinitionCache(str(tmp_path), 1800).put(parameters[SERVICE_URL], 'TheUser', json.loads(validServiceInfo), None, None)
+
+        fakeHandler = FakeGoodCredentialsHttpsHandler().forParameters(parameters).withServiceInfo(validServiceInfo)
+
+        with patch('support.extractor.HttpSession.open', fakeHandler.open):
+            replicatorUnderTest = AGOLSurveyReplicator(parameters)
+
+            # when
+
+            replicatorUnderTest.extract()
+
+        # then
+
+        assert fakeHandler.generateTokenCallCount == 1
+        assert fakeHandler.serviceInfoCallCount == 0
+        assert fakeHandler.replicateJobCallCount == 1
+
+    def test_AGOLSurveyReplicator_replaces_rejected_cached_token(self, tmp_path):
+        # given
+
+        parameters = {
+            PORTAL: 'https://www.not.really.arcgis.com',
+            PORTAL_USER_NAME: 'TheUser',
+            PORTAL_PASSWORD: 'NopeNopeNopeNope',
+            SERVICE_URL: 'https://yaddayaddayadda.com/rest-of-url',
+            CACHE_DIRECTORY: str(tmp_path),
+
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'blob.gdb',
+            DESTINATION_CRS: 'WSG84-to-GDA2020-standin',
+        }
+
+        TokenCache(str(tmp_path)).put(parameters[PORTAL], parameters[PORTAL_USER_NAME], 'revokedToken', time.epochSeconds() + 3600)
+
+        validServiceInfo = Path('syncEnabledFeatureServiceInfo.json').read_text()
+        fakeHandler = FakeStaleTokenHttpsHandler('revokedToken').forParameters(parameters).withServiceInfo(validServiceInfo)
+
+        context = {}
+
+        with patch('support.extractor.HttpSession.open', fakeHandler.open):
+            replicatorUnderTest = AGOLSurveyReplicator(parameters).withContext(context)
+
+            # when
+
+            replicatorUnderTest.extract()
+
+        # then
+
+        assert fakeHandler.generateTokenCallCount == 1
+        assert fakeHandler.replicateJobCallCount == 1
+        assert context[TOKEN] == fakeHandler.tokenUUID
+        assert TokenCache(str(tmp_path)).get(parameters[PORTAL], parameters[PORTAL_USER_NAME])['token'] == fakeHandler.tokenUUID
+
+
+    def test_AGOLSurveyReplicator_replicates_only_since_last_sync(self):
+        # given
+
+        parameters = {
+            PORTAL: 'https://www.not.really.arcgis.com',
+            PORTAL_USER_NAME: 'TheUser',
+            PORTAL_PASSWORD: 'NopeNopeNopeNope',
+            SERVICE_URL: 'https://yaddayaddayadda.com/rest-of-url',
+
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'blob.gdb',
+            DESTINATION_CRS: 'WSG84-to-GDA2020-standin',
+        }
+
+        context = {
+            PROCESS_TIME: datetime.datetime(2024, 6, 30, 12, 0, 0)
+        }
+
+        validServiceInfo = Path('syncEnabledFeatureServiceInfo.json').read_text()
+        fakeHandler = FakeReplicaRequestCapturingHttpsHandler().forParameters(parameters).withServiceInfo(validServiceInfo)
+
+        with patch('support.extractor.HttpSession.open', fakeHandler.open),\
+             patch('support.extractor.arcpy_proxy.ArcpyProxy.getSurveyTables', lambda self, workspace, prefix = '': ['myprefix_layer1']),\
+             patch('support.extractor.arcpy_proxy.ArcpyProxy.getLastSynchronizationTime', lambda self, workspace, tables: datetime.datetime(2024, 6, 1, 8, 30, 0)):
+
+            replicatorUnderTest = AGOLSurveyReplicator(parameters).withContext(context)
+
+            # when
+
+            replicatorUnderTest.extract()
+
+        # then
+
+        assert context[EXISTING_TABLES] == ['myprefix_layer1']
+        assert context[LAST_SYNC_TIME] == datetime.datetime(2024, 6, 1, 8, 30, 0)
+
+        layerQueries = json.loads(fakeHandler.replicaRequest['layerQueries'][0])
+        assert sorted(layerQueries.keys()) == ['layer1', 'layer2', 'table1', 'table2']
+        assert layerQueries['table2'] == {
+            'queryOption': 'useFilter',
+            'where': "CreationDate > timestamp '2024-06-01 08:30:00' AND CreationDate <= timestamp '2024-06-30 12:00:00'",
+            'useGeometry': False,
+            'includeRelated': False
+        }
+
+
+    def test_AGOLSurveyReplicator_prunes_layers_without_new_records(self):
+        # given
+
+        parameters = {
+            PORTAL: 'https://www.not.really.arcgis.com',
+            PORTAL_USER_NAME: 'TheUser',
+            PORTAL_PASSWORD: 'NopeNopeNopeNope',
+            SERVICE_URL: 'https://yaddayaddayadda.com/rest-of-url',
+
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'blob.gdb',
+            DESTINATION_CRS: 'WSG84-to-GDA2020-standin',
+        }
+
+        context = {}
+        lastSyncTime = datetime.datetime(2024, 6, 1, 8, 30, 0)
+        recordCounts = { 'layer1': 3, 'layer2': 0, 'table1': 0, 'table2': 1 }
+
+        validServiceInfo = Path('syncEnabledFeatureServiceInfo.json').read_text()
+        fakeHandler = FakeLayerCountingHttpsHandler().forParameters(parameters).withServiceInfo(validServiceInfo).withRecordCounts(recordCounts)
+
+        fakeZipFile = FakeZipFile()
+
+        with patch('support.extractor.HttpSession.open', fakeHandler.open),\
+             patch('support.extractor.zipfile.ZipFile.namelist', fakeZipFile.namelist),\
+             patch('support.extractor.zipfile.ZipFile.extractall', fakeZipFile.extractall),\
+             patch('support.extractor.arcpy_proxy.ArcpyProxy.getSurveyTables', lambda self, workspace, prefix = '': ['myprefix_layer1']),\
+             patch('support.extractor.arcpy_proxy.ArcpyProxy.getLastSynchronizationTime', lambda self, workspace, tables: lastSyncTime):
+
+            replicatorUnderTest = AGOLSurveyReplicator(parameters).withContext(context)
+
+            # when
+
+            replicatorUnderTest.extract()
+
+        # then
+
+        assert [layerId for layerId, where in fakeHandler.countQueries] == ['layer1', 'layer2', 'table1', 'table2']
+        assert fakeHandler.countQueries[0][1] == "CreationDate > timestamp '2024-06-01 08:30:00'"
+
+        assert fakeHandler.replicaRequest['layers'] == ['layer1, table2']
+        assert sorted(json.loads(fakeHandler.replicaRequest['layerQueries'][0]).keys()) == ['layer1', 'table2']
+        assert metrics.valueOf(context, 'ReplicaLayersPruned') == 2
+
+
+    def test_AGOLSurveyReplicator_skips_survey_without_new_records(self):
+        # given
+
+        parameters = {
+            PORTAL: 'https://www.not.really.arcgis.com',
+            PORTAL_USER_NAME: 'TheUser',
+            PORTAL_PASSWORD: 'NopeNopeNopeNope',
+            SERVICE_URL: 'https://yaddayaddayadda.com/rest-of-url',
+
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'blob.gdb',
+            DESTINATION_CRS: 'WSG84-to-GDA2020-standin',
+        }
+
+        recordCounts = { 'layer1': 0, 'layer2': 0, 'table1': 0, 'table2': 0 }
+
+        validServiceInfo = Path('syncEnabledFeatureServiceInfo.json').read_text()
+        fakeHandler = FakeLayerCountingHttpsHandler().forParameters(parameters).withServiceInfo(validServiceInfo).withRecordCounts(recordCounts)
+
+        with patch('support.extractor.HttpSession.open', fakeHandler.open),\
+             patch('support.extractor.arcpy_proxy.ArcpyProxy.getSurveyTables', lambda self, workspace, prefix = '': ['myprefix_layer1']),\
+             patch('support.extractor.arcpy_proxy.ArcpyProxy.getLastSynchronizationTime', lambda self, workspace, tables: datetime.datetime(2024, 6, 1, 8, 30, 0)):
+
+            replicatorUnderTest = AGOLSurveyReplicator(parameters)
+
+            # when
+
+            replicatedSurvey = replicatorUnderTest.extract()
+
+        # then
+
+        assert replicatedSurvey == None
+        assert fakeHandler.replicateJobCallCount == 0
+
+
+    def test_AGOLSurveyReplicator_skips_unedited_survey(self):
+        # given
+
+        parameters = {
+            PORTAL: 'https://www.not.really.arcgis.com',
+            PORTAL_USER_NAME: 'TheUser',
+            PORTAL_PASSWORD: 'NopeNopeNopeNope',
+            SERVICE_URL: 'https://yaddayaddayadda.com/rest-of-url',
+
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'blob.gdb',
+            DESTINATION_CRS: 'WSG84-to-GDA2020-standin',
+        }
+
+        lastSyncTime = datetime.datetime(2024, 6, 1, 8, 30, 0)
+
+        serviceInfo = json.loads(Path('syncEnabledFeatureServiceInfo.json').read_text())
+        serviceInfo['editingInfo'] = { 'lastEditDate': epochMilliseconds(lastSyncTime - datetime.timedelta(minutes = 5)) }
+        fakeHandler = FakeGoodCredentialsHttpsHandler().forParameters(parameters).withServiceInfo(json.dumps(serviceInfo))
+
+        with patch('support.extractor.HttpSession.open', fakeHandler.open),\
+             patch('support.extractor.arcpy_proxy.ArcpyProxy.getSurveyTables', lambda self, workspace, prefix = '': ['myprefix_layer1']),\
+             patch('support.extractor.arcpy_proxy.ArcpyProxy.getLastSynchronizationTime', lambda self, workspace, tables: lastSyncTime):
+
+            replicatorUnderTest = AGOLSurveyReplicator(parameters)
+
+            # when
+
+            replicatedSurvey = replicatorUnderTest.extract()
+
+        # then
+
+        assert replicatedSurvey == None
+        assert fakeHandler.replicateJobCallCount == 0
+        assert fakeHandler.resultCallCount == 0
+
+
+    def test_AGOLSurveyReplicator_checks_layer_edit_dates(self):
+        # given
+
+        parameters = {
+            PORTAL: 'https://www.not.really.arcgis.com',
+            PORTAL_USER_NAME: 'TheUser',
+            PORTAL_PASSWORD: 'NopeNopeNopeNope',
+            SERVICE_URL: 'https://yaddayaddayadda.com/rest-of-url',
+
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'blob.gdb',
+            DESTINATION_CRS: 'WSG84-to-GDA2020-standin',
+        }
+
+        lastSyncTime = datetime.datetime(2024, 6, 1, 8, 30, 0)
+        layersInfo = {
+            'layers': [ { 'id': 0, 'editingInfo': { 'lastEditDate': epochMilliseconds(lastSyncTime - datetime.timedelta(days = 3)) } } ],
+            'tables': [ { 'id': 1, 'editingInfo': { 'lastEditDate': epochMilliseconds(lastSyncTime + datetime.timedelta(minutes = 1)) } } ]
+        }
+
+        validServiceInfo = Path('syncEnabledFeatureServiceInfo.json').read_text()
+        fakeHandler = FakeLayerDefinitionsHttpsHandler().forParameters(parameters).withServiceInfo(validServiceInfo).withLayersInfo(layersInfo)
+
+        fakeZipFile = FakeZipFile()
+
+        with patch('support.extractor.HttpSession.open', fakeHandler.open),\
+             patch('support.extractor.zipfile.ZipFile.namelist', fakeZipFile.namelist),\
+             patch('support.extractor.zipfile.ZipFile.extractall', fakeZipFile.extractall),\
+             patch('support.extractor.arcpy_proxy.ArcpyProxy.getSurveyTables', lambda self, workspace, prefix = '': ['myprefix_layer1']),\
+             patch('support.extractor.arcpy_proxy.ArcpyProxy.getLastSynchronizationTime', lambda self, workspace, tables: lastSyncTime):
+
+            replicatorUnderTest = AGOLSurveyReplicator(parameters)
+
+            # when
+
+            replicatedSurvey = replicatorUnderTest.extract()
+
+        # then
+
+        assert replicatedSurvey != None
+        assert fakeHandler.layersInfoCallCount == 1
+        assert fakeHandler.replicateJobCallCount == 1
+
+
+    def test_AGOLSurveyReplicator_fetches_attachments_by_url(self):
+        # given
+
+        parameters = {
+            PORTAL: 'https://www.not.really.arcgis.com',
+            PORTAL_USER_NAME: 'TheUser',
+            PORTAL_PASSWORD: 'NopeNopeNopeNope',
+            SERVICE_URL: 'https://yaddayaddayadda.com/rest-of-url',
+            ATTACHMENT_TRANSFER: 'url',
+
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'blob.gdb',
+            DESTINATION_CRS: 'WSG84-to-GDA2020-standin',
+        }
+
+        layersInfo = {
+            'layers': [ { 'id': 'layer1', 'name': 'survey', 'hasAttachments': True }, { 'id': 'layer2', 'name': 'other', 'hasAttachments': False } ],
+            'tables': [ { 'id': 'table1', 'name': 'repeat', 'hasAttachments': True } ]
+        }
+
+        validServiceInfo = Path('syncEnabledFeatureServiceInfo.json').read_text()
+        fakeHandler = FakeLayerDefinitionsHttpsHandler().forParameters(parameters).withServiceInfo(validServiceInfo).withLayersInfo(layersInfo)
+
+        fakeZipFile = FakeZipFile()
+        fetches = []
+
+        with patch('support.extractor.HttpSession.open', fakeHandler.open),\
+             patch('support.extractor.zipfile.ZipFile.namelist', fakeZipFile.namelist),\
+             patch('support.extractor.zipfile.ZipFile.extractall', fakeZipFile.extractall),\
+             patch('support.extractor.AttachmentFetcher.fetchInto', lambda self, gdb, table, url, where, token: fetches.append((table, url, token))):
+
+            replicatorUnderTest = AGOLSurveyReplicator(parameters)
+
+            # when
+
+            replicatorUnderTest.extract()
+
+        # then
+
+        assert fakeHandler.replicaRequest['returnAttachments'] == ['False']
+        assert fetches == [
+            ('survey', f'{parameters[SERVICE_URL]}/layer1', fakeHandler.tokenUUID),
+            ('repeat', f'{parameters[SERVICE_URL]}/table1', fakeHandler.tokenUUID)
+        ]
+
+
+    def test_AGOLSurveyReplicator_replicates_sqlite_format(self, tmp_path):
+        # given
+
+        parameters = {
+            PORTAL: 'https://www.not.really.arcgis.com',
+            PORTAL_USER_NAME: 'TheUser',
+            PORTAL_PASSWORD: 'NopeNopeNopeNope',
+            SERVICE_URL: 'https://yaddayaddayadda.com/rest-of-url',
+            REPLICA_FORMAT: 'SQLite',
+
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'blob.gdb',
+            DESTINATION_CRS: 'WSG84-to-GDA2020-standin',
+        }
+
+        mobileGeodatabase = tmp_path.joinpath('served.geodatabase')
+        connection = sqlite3.connect(str(mobileGeodatabase))
+        connection.execute('CREATE TABLE survey (objectid INTEGER PRIMARY KEY, CreationDate DATETIME)')
+        connection.commit()
+        connection.close()
+
+        validServiceInfo = Path('syncEnabledFeatureServiceInfo.json').read_text()
+        fakeHandler = FakeMobileReplicaHttpsHandler().forParameters(parameters).withServiceInfo(validServiceInfo).\
+                        withResultFile(mobileGeodatabase.read_bytes())
+
+        with patch('support.extractor.HttpSession.open', fakeHandler.open):
+            replicatorUnderTest = AGOLSurveyReplicator(parameters)
+
+            # when
+
+            replicatedSurvey = replicatorUnderTest.extract()
+
+        # then
+
+        assert fakeHandler.replicaRequest['dataFormat'] == ['sqlite']
+        assert fakeHandler.resultCallCount == 1
+
+        assert replicatedSurvey.endswith('survey.geodatabase')
+        assert Path(replicatedSurvey).read_bytes() == mobileGeodatabase.read_bytes()
+
+    def test_AGOLSurveyReplicator_replicate_corrupt_sqlite_replica(self):
+        # given
+
+        parameters = {
+            PORTAL: 'https://www.not.really.arcgis.com',
+            PORTAL_USER_NAME: 'TheUser',
+            PORTAL_PASSWORD: 'NopeNopeNopeNope',
+            SERVICE_URL: 'https://yaddayaddayadda.com/rest-of-url',
+            REPLICA_FORMAT: 'sqlite',
+
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'blob.gdb',
+            DESTINATION_CRS: 'WSG84-to-GDA2020-standin',
+        }
+
+        validServiceInfo = Path('syncEnabledFeatureServiceInfo.json').read_text()
+        fakeHandler = FakeMobileReplicaHttpsHandler().forParameters(parameters).withServiceInfo(validServiceInfo).\
+                        withResultFile(b'definitely not a mobile geodatabase' * 100)
+
+        with patch('support.extractor.HttpSession.open', fakeHandler.open):
+            with pytest.raises(Exception) as e_info:
+                replicatorUnderTest = AGOLSurveyReplicator(parameters)
+
+                # when
+
+                replicatorUnderTest.extract()
+
+            # then
+
+            assert 'failed integrity check' in str(e_info.value)
+
+    def test_AGOLSurveyReplicator_rejects_unknown_replica_format(self):
+        # when/then
+
+        with pytest.raises(SystemExit, match=r'\[replica_format\] expects one of'):
+            AGOLSurveyReplicator({ REPLICA_FORMAT: 'shapefile' })
+
+    def test_AGOLSurveyReplicator_retries_unloaded_cached_replica(self, tmp_path):
+        # given
+
+        parameters = {
+            PORTAL: 'https://www.not.really.arcgis.com',
+            PORTAL_USER_NAME: 'TheUser',
+            PORTAL_PASSWORD: 'NopeNopeNopeNope',
+            SERVICE_URL: 'https://yaddayaddayadda.com/rest-of-url',
+            CACHE_DIRECTORY: str(tmp_path.joinpath('cache')),
+
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'blob.gdb',
+            DESTINATION_CRS: 'WSG84-to-GDA2020-standin',
+        }
+
+        earlierProcessTime = time.getUTCTimestamp(parameters[TIMEZONE]) - datetime.timedelta(hours=1)
+        context = { PROCESS_TIME: time.getUTCTimestamp(parameters[TIMEZONE]) }
+
+        failedReplica = tmp_path.joinpath('failed', 'survey.gdb')
+        failedReplica.mkdir(parents=True)
+        failedReplica.joinpath('a00000001.gdbtable').write_bytes(b'rows that failed to load')
+        ReplicaCache(parameters[CACHE_DIRECTORY], 1024 * 1024).store(parameters[SERVICE_URL], ['0', '1'], str(failedReplica), \
+            contentHashOf(str(failedReplica)), None, earlierProcessTime)
+
+        validServiceInfo = Path('syncEnabledFeatureServiceInfo.json').read_text()
+        fakeHandler = FakeGoodCredentialsHttpsHandler().forParameters(parameters).withServiceInfo(validServiceInfo)
+
+        with patch('support.extractor.HttpSession.open', fakeHandler.open):
+            replicatorUnderTest = AGOLSurveyReplicator(parameters).withContext(context)
+
+            # when
+
+            replicatedSurvey = replicatorUnderTest.extract()
+
+        # then
+
+        assert fakeHandler.generateTokenCallCount == 0
+        assert fakeHandler.replicateJobCallCount == 0
+
+        assert contentHashOf(replicatedSurvey) == contentHashOf(str(failedReplica))
+        assert context[PROCESS_TIME] == earlierProcessTime
+        assert context[REPLICA_LAYERS] == ['0', '1']
+
+    def test_AGOLSurveyReplicator_replicate_corrupt_replica(self):
+        # given
+
+        parameters = {
+            PORTAL: 'https://www.not.really.arcgis.com',
+            PORTAL_USER_NAME: 'TheUser',
+            PORTAL_PASSWORD: 'NopeNopeNopeNope',
+            SERVICE_URL: 'https://yaddayaddayadda.com/rest-of-url',
+
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'blob.gdb',
+            DESTINATION_CRS: 'WSG84-to-GDA2020-standin',
+        }
+
+        validServiceInfo = Path('syncEnabledFeatureServiceInfo.json').read_text()
+        fakeHandler = FakeCorruptReplicaHttpsHandler().forParameters(parameters).withServiceInfo(validServiceInfo)
+
+        with patch('support.extractor.HttpSession.open', fakeHandler.open):
+            with pytest.raises(Exception) as e_info:
+                replicatorUnderTest = AGOLSurveyReplicator(parameters)
+
+                # when
+
+                replicatorUnderTest.extract()
+
+            # then
+
+            # Once while streaming, then again as a whole archive for the integrity check.
+            assert fakeHandler.resultCallCount == 2
+            assert 'failed integrity check' in str(e_info.value)
 
             
     def test_AGOLSurveyReplicator_replicate_bad_credentials(self):
@@ -177,7 +1029,7 @@ class TestAGOLSurveyReplicator:
         validServiceInfo = Path('syncEnabledFeatureServiceInfo.json').read_text()
         fakeHandler = FakeBadCredentialsHttpsHandler().forParameters(parameters).withServiceInfo(validServiceInfo)
 
-        with patch('support.extractor.urllib.request.urlopen', fakeHandler.open):
+        with patch('support.extractor.HttpSession.open', fakeHandler.open):
             with pytest.raises(Exception) as e_info:
                 replicatorUnderTest = AGOLSurveyReplicator(parameters)
 
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: tests/support/test_field_maps.py
+# Purpose: Testing harness for support/field_maps.py
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+import pytest
+from unittest.mock import patch
+
+from support.field_maps import FieldMapCache, compileFieldMap
+
+DESTINATION = 'c:/connections/survey.sde'
+
+
+@pytest.mark.usefixtures("resetArcpy", "resetMessengerSingleton")
+class TestFieldMaps:
+
+    def test_compileFieldMap_matches_exact_normalised_and_contained_names(self):
+        # given
+
+        originFieldNames = ['OBJECTID', 'SHAPE', 'globalid', 'date', 'site_code', 'notes', 'name']
+        destinationFieldNames = ['OBJECTID', 'GLOBALID', 'DATE_', 'the_site_code', 'notes_1', 'notes_2', 'NAME', 'surname']
+
+        # when
+
+        fieldMap = compileFieldMap(originFieldNames, destinationFieldNames)
+
+        # then
+
+        assert fieldMap == [
+            ['OBJECTID', 'OBJECTID'],
+            ['globalid', 'GLOBALID'],
+            ['date', 'DATE_'],
+            ['site_code', 'the_site_code'],
+            ['notes', None],
+            ['name', 'NAME']
+        ]
+
+    def test_FieldMapCache_skips_matching_while_schemas_are_unchanged(self, tmp_path):
+        # given
+
+        FieldMapCache(str(tmp_path)).fieldMapFor(DESTINATION, 'survey', ['OBJECTID', 'date'], ['OBJECTID', 'DATE_'])
+        compilations = []
+
+        def fakeCompileFieldMap(originFieldNames, destinationFieldNames):
+            compilations.append(originFieldNames)
+            return []
+
+        cacheUnderTest = FieldMapCache(str(tmp_path))
+
+        # when
+
+        with patch('support.field_maps.compileFieldMap', fakeCompileFieldMap):
+            unchanged = cacheUnderTest.fieldMapFor(DESTINATION, 'survey', ['OBJECTID', 'date'], ['OBJECTID', 'DATE_'])
+            changed = cacheUnderTest.fieldMapFor(DESTINATION, 'survey', ['OBJECTID', 'date', 'notes'], ['OBJECTID', 'DATE_', 'NOTES'])
+
+        # then
+
+        assert unchanged == [['OBJECTID', 'OBJECTID'], ['date', 'DATE_']]
+        assert changed == []
+        assert compilations == [['OBJECTID', 'date', 'notes']]
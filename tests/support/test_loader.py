@@ -9,11 +9,14 @@
 
 from support.parameters import *
 import support.time as time
+import support.metrics as metrics
+
+import datetime
 
 import pytest
 from unittest.mock import patch
 
-from support.loader import ReprojectingSDEAppender
+from support.loader import ReprojectingSDEAppender, ATTACHMENTS_APPENDED, ATTACHMENTS_DEDUPLICATED, ATTACHMENT_BYTES_SAVED
 
 
 class FakeArcpy():
@@ -24,6 +27,31 @@ class FakeArcpy():
         self.spatialReferenceInputs.append(crsCode)
 
 
+class FakeInsertCursor():
+    def __init__(self):
+        self.fields = None
+        self.batches = []
+
+    def open(self, table, fields):
+        self.fields = fields
+        self.batches.append([])
+        return self
+
+    def insertRow(self, row):
+        self.batches[-1].append(row)
+        return sum(len(batch) for batch in self.batches)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, exception_traceback):
+        pass
+
+
+def fakeAttachmentFields(table):
+    return [arcpy.Field('ATTACHMENTID', 'OID'), arcpy.Field('GLOBALID', 'GlobalID'), arcpy.Field('REL_GLOBALID', 'GUID'), arcpy.Field('DATA', 'Blob')]
+
+
 @pytest.mark.usefixtures("useTestDataDirectory", "resetArcpy", "resetMessengerSingleton")    
 class TestSDEAppender:
 
@@ -61,3 +89,313 @@ class TestSDEAppender:
         assert fakeArcpy.spatialReferenceInputs[1] == parameters[DESTINATION_CRS] # Explicit feature class creation
         
         assert arcpy.env.geographicTransformations == parameters[DESTINATION_GEOGRAPHIC_TRANSFORMATIONS] # General env projection/transformation
+
+    def test_SDEAppender_strips_main_qualifier_of_mobile_replica_tables(self):
+        # given
+           
+        parameters = {
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'c:/tmp/some_destination.gdb',
+            DESTINATION_CRS: 'GDA2020_MGA_Zone_56',
+            DESTINATION_GEOGRAPHIC_TRANSFORMATIONS: "WGS_1984_2_To_GDA2020"
+        }
+        
+        context = {
+            PROCESS_TIME: time.getUTCTimestamp(parameters[TIMEZONE]),
+            EXISTING_TABLES: []
+        }
+
+        featureClassesCreated = []
+        tablesCreated = []
+        appendDestinations = []
+
+        def fakeCreateFeatureclass(workspace, name, geometryType, template=None, spatial_reference=None):
+            featureClassesCreated.append(name)
+
+        def fakeCreateTable(workspace, name, template=None):
+            tablesCreated.append(name)
+
+        def fakeAppend(table, destination, schemaType, fieldMappings):
+            appendDestinations.append((table, destination))
+
+        loaderUnderTest = ReprojectingSDEAppender(parameters).withContext(context)
+
+        # when
+
+        with patch('support.loader.arcpy.ListFeatureClasses', lambda wildcard: ['main.survey']),\
+             patch('support.loader.arcpy.ListTables', lambda wildcard: ['main.repeat']),\
+             patch('support.loader.arcpy.CreateFeatureclass_management', fakeCreateFeatureclass, create=True),\
+             patch('support.loader.arcpy.management.CreateTable', fakeCreateTable),\
+             patch('support.append_scheduler.arcpy.management.Append', fakeAppend):
+            loaderUnderTest.loadFrom('fakeReplicant.geodatabase')
+
+        # then
+
+        assert featureClassesCreated + tablesCreated == ['myprefix_survey', 'myprefix_repeat']
+        assert sorted(appendDestinations) == [
+            ('main.repeat', 'c:/tmp/some_destination.gdb/myprefix_repeat'),
+            ('main.survey', 'c:/tmp/some_destination.gdb/myprefix_survey')
+        ]
+        assert sorted(context[LOADED_TABLES]) == ['myprefix_repeat', 'myprefix_survey']
+
+    def test_SDEAppender_indexes_synchronisation_field_of_tables_it_creates(self):
+        # given
+           
+        parameters = {
+            PORTAL: 'https://www.not.really.arcgis.com',
+            PORTAL_USER_NAME: 'TheUser',
+            PORTAL_PASSWORD: 'NopeNopeNopeNope',
+            SERVICE_URL: 'https://yaddayaddayadda.com/rest-of-url',
+
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'c:/tmp/some_destination.gdb',
+            DESTINATION_CRS: 'GDA2020_MGA_Zone_56',
+            DESTINATION_GEOGRAPHIC_TRANSFORMATIONS: "WGS_1984_2_To_GDA2020"
+        }
+        
+        newContext = {
+            PROCESS_TIME: time.getUTCTimestamp(parameters[TIMEZONE]),
+            EXISTING_TABLES: []
+        }
+        existingContext = {
+            PROCESS_TIME: time.getUTCTimestamp(parameters[TIMEZONE]),
+            EXISTING_TABLES: ['myprefix_featureClass1', 'myprefix_featureClass2', 'myprefix_table1', 'myprefix_table2']
+        }
+
+        indexesAdded = []
+        indexListings = []
+
+        def fakeAddIndex(table, fields, name):
+            indexesAdded.append((table.split('/')[-1], fields, name))
+            if table.endswith('myprefix_table1'):
+                raise arcpy.ExecuteError('ERROR 000464: Cannot get exclusive schema lock')
+
+        # when
+
+        with patch('support.loader.arcpy.ListIndexes', lambda table: indexListings.append(table) or []),\
+             patch('support.loader.arcpy.management.AddIndex', fakeAddIndex):
+            ReprojectingSDEAppender(parameters).withContext(newContext).loadFrom('fakeReplicant.gdb')
+            indexesAddedToNewTables = list(indexesAdded)
+            ReprojectingSDEAppender(parameters).withContext(existingContext).loadFrom('fakeReplicant.gdb')
+
+        # then
+
+        assert [table for table, fields, name in indexesAddedToNewTables] == ['myprefix_featureClass1', 'myprefix_featureClass2', 'myprefix_table1', 'myprefix_table2']
+        assert all(fields == ['SYS_TRANSFER_DATE'] for table, fields, name in indexesAdded)
+        assert len(set(name for table, fields, name in indexesAdded)) == 4
+        assert all(len(name) <= 30 for table, fields, name in indexesAdded)
+
+        assert sorted(newContext[LOADED_TABLES]) == sorted(existingContext[EXISTING_TABLES])
+        assert indexesAdded == indexesAddedToNewTables
+        assert indexListings == []
+
+    def test_SDEAppender_appendAttachments_reads_only_rows_stamped_this_run(self):
+        # given
+
+        parameters = {
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'c:/tmp/some_destination.gdb'
+        }
+
+        processTime = time.getUTCTimestamp(parameters[TIMEZONE])
+        context = { PROCESS_TIME: processTime }
+
+        whereClauses = []
+
+        class FakeSearchCursor():
+            def __init__(self, table, fields, where_clause=None):
+                if table.endswith('__ATTACH'):
+                    self.rows = [['inGUID1', None], ['inGUID2', None], ['inGUID1', None]]
+                    return
+                whereClauses.append((table, where_clause))
+                if table == 'myprefix_survey':
+                    self.rows = [['key1', 'inGUID1'], ['key2', 'inGUID2']]
+                elif where_clause == None:
+                    self.rows = [['oldKey', 'oldGUID'], ['key2', 'outGUID2']]
+                else:
+                    self.rows = [['key1', 'outGUID1']]
+
+            def __enter__(self):
+                return iter(self.rows)
+
+            def __exit__(self, exception_type, exception_value, exception_traceback):
+                pass
+
+        fakeInsertCursor = FakeInsertCursor()
+        loaderUnderTest = ReprojectingSDEAppender(parameters).withContext(context)
+
+        # when
+
+        with patch('support.loader.arcpy.da.SearchCursor', FakeSearchCursor),\
+             patch('support.loader.arcpy.da.InsertCursor', fakeInsertCursor.open),\
+             patch('support.loader.arcpy.ListFields', fakeAttachmentFields):
+            loaderUnderTest.appendAttachments('myprefix_survey', 'c:/tmp/some_destination.gdb/myprefix_survey')
+
+        # then
+
+        assert whereClauses == [
+            ('myprefix_survey', None),
+            ('c:/tmp/some_destination.gdb/myprefix_survey', f"SYS_TRANSFER_DATE = timestamp '{time.createTimestampText(processTime)}'"),
+            ('c:/tmp/some_destination.gdb/myprefix_survey', None)
+        ]
+        assert [row[0] for batch in fakeInsertCursor.batches for row in batch] == ['outGUID1', 'outGUID2', 'outGUID1']
+
+    def test_SDEAppender_streams_attachments_within_batch_budget(self):
+        # given
+
+        parameters = {
+            PREFIX: 'myprefix',
+            SDE_CONNECTION: 'c:/tmp/some_destination.gdb',
+            ATTACHMENT_BATCH_MB: '1'
+        }
+
+        context = {}
+        megabyte = 1024 * 1024
+        attachments = [['inGUID1', bytes(megabyte // 2)], ['inGUID1', bytes(megabyte // 2)], ['inGUID2', bytes(2 * megabyte)], ['inGUID2', None]]
+        fieldsRead = []
+
+        class FakeSearchCursor():
+            def __init__(self, table, fields, where_clause=None):
+                fieldsRead.append(fields)
+
+            def __enter__(self):
+                return iter(attachments)
+
+            def __exit__(self, exception_type, exception_value, exception_traceback):
+                pass
+
+        fakeInsertCursor = FakeInsertCursor()
+        loaderUnderTest = ReprojectingSDEAppender(parameters).withContext(context)
+
+        # when
+
+        with patch('support.loader.arcpy.da.SearchCursor', FakeSearchCursor),\
+             patch('support.loader.arcpy.da.InsertCursor', fakeInsertCursor.open),\
+             patch('support.loader.arcpy.ListFields', fakeAttachmentFields):
+            loaderUnderTest.streamAttachments('myprefix_survey__ATTACH', 'c:/tmp/some_destination.gdb/myprefix_survey__ATTACH', \
+                { 'inGUID1': 'outGUID1', 'inGUID2': 'outGUID2' })
+
+        # then
+
+        assert fieldsRead == [['REL_GLOBALID', 'DATA']]
+        assert fakeInsertCursor.fields == ['REL_GLOBALID', 'DATA']
+        assert [[row[0] for row in batch] for batch in fakeInsertCursor.batches] == [['outGUID1', 'outGUID1'], ['outGUID2'], ['outGUID2']]
+        assert metrics.valueOf(context, ATTACHMENTS_APPENDED) == 4
+
+    def test_SDEAppender_dedupes_attachments_across_runs(self, tmp_path):
+        # given
+
+        parameters = {
+            PREFIX: 'myprefix',
+            SDE_CONNECTION: 'c:/tmp/some_destination.gdb',
+            CACHE_DIRECTORY: str(tmp_path),
+            ATTACHMENT_DEDUPE: 'reference'
+        }
+
+        photo = b'the same photo'
+        attachments = [['inGUID1', 'a.jpg', photo], ['inGUID2', 'b.jpg', photo], ['inGUID2', 'c.jpg', b'another photo']]
+        lookup = { 'inGUID1': 'outGUID1', 'inGUID2': 'outGUID2' }
+        existenceChecks = []
+
+        class FakeSearchCursor():
+            def __init__(self, table, fields, where_clause=None):
+                self.rows = attachments
+                if where_clause != None:
+                    existenceChecks.append(where_clause)
+                    self.rows = [[1]]
+
+            def __enter__(self):
+                return iter(self.rows)
+
+            def __exit__(self, exception_type, exception_value, exception_traceback):
+                pass
+
+        def fakeFields(table):
+            return [arcpy.Field('ATTACHMENTID', 'OID'), arcpy.Field('REL_GLOBALID', 'GUID'), arcpy.Field('ATT_NAME'), arcpy.Field('DATA', 'Blob')]
+
+        firstInsertCursor = FakeInsertCursor()
+        secondInsertCursor = FakeInsertCursor()
+        firstContext = {}
+        secondContext = {}
+
+        # when
+
+        with patch('support.loader.arcpy.da.SearchCursor', FakeSearchCursor),\
+             patch('support.loader.arcpy.ListFields', fakeFields):
+            with patch('support.loader.arcpy.da.InsertCursor', firstInsertCursor.open):
+                firstLoader = ReprojectingSDEAppender(parameters).withContext(firstContext)
+                firstLoader.streamAttachments('myprefix_survey__ATTACH', 'c:/tmp/some_destination.gdb/myprefix_survey__ATTACH', lookup)
+                firstLoader.attachmentIndex.commit()
+                firstLoader.attachmentIndex.close()
+
+            with patch('support.loader.arcpy.da.InsertCursor', secondInsertCursor.open):
+                secondLoader = ReprojectingSDEAppender(parameters).withContext(secondContext)
+                secondLoader.streamAttachments('myprefix_survey__ATTACH', 'c:/tmp/some_destination.gdb/myprefix_survey__ATTACH', lookup)
+                secondLoader.attachmentIndex.close()
+
+        # then
+
+        assert [row[1] for batch in firstInsertCursor.batches for row in batch] == ['a.jpg', 'c.jpg']
+        assert metrics.valueOf(firstContext, ATTACHMENTS_DEDUPLICATED) == 1
+        assert metrics.valueOf(firstContext, ATTACHMENT_BYTES_SAVED) == len(photo)
+
+        assert secondInsertCursor.batches == []
+        assert existenceChecks == ['ATTACHMENTID = 1', 'ATTACHMENTID = 2']
+        assert metrics.valueOf(secondContext, ATTACHMENTS_DEDUPLICATED) == 3
+        assert metrics.valueOf(secondContext, ATTACHMENTS_APPENDED) == 0
+
+    def test_SDEAppender_writes_attachment_references_to_destination(self):
+        # given
+
+        parameters = {
+            PREFIX: 'myprefix',
+            SDE_CONNECTION: 'c:/tmp/some_destination.gdb',
+            ATTACHMENT_DEDUPE: 'reference'
+        }
+
+        processTime = datetime.datetime(2024, 6, 30, 12, 0, 0, 250000)
+        context = { PROCESS_TIME: processTime, CLEANUP_OPERATIONS: { 'append': ['myprefix_survey'] } }
+
+        photo = b'the same photo'
+        attachments = [['inGUID1', 'a.jpg', photo], ['inGUID2', 'b.jpg', photo], ['inGUID2', 'c.jpg', b'another photo']]
+        lookup = { 'inGUID1': 'outGUID1', 'inGUID2': 'outGUID2' }
+        tablesCreated = []
+
+        class FakeSearchCursor():
+            def __init__(self, table, fields, where_clause=None):
+                pass
+
+            def __enter__(self):
+                return iter(attachments)
+
+            def __exit__(self, exception_type, exception_value, exception_traceback):
+                pass
+
+        def fakeFields(table):
+            return [arcpy.Field('ATTACHMENTID', 'OID'), arcpy.Field('REL_GLOBALID', 'GUID'), arcpy.Field('ATT_NAME'), arcpy.Field('DATA', 'Blob')]
+
+        attachmentInsertCursor = FakeInsertCursor()
+        referenceInsertCursor = FakeInsertCursor()
+        loaderUnderTest = ReprojectingSDEAppender(parameters).withContext(context)
+
+        # when
+
+        with patch('support.loader.arcpy.da.SearchCursor', FakeSearchCursor),\
+             patch('support.loader.arcpy.ListFields', fakeFields),\
+             patch('support.loader.arcpy.management.CreateTable', lambda workspace, name: tablesCreated.append(name)):
+            with patch('support.loader.arcpy.da.InsertCursor', attachmentInsertCursor.open):
+                loaderUnderTest.streamAttachments('myprefix_survey__ATTACH', 'c:/tmp/some_destination.gdb/myprefix_survey__ATTACH', lookup)
+            with patch('support.loader.arcpy.da.InsertCursor', referenceInsertCursor.open):
+                loaderUnderTest.writeAttachmentReferences()
+
+        # then
+
+        assert [row[1] for batch in attachmentInsertCursor.batches for row in batch] == ['a.jpg', 'c.jpg']
+
+        assert tablesCreated == ['myprefix__ATTACH_REFS']
+        assert referenceInsertCursor.fields == ['REL_GLOBALID', 'ATT_NAME', 'ATTACHMENT_TABLE', 'ATTACHMENTID', 'SYS_TRANSFER_DATE']
+        assert referenceInsertCursor.batches == [[['outGUID2', 'b.jpg', 'myprefix_survey__ATTACH', 1, datetime.datetime(2024, 6, 30, 12, 0, 0)]]]
+        assert context[CLEANUP_OPERATIONS]['append'] == ['myprefix_survey', 'myprefix__ATTACH_REFS']
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: tests/support/test_poller.py
+# Purpose: Testing harness for support/poller.py
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+import pytest
+from unittest.mock import patch
+
+from support.poller import PollScheduler
+
+
+class FakeClock():
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonicSeconds(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestPollScheduler:
+
+    def test_PollScheduler_starts_subsecond_and_backs_off(self):
+        # given
+
+        fakeClock = FakeClock()
+
+        with patch('support.poller.time.monotonicSeconds', fakeClock.monotonicSeconds),\
+             patch('support.poller.time.sleep', fakeClock.sleep):
+
+            schedulerUnderTest = PollScheduler(deadlineSeconds = 3600, maxWaitSeconds = 30)
+
+            # when
+
+            for poll in range(12):
+                schedulerUnderTest.recordPoll()
+                schedulerUnderTest.wait()
+
+        # then
+
+        assert fakeClock.sleeps[0] <= 0.5
+        assert fakeClock.sleeps[0] >= 0.25
+        assert fakeClock.sleeps[4] >= 4.0
+        assert max(fakeClock.sleeps) <= 30
+        assert fakeClock.sleeps[-1] >= 15
+
+        assert schedulerUnderTest.pollCount == 12
+        assert schedulerUnderTest.totalWaitSeconds == pytest.approx(sum(fakeClock.sleeps))
+
+    def test_PollScheduler_jitters_waits(self):
+        # given
+
+        fakeClock = FakeClock()
+
+        with patch('support.poller.time.monotonicSeconds', fakeClock.monotonicSeconds):
+            waits = set()
+            for attempt in range(20):
+                schedulerUnderTest = PollScheduler(deadlineSeconds = 3600)
+                schedulerUnderTest.recordPoll()
+
+                # when
+
+                waits.add(schedulerUnderTest.nextWaitSeconds())
+
+        # then
+
+        assert len(waits) > 1
+
+    def test_PollScheduler_respects_deadline(self):
+        # given
+
+        fakeClock = FakeClock()
+
+        with patch('support.poller.time.monotonicSeconds', fakeClock.monotonicSeconds),\
+             patch('support.poller.time.sleep', fakeClock.sleep):
+
+            schedulerUnderTest = PollScheduler(deadlineSeconds = 10, maxWaitSeconds = 30)
+
+            # when
+
+            while not schedulerUnderTest.deadlinePassed():
+                schedulerUnderTest.recordPoll()
+                schedulerUnderTest.wait()
+
+        # then
+
+        assert schedulerUnderTest.totalWaitSeconds == pytest.approx(10)
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: tests/support/test_query_extractor.py
+# Purpose: Testing harness for support/query_extractor.py
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+from io import BytesIO
+from pathlib import Path
+
+import json
+import threading
+import urllib.parse
+import uuid
+
+from support.parameters import *
+
+import pytest
+from unittest.mock import patch
+
+from support.query_extractor import AGOLSurveyQueryExtractor
+import support.metrics as metrics
+
+
+class FakeHttpResponse(BytesIO):
+    def __init__(self, content, status = 200):
+        BytesIO.__init__(self, content)
+        self.status = status
+        self.headers = { 'Content-Length': str(len(content)) }
+
+
+class FakeQueryableServiceHttpsHandler():
+    '''Serves a survey layer with a repeat table, paging query results by resultOffset'''
+
+    def __init__(self, params, surveyRecords, repeatRecords, pageSize, capabilities = 'Query,Sync'):
+        self.params = params
+        self.capabilities = capabilities
+        self.tokenUUID = str(uuid.uuid4())
+        self.pageSize = pageSize
+        self.records = { '0': surveyRecords, '1': repeatRecords }
+        self.pageOffsetsQueried = { '0': [], '1': [] }
+        self.replicateJobCallCount = 0
+        self.lock = threading.Lock()
+
+    def definitionOf(self, layerId):
+        if layerId == '0':
+            return { 'id': 0, 'name': 'survey', 'objectIdField': 'objectid', 'maxRecordCount': self.pageSize,
+                     'geometryType': 'esriGeometryPoint', 'hasAttachments': True,
+                     'relationships': [ { 'id': 0, 'role': 'esriRelRoleOrigin', 'relatedTableId': 1, 'keyField': 'globalid',
+                                          'cardinality': 'esriRelCardinalityOneToMany', 'composition': True } ] }
+        return { 'id': 1, 'name': 'repeat', 'objectIdField': 'objectid', 'maxRecordCount': self.pageSize,
+                 'relationships': [ { 'id': 0, 'role': 'esriRelRoleDestination', 'relatedTableId': 0, 'keyField': 'parentglobalid' } ] }
+
+    def open(self, url, prameters = None, headers = None):
+        parts = urllib.parse.urlsplit(url)
+        query = urllib.parse.parse_qs(parts.query)
+        if prameters != None:
+            query.update(urllib.parse.parse_qs(prameters.decode('utf-8')))
+
+        if url.startswith(f'{self.params[PORTAL]}/sharing/rest/generateToken?'):
+            return self.reply({ 'token': self.tokenUUID })
+        if url == f"{self.params[SERVICE_URL]}?f=json&token={self.tokenUUID}":
+            return self.reply({ 'capabilities': self.capabilities, 'layers': [ { 'id': 0 } ], 'tables': [ { 'id': 1 } ] })
+        if parts.path.endswith('/createReplica/'):
+            self.replicateJobCallCount += 1
+            return self.reply({})
+
+        layerId = parts.path.split('/')[-2] if parts.path.endswith('/query') else parts.path.split('/')[-1]
+        if not parts.path.endswith('/query'):
+            return self.reply(self.definitionOf(layerId))
+        if query.get('returnCountOnly', ['false'])[0] == 'true':
+            return self.reply({ 'count': len(self.records[layerId]) })
+
+        offset = int(query['resultOffset'][0])
+        with self.lock:
+            self.pageOffsetsQueried[layerId].append(offset)
+        page = self.records[layerId][offset:offset + int(query['resultRecordCount'][0])]
+        return self.reply({
+            'objectIdFieldName': 'objectid',
+            'fields': [ { 'name': 'objectid', 'type': 'esriFieldTypeOID' } ],
+            'features': [ { 'attributes': record } for record in page ]
+        })
+
+    def reply(self, content):
+        return FakeHttpResponse(json.dumps(content).encode('utf-8'))
+
+
+class FakeConversionRecorder():
+    def __init__(self):
+        self.featureSets = {}
+        self.relationships = []
+
+    def JSONToFeatures(self, jsonPath, outFeatures, geometry_type = None):
+        self.featureSets[Path(outFeatures).name] = json.loads(Path(jsonPath).read_text())
+
+    def CreateRelationshipClass(self, origin, destination, relationshipClass, *args):
+        self.relationships.append((Path(origin).name, Path(destination).name, args[0], args[-2], args[-1]))
+
+
+@pytest.mark.usefixtures("useTestDataDirectory", "resetArcpy", "resetMessengerSingleton")
+class TestAGOLSurveyQueryExtractor:
+
+    def test_AGOLSurveyQueryExtractor_pages_layers_into_geodatabase(self):
+        # given
+
+        parameters = {
+            PORTAL: 'https://www.not.really.arcgis.com',
+            PORTAL_USER_NAME: 'TheUser',
+            PORTAL_PASSWORD: 'NopeNopeNopeNope',
+            SERVICE_URL: 'https://yaddayaddayadda.com/rest-of-url',
+            QUERY_WORKERS: '3',
+
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'blob.gdb',
+            DESTINATION_CRS: 'WSG84-to-GDA2020-standin',
+        }
+
+        context = {}
+
+        surveyRecords = [ { 'objectid': index } for index in range(1, 8) ]
+        repeatRecords = [ { 'objectid': index } for index in range(1, 3) ]
+
+        fakeHandler = FakeQueryableServiceHttpsHandler(parameters, surveyRecords, repeatRecords, pageSize = 3)
+        fakeConversion = FakeConversionRecorder()
+        attachmentFetches = []
+
+        with patch('support.extractor.HttpSession.open', fakeHandler.open),\
+             patch('support.query_extractor.arcpy.conversion.JSONToFeatures', fakeConversion.JSONToFeatures),\
+             patch('support.query_extractor.arcpy.management.CreateRelationshipClass', fakeConversion.CreateRelationshipClass),\
+             patch('support.extractor.AttachmentFetcher.fetchInto', lambda self, gdb, table, url, where, token: attachmentFetches.append(table)):
+
+            extractorUnderTest = AGOLSurveyQueryExtractor(parameters).withContext(context)
+
+            # when
+
+            surveyGDB = extractorUnderTest.extract()
+
+        # then
+
+        assert surveyGDB.endswith('survey.gdb')
+        assert fakeHandler.replicateJobCallCount == 0
+
+        assert sorted(fakeHandler.pageOffsetsQueried['0']) == [0, 3, 6]
+        assert fakeHandler.pageOffsetsQueried['1'] == [0]
+
+        assert [f['attributes'] for f in fakeConversion.featureSets['survey']['features']] == surveyRecords
+        assert fakeConversion.featureSets['survey']['objectIdFieldName'] == 'objectid'
+        assert [f['attributes'] for f in fakeConversion.featureSets['repeat']['features']] == repeatRecords
+
+        assert attachmentFetches == ['survey']
+        assert fakeConversion.relationships == [ ('survey', 'repeat', 'COMPOSITE', 'globalid', 'parentglobalid') ]
+
+        assert metrics.valueOf(context, 'QueryPages') == 4
+        assert metrics.valueOf(context, 'QueryRecords') == 9
+
+    def test_AGOLSurveyQueryExtractor_writes_empty_layers(self):
+        # given
+
+        parameters = {
+            PORTAL: 'https://www.not.really.arcgis.com',
+            PORTAL_USER_NAME: 'TheUser',
+            PORTAL_PASSWORD: 'NopeNopeNopeNope',
+            SERVICE_URL: 'https://yaddayaddayadda.com/rest-of-url',
+
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'blob.gdb',
+            DESTINATION_CRS: 'WSG84-to-GDA2020-standin',
+        }
+
+        fakeHandler = FakeQueryableServiceHttpsHandler(parameters, [], [], pageSize = 1000)
+        fakeConversion = FakeConversionRecorder()
+
+        with patch('support.extractor.HttpSession.open', fakeHandler.open),\
+             patch('support.query_extractor.arcpy.conversion.JSONToFeatures', fakeConversion.JSONToFeatures),\
+             patch('support.query_extractor.arcpy.management.CreateRelationshipClass', fakeConversion.CreateRelationshipClass),\
+             patch('support.extractor.AttachmentFetcher.fetchInto', lambda self, gdb, table, url, where, token: None):
+
+            extractorUnderTest = AGOLSurveyQueryExtractor(parameters)
+
+            # when
+
+            extractorUnderTest.extract()
+
+        # then
+
+        assert fakeConversion.featureSets['survey']['features'] == []
+        assert fakeConversion.featureSets['repeat']['features'] == []
+
+    def test_AGOLSurveyQueryExtractor_needs_query_not_sync_capability(self):
+        # given
+
+        parameters = {
+            PORTAL: 'https://www.not.really.arcgis.com',
+            PORTAL_USER_NAME: 'TheUser',
+            PORTAL_PASSWORD: 'NopeNopeNopeNope',
+            SERVICE_URL: 'https://yaddayaddayadda.com/rest-of-url',
+            QUERY_WORKERS: '1',
+
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'blob.gdb',
+            DESTINATION_CRS: 'WSG84-to-GDA2020-standin',
+        }
+
+        surveyRecords = [ { 'objectid': index } for index in range(1, 12) ]
+        queryOnlyHandler = FakeQueryableServiceHttpsHandler(parameters, surveyRecords, [], pageSize = 1, capabilities = 'Query')
+        syncOnlyHandler = FakeQueryableServiceHttpsHandler(parameters, [], [], pageSize = 1, capabilities = 'Sync')
+        fakeConversion = FakeConversionRecorder()
+
+        with patch('support.query_extractor.arcpy.conversion.JSONToFeatures', fakeConversion.JSONToFeatures),\
+             patch('support.query_extractor.arcpy.management.CreateRelationshipClass', fakeConversion.CreateRelationshipClass),\
+             patch('support.extractor.AttachmentFetcher.fetchInto', lambda self, gdb, table, url, where, token: None):
+
+            # when
+
+            with patch('support.extractor.HttpSession.open', queryOnlyHandler.open):
+                AGOLSurveyQueryExtractor(parameters).extract()
+
+            # then
+
+            assert [f['attributes'] for f in fakeConversion.featureSets['survey']['features']] == surveyRecords
+
+            with patch('support.extractor.HttpSession.open', syncOnlyHandler.open):
+                with pytest.raises(Exception, match='Query Capabilities not enabled'):
+                    AGOLSurveyQueryExtractor(parameters).extract()
+
+    def test_AGOLSurveyQueryExtractor_invalid_worker_count(self):
+        # when/then
+
+        with pytest.raises(SystemExit, match=r'\[query_workers\] expects a whole number'):
+            AGOLSurveyQueryExtractor({ QUERY_WORKERS: 'many' })
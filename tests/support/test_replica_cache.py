@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: tests/support/test_replica_cache.py
+# Purpose: Testing harness for support/replica_cache.py
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+import datetime
+import pytz
+
+import pytest
+
+from support.replica_cache import ReplicaCache, contentHashOf, MAX_REPLICA_AGE_SECONDS
+
+SERVICE_URL = 'https://yaddayaddayadda.com/rest-of-url'
+PROCESS_TIME = pytz.utc.localize(datetime.datetime(2024, 6, 2, 0, 0, 0))
+LAST_SYNC_TIME = datetime.datetime(2024, 6, 1, 0, 0, 0)
+
+
+def createReplica(parentPath, content):
+    replicaPath = parentPath.joinpath('survey.gdb')
+    replicaPath.mkdir(parents=True)
+    replicaPath.joinpath('a00000001.gdbtable').write_bytes(content)
+    return str(replicaPath)
+
+
+@pytest.mark.usefixtures("resetArcpy", "resetMessengerSingleton")
+class TestReplicaCache:
+
+    def test_contentHashOf_tracks_bytes_not_location(self, tmp_path):
+        # given
+
+        first = createReplica(tmp_path.joinpath('first'), b'same rows')
+        second = createReplica(tmp_path.joinpath('second'), b'same rows')
+        different = createReplica(tmp_path.joinpath('different'), b'other rows')
+
+        # then
+
+        assert contentHashOf(first) == contentHashOf(second)
+        assert contentHashOf(first) != contentHashOf(different)
+
+    def test_ReplicaCache_recognises_loaded_replica(self, tmp_path):
+        # given
+
+        cacheUnderTest = ReplicaCache(str(tmp_path.joinpath('cache')), 1024 * 1024)
+        replicaPath = createReplica(tmp_path.joinpath('download'), b'rows')
+        contentHash = contentHashOf(replicaPath)
+
+        cacheUnderTest.store(SERVICE_URL, ['1', '0'], replicaPath, contentHash, LAST_SYNC_TIME, PROCESS_TIME)
+
+        # when
+
+        loadedBeforeMarking = cacheUnderTest.alreadyLoaded(SERVICE_URL, ['0', '1'], contentHash)
+        cacheUnderTest.markLoaded(SERVICE_URL, ['0', '1'], contentHash)
+
+        # then
+
+        assert not loadedBeforeMarking
+        assert cacheUnderTest.alreadyLoaded(SERVICE_URL, ['1', '0'], contentHash)
+        assert not cacheUnderTest.alreadyLoaded(SERVICE_URL, ['0'], contentHash)
+        assert not cacheUnderTest.alreadyLoaded(SERVICE_URL, ['0', '1'], 'someOtherHash')
+
+        # Loaded replicas are remembered by hash only.
+        assert list(tmp_path.joinpath('cache', 'replicas').glob('*/survey.gdb')) == []
+
+    def test_ReplicaCache_hands_back_unloaded_replica(self, tmp_path):
+        # given
+
+        cacheUnderTest = ReplicaCache(str(tmp_path.joinpath('cache')), 1024 * 1024)
+        replicaPath = createReplica(tmp_path.joinpath('download'), b'rows')
+        cacheUnderTest.store(SERVICE_URL, ['0'], replicaPath, contentHashOf(replicaPath), LAST_SYNC_TIME, PROCESS_TIME)
+
+        # when
+
+        retry = cacheUnderTest.unloadedReplica(SERVICE_URL, LAST_SYNC_TIME)
+        staleRetry = cacheUnderTest.unloadedReplica(SERVICE_URL, datetime.datetime(2024, 6, 1, 12, 0, 0))
+
+        # then
+
+        workingPath, layers, processTime = retry
+        assert workingPath != replicaPath
+        assert contentHashOf(workingPath) == contentHashOf(replicaPath)
+        assert layers == ['0']
+        assert processTime == PROCESS_TIME
+
+        assert staleRetry == None
+
+    def test_ReplicaCache_discards_replica_that_fails_to_load_twice(self, tmp_path):
+        # given
+
+        cacheUnderTest = ReplicaCache(str(tmp_path.joinpath('cache')), 1024 * 1024)
+        replicaPath = createReplica(tmp_path.joinpath('download'), b'rows')
+        contentHash = contentHashOf(replicaPath)
+
+        # when
+
+        cacheUnderTest.store(SERVICE_URL, ['0'], replicaPath, contentHash, LAST_SYNC_TIME, PROCESS_TIME)
+        firstRetry = cacheUnderTest.unloadedReplica(SERVICE_URL, LAST_SYNC_TIME)
+
+        cacheUnderTest.store(SERVICE_URL, ['0'], firstRetry[0], contentHash, LAST_SYNC_TIME, PROCESS_TIME)
+        secondRetry = cacheUnderTest.unloadedReplica(SERVICE_URL, LAST_SYNC_TIME)
+
+        # then
+
+        assert secondRetry == None
+        assert cacheUnderTest.entryFor(SERVICE_URL) == None
+        assert list(tmp_path.joinpath('cache', 'replicas').glob('*/survey.gdb')) == []
+
+    def test_ReplicaCache_discards_replica_past_maximum_age(self, tmp_path, monkeypatch):
+        # given
+
+        cacheUnderTest = ReplicaCache(str(tmp_path.joinpath('cache')), 1024 * 1024)
+        replicaPath = createReplica(tmp_path.joinpath('download'), b'rows')
+        cacheUnderTest.store(SERVICE_URL, ['0'], replicaPath, contentHashOf(replicaPath), LAST_SYNC_TIME, PROCESS_TIME)
+
+        storedAt = cacheUnderTest.entryFor(SERVICE_URL)['storedAt']
+        monkeypatch.setattr('support.time.epochSeconds', lambda: storedAt + MAX_REPLICA_AGE_SECONDS + 1)
+
+        # when
+
+        retry = cacheUnderTest.unloadedReplica(SERVICE_URL, LAST_SYNC_TIME)
+
+        # then
+
+        assert retry == None
+        assert cacheUnderTest.entryFor(SERVICE_URL) == None
+
+    def test_ReplicaCache_evicts_oldest_to_fit(self, tmp_path):
+        # given
+
+        cacheUnderTest = ReplicaCache(str(tmp_path.joinpath('cache')), 150)
+
+        firstPath = createReplica(tmp_path.joinpath('first'), b'x' * 100)
+        cacheUnderTest.store('https://first.com/service', ['0'], firstPath, contentHashOf(firstPath), None, PROCESS_TIME)
+
+        secondPath = createReplica(tmp_path.joinpath('second'), b'y' * 100)
+
+        # when
+
+        cacheUnderTest.store('https://second.com/service', ['0'], secondPath, contentHashOf(secondPath), None, PROCESS_TIME)
+
+        # then
+
+        assert cacheUnderTest.unloadedReplica('https://first.com/service', None) == None
+        assert cacheUnderTest.unloadedReplica('https://second.com/service', None) != None
+
+    def test_ReplicaCache_skips_replicas_over_limit(self, tmp_path):
+        # given
+
+        cacheUnderTest = ReplicaCache(str(tmp_path.joinpath('cache')), 50)
+        replicaPath = createReplica(tmp_path.joinpath('download'), b'x' * 100)
+
+        # when
+
+        cacheUnderTest.store(SERVICE_URL, ['0'], replicaPath, contentHashOf(replicaPath), None, PROCESS_TIME)
+
+        # then
+
+        assert cacheUnderTest.unloadedReplica(SERVICE_URL, None) == None
@@ -11,11 +11,16 @@ from support.parameters import *
 from support.reprojector import SurveyReprojector
 from support.extractor import NullSurveyReplicator
 from support.loader import NullLoader
+from support.sync_state import SyncStateStore
+import support.metrics as metrics
 import support.time as time
 
 import pytest
 from unittest.mock import patch
 
+import tempfile
+from pathlib import Path
+
 import arcpy
 
 DUMMY_ENTRY = 'dummyentry'
@@ -38,6 +43,47 @@ class FakeReplicator(NullSurveyReplicator):
         return 'FakeReplicant.gdb'
 
 
+class FakeMetricRecordingReplicator(NullSurveyReplicator):
+    def extract(self):
+        metrics.record(self.context, 'SomeMetric', 42)
+        return 'FakeReplicant.gdb'
+
+
+class FakeUnchangedSurveyReplicator(NullSurveyReplicator):
+    def extract(self):
+        return None
+
+
+class FakeCountingLoader(NullLoader):
+    def __init__(self, parametersSupplied):
+        NullLoader.__init__(self, parametersSupplied)
+        self.loadCount = 0
+
+    def loadFrom(self, surveyGDB):
+        self.loadCount += 1
+
+
+class FakeRepeatingReplicator(NullSurveyReplicator):
+    '''Downloads a byte-identical replica to a fresh directory every run'''
+
+    def extract(self):
+        self.context[REPLICA_LAYERS] = ['0', '1']
+        replicaPath = Path(tempfile.mkdtemp()).joinpath('survey.gdb')
+        replicaPath.mkdir()
+        replicaPath.joinpath('a00000001.gdbtable').write_bytes(b'the same rows')
+        return str(replicaPath)
+
+
+class FakeTableLoadingLoader(NullLoader):
+    def loadFrom(self, surveyGDB):
+        self.context[LOADED_TABLES] = ['myprefix_survey']
+
+
+class FakeFailingLoader(NullLoader):
+    def loadFrom(self, surveyGDB):
+        raise arcpy.ExecuteError('some fake load error')
+
+
 class FakeAttributeErrorReplicator(NullSurveyReplicator):
     def extract(self):
         raise AttributeError("Here's a randon attribute error")
@@ -218,4 +264,172 @@ class TestSurveyReprojecor:
 
         fakeProxy.cleanupCreatedTablesCalled = 1
         fakeProxy.cleanupAppendsCalled = 1
-        
\ No newline at end of file
+
+
+    def test_SurveyReprojector_reports_metrics(self):
+        # given
+           
+        parameters = {
+            PORTAL: 'https://www.not.really.arcgis.com',
+            PORTAL_USER_NAME: 'TheUser',
+            PORTAL_PASSWORD: 'NopeNopeNopeNope',
+            SERVICE_URL: 'https://yaddayaddayadda.com/rest-of-url',
+
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'some_destination.gdb',
+            DESTINATION_CRS: 'WSG84-to-GDA2020-standin',
+        }
+
+        reprojectorUnderTest = SurveyReprojector(parameters).usingExtractor(FakeMetricRecordingReplicator(parameters))
+
+        # when
+
+        reprojectorUnderTest.reproject()
+
+        # then
+
+        assert any(message.endswith('SomeMetric = [42]') for message in arcpy.messages)
+
+    def test_SurveyReprojector_skips_unchanged_survey(self):
+        # given
+           
+        parameters = {
+            PORTAL: 'https://www.not.really.arcgis.com',
+            PORTAL_USER_NAME: 'TheUser',
+            PORTAL_PASSWORD: 'NopeNopeNopeNope',
+            SERVICE_URL: 'https://yaddayaddayadda.com/rest-of-url',
+
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'some_destination.gdb',
+            DESTINATION_CRS: 'WSG84-to-GDA2020-standin',
+        }
+
+        fakeLoader = FakeCountingLoader(parameters)
+        reprojectorUnderTest = SurveyReprojector(parameters).\
+                                usingExtractor(FakeUnchangedSurveyReplicator(parameters)).\
+                                usingLoader(fakeLoader)
+
+        # when
+
+        with patch('support.reprojector.arcpy_proxy.ArcpyProxy.Delete') as fakeDelete:
+            reprojectorUnderTest.reproject()
+
+        # then
+
+        assert fakeLoader.loadCount == 0
+        assert fakeDelete.call_count == 0
+        assert any(message.endswith('No changes to synchronise. Skipping transformation and loading.') for message in arcpy.messages)
+
+    def test_SurveyReprojector_skips_replica_identical_to_last_loaded(self, tmp_path):
+        # given
+           
+        parameters = {
+            PORTAL: 'https://www.not.really.arcgis.com',
+            PORTAL_USER_NAME: 'TheUser',
+            PORTAL_PASSWORD: 'NopeNopeNopeNope',
+            SERVICE_URL: 'https://yaddayaddayadda.com/rest-of-url',
+            CACHE_DIRECTORY: str(tmp_path),
+
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'some_destination.gdb',
+            DESTINATION_CRS: 'WSG84-to-GDA2020-standin',
+        }
+
+        fakeLoader = FakeCountingLoader(parameters)
+
+        SurveyReprojector(parameters).\
+            usingExtractor(FakeRepeatingReplicator(parameters)).\
+            usingLoader(fakeLoader).\
+            reproject()
+
+        # when
+
+        SurveyReprojector(parameters).\
+            usingExtractor(FakeRepeatingReplicator(parameters)).\
+            usingLoader(fakeLoader).\
+            reproject()
+
+        # then
+
+        assert fakeLoader.loadCount == 1
+        assert any(message.endswith('Replica is identical to the last one loaded. Skipping transformation and loading.') for message in arcpy.messages)
+
+    def test_SurveyReprojector_reloads_replica_after_failed_load(self, tmp_path):
+        # given
+           
+        parameters = {
+            PORTAL: 'https://www.not.really.arcgis.com',
+            PORTAL_USER_NAME: 'TheUser',
+            PORTAL_PASSWORD: 'NopeNopeNopeNope',
+            SERVICE_URL: 'https://yaddayaddayadda.com/rest-of-url',
+            CACHE_DIRECTORY: str(tmp_path),
+
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'some_destination.gdb',
+            DESTINATION_CRS: 'WSG84-to-GDA2020-standin',
+        }
+
+        with pytest.raises(SystemExit):
+            SurveyReprojector(parameters).\
+                usingExtractor(FakeRepeatingReplicator(parameters)).\
+                usingLoader(FakeFailingLoader(parameters)).\
+                reproject()
+
+        fakeLoader = FakeCountingLoader(parameters)
+
+        # when
+
+        SurveyReprojector(parameters).\
+            usingExtractor(FakeRepeatingReplicator(parameters)).\
+            usingLoader(fakeLoader).\
+            reproject()
+
+        # then
+
+        assert fakeLoader.loadCount == 1
+
+    def test_SurveyReprojector_records_table_watermarks_only_after_successful_load(self, tmp_path):
+        # given
+           
+        parameters = {
+            PORTAL: 'https://www.not.really.arcgis.com',
+            PORTAL_USER_NAME: 'TheUser',
+            PORTAL_PASSWORD: 'NopeNopeNopeNope',
+            SERVICE_URL: 'https://yaddayaddayadda.com/rest-of-url',
+            CACHE_DIRECTORY: str(tmp_path),
+
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'some_destination.gdb',
+            DESTINATION_CRS: 'WSG84-to-GDA2020-standin',
+        }
+        syncState = SyncStateStore(str(tmp_path))
+
+        with pytest.raises(SystemExit):
+            SurveyReprojector(parameters).\
+                usingExtractor(FakeRepeatingReplicator(parameters)).\
+                usingLoader(FakeFailingLoader(parameters)).\
+                reproject()
+
+        assert syncState.watermarksFor(parameters[SDE_CONNECTION], parameters[PREFIX], ['myprefix_survey']) == {}
+
+        # when
+
+        reprojectorUnderTest = SurveyReprojector(parameters)
+        reprojectorUnderTest.context[EXISTING_TABLES] = ['myprefix_repeat']
+        reprojectorUnderTest.\
+            usingExtractor(FakeRepeatingReplicator(parameters)).\
+            usingLoader(FakeTableLoadingLoader(parameters)).\
+            reproject()
+
+        # then
+
+        processTime = reprojectorUnderTest.context[PROCESS_TIME].replace(tzinfo=None, microsecond=0)
+        assert syncState.watermarksFor(parameters[SDE_CONNECTION], parameters[PREFIX], ['myprefix_survey', 'myprefix_repeat']) == {
+            'myprefix_survey': processTime,
+            'myprefix_repeat': processTime
+        }
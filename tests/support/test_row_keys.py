@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: tests/support/test_row_keys.py
+# Purpose: Testing harness for support/row_keys.py
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+import pytest
+
+from support.row_keys import guidBatch, rowKeys
+
+import itertools
+import uuid
+
+
+class TestRowKeys:
+
+    def test_guidBatch_formats_version_4_guids(self):
+        # when
+
+        keys = guidBatch(1000)
+
+        # then
+
+        assert len(keys) == 1000
+        assert len(set(keys)) == 1000
+        for key in keys:
+            assert key.startswith('{') and key.endswith('}')
+            parsed = uuid.UUID(key[1:-1])
+            assert parsed.version == 4
+            assert parsed.variant == uuid.RFC_4122
+            assert key == '{' + str(parsed) + '}'
+
+    def test_rowKeys_carries_on_across_batches(self):
+        # when
+
+        keys = list(itertools.islice(rowKeys(batchSize=3), 10))
+
+        # then
+
+        assert len(keys) == 10
+        assert len(set(keys)) == 10
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: tests/support/test_service_cache.py
+# Purpose: Testing harness for support/service_cache.py
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+import pytest
+from unittest.mock import patch
+
+from support.service_cache import ServiceDefinitionCache, summariseServiceDefinition
+
+SERVICE_URL = 'https://yaddayaddayadda.com/rest-of-url'
+
+DEFINITION = {
+    'capabilities': 'Query,Sync',
+    'syncCapabilities': { 'supportsAttachmentsSyncDirection': True },
+    'layers': [ { 'id': 0, 'name': 'survey', 'geometryType': 'esriGeometryPoint', 'minScale': 0, 'subLayerIds': None } ],
+    'tables': [ { 'id': 1, 'name': 'repeat' } ],
+    'fullExtent': { 'xmin': 0, 'ymin': 0, 'xmax': 1, 'ymax': 1 },
+    'serviceDescription': 'A long description' * 100
+}
+
+
+@pytest.mark.usefixtures("resetArcpy", "resetMessengerSingleton")
+class TestServiceDefinitionCache:
+
+    def test_summariseServiceDefinition_keeps_what_the_extractor_reads(self):
+        # when
+
+        summary = summariseServiceDefinition(DEFINITION)
+
+        # then
+
+        assert summary == {
+            'capabilities': 'Query,Sync',
+            'syncCapabilities': { 'supportsAttachmentsSyncDirection': True },
+            'layers': [ { 'id': 0, 'name': 'survey', 'geometryType': 'esriGeometryPoint' } ],
+            'tables': [ { 'id': 1, 'name': 'repeat' } ]
+        }
+
+    def test_ServiceDefinitionCache_round_trip_per_user(self, tmp_path):
+        # given
+
+        ServiceDefinitionCache(str(tmp_path), 3600).put(SERVICE_URL, 'TheUser', DEFINITION, '"v1"', None)
+
+        # when
+
+        cacheUnderTest = ServiceDefinitionCache(str(tmp_path), 3600)
+        entry = cacheUnderTest.get(SERVICE_URL + '/', 'TheUser')
+
+        # then
+
+        assert entry['definition'] == summariseServiceDefinition(DEFINITION)
+        assert entry['etag'] == '"v1"'
+        assert cacheUnderTest.get(SERVICE_URL, 'SomeoneElse') == None
+
+    def test_ServiceDefinitionCache_revalidates_entries_with_validators(self, tmp_path):
+        # given
+
+        cacheUnderTest = ServiceDefinitionCache(str(tmp_path), 3600)
+        cacheUnderTest.put(SERVICE_URL, 'TheUser', DEFINITION, None, 'Sat, 01 Jun 2024 08:30:00 GMT')
+
+        # when/then
+
+        assert not cacheUnderTest.isUsableWithoutRequest(cacheUnderTest.get(SERVICE_URL, 'TheUser'))
+
+    def test_ServiceDefinitionCache_trusts_unvalidated_entries_within_ttl(self, tmp_path):
+        # given
+
+        cacheUnderTest = ServiceDefinitionCache(str(tmp_path), 3600)
+        cacheUnderTest.put(SERVICE_URL, 'TheUser', DEFINITION, None, None)
+        entry = cacheUnderTest.get(SERVICE_URL, 'TheUser')
+
+        # when/then
+
+        assert cacheUnderTest.isUsableWithoutRequest(entry)
+        with patch('support.service_cache.time.epochSeconds', lambda: entry['fetchedAt'] + 3601):
+            assert not cacheUnderTest.isUsableWithoutRequest(entry)
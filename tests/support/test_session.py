@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: tests/support/test_session.py
+# Purpose: Testing harness for support/session.py
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+import gzip
+import json
+import threading
+import urllib.error
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from support.session import HttpSession
+
+
+class FakePortalRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connectionsAccepted += 1
+
+    def reply(self, status, body, headers = {}):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.acceptEncodings.append(self.headers.get('Accept-Encoding'))
+        if self.path.startswith('/json'):
+            body = json.dumps({ 'path': self.path }).encode('utf-8')
+            if 'gzip' in (self.headers.get('Accept-Encoding') or ''):
+                self.reply(200, gzip.compress(body), { 'Content-Encoding': 'gzip' })
+            else:
+                self.reply(200, body)
+        elif self.path == '/definition':
+            if self.headers.get('If-None-Match') == '"v1"':
+                self.reply(304, b'', { 'ETag': '"v1"' })
+            else:
+                self.reply(200, b'{"layers": []}', { 'ETag': '"v1"', 'Last-Modified': 'Sat, 01 Jun 2024 08:30:00 GMT' })
+        elif self.path == '/moved':
+            self.reply(302, b'', { 'Location': '/json/landed' })
+        else:
+            self.reply(404, b'{"error": "not found"}')
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length'))
+        body = json.dumps({ 'posted': self.rfile.read(length).decode('utf-8') }).encode('utf-8')
+        self.reply(200, body)
+
+
+@pytest.fixture
+def fakePortal(monkeypatch):
+    monkeypatch.setenv('no_proxy', '*')
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakePortalRequestHandler)
+    server.connectionsAccepted = 0
+    server.acceptEncodings = []
+    thread = threading.Thread(target=server.serve_forever, kwargs={ 'poll_interval': 0.05 }, daemon=True)
+    thread.start()
+
+    HttpSession().reset()
+    yield server
+
+    HttpSession().reset()
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.usefixtures("resetArcpy", "resetMessengerSingleton")
+class TestHttpSession:
+
+    def test_HttpSession_isSingleton(self):
+        assert HttpSession() == HttpSession()
+
+    def test_HttpSession_reuses_connection(self, fakePortal):
+        # given
+
+        baseUrl = f'http://127.0.0.1:{fakePortal.server_port}'
+        sessionUnderTest = HttpSession()
+
+        # when
+
+        responses = [sessionUnderTest.getJson(f'{baseUrl}/json/{index}') for index in range(5)]
+
+        # then
+
+        assert [response['path'] for response in responses] == [f'/json/{index}' for index in range(5)]
+        assert fakePortal.connectionsAccepted == 1
+
+    def test_HttpSession_negotiates_gzip_for_json(self, fakePortal):
+        # given
+
+        baseUrl = f'http://127.0.0.1:{fakePortal.server_port}'
+
+        # when
+
+        response = HttpSession().getJson(f'{baseUrl}/json/zipped')
+
+        # then
+
+        assert response == { 'path': '/json/zipped' }
+        assert fakePortal.acceptEncodings == ['gzip']
+
+    def test_HttpSession_open_leaves_encoding_alone(self, fakePortal):
+        # given
+
+        baseUrl = f'http://127.0.0.1:{fakePortal.server_port}'
+
+        # when
+
+        with HttpSession().open(f'{baseUrl}/json/raw') as response:
+            body = response.read()
+
+        # then
+
+        assert json.loads(body) == { 'path': '/json/raw' }
+        assert fakePortal.acceptEncodings == ['identity']
+
+    def test_HttpSession_posts_form_data(self, fakePortal):
+        # given
+
+        baseUrl = f'http://127.0.0.1:{fakePortal.server_port}'
+
+        # when
+
+        response = HttpSession().getJson(f'{baseUrl}/token', b'username=TheUser')
+
+        # then
+
+        assert response == { 'posted': 'username=TheUser' }
+
+    def test_HttpSession_conditional_get(self, fakePortal):
+        # given
+
+        baseUrl = f'http://127.0.0.1:{fakePortal.server_address[1]}'
+        sessionUnderTest = HttpSession()
+
+        # when
+
+        firstResponse = sessionUnderTest.getJsonIfChanged(f'{baseUrl}/definition')
+        secondResponse = sessionUnderTest.getJsonIfChanged(f'{baseUrl}/definition', firstResponse[1], firstResponse[2])
+
+        # then
+
+        assert firstResponse == ({ 'layers': [] }, '"v1"', 'Sat, 01 Jun 2024 08:30:00 GMT')
+        assert secondResponse == (None, '"v1"', 'Sat, 01 Jun 2024 08:30:00 GMT')
+        assert fakePortal.connectionsAccepted == 1
+
+    def test_HttpSession_follows_redirects(self, fakePortal):
+        # given
+
+        baseUrl = f'http://127.0.0.1:{fakePortal.server_port}'
+
+        # when
+
+        response = HttpSession().getJson(f'{baseUrl}/moved')
+
+        # then
+
+        assert response == { 'path': '/json/landed' }
+        assert fakePortal.connectionsAccepted == 1
+
+    def test_HttpSession_raises_HTTPError(self, fakePortal):
+        # given
+
+        baseUrl = f'http://127.0.0.1:{fakePortal.server_port}'
+
+        # when/then
+
+        with pytest.raises(urllib.error.HTTPError) as e_info:
+            HttpSession().getJson(f'{baseUrl}/missing')
+
+        assert e_info.value.code == 404
+
+    def test_HttpSession_replaces_abandoned_connection(self, fakePortal):
+        # given
+
+        baseUrl = f'http://127.0.0.1:{fakePortal.server_port}'
+        sessionUnderTest = HttpSession()
+
+        # when
+
+        response = sessionUnderTest.open(f'{baseUrl}/json/abandoned')
+        response.read(2)
+        response.close()
+
+        secondResponse = sessionUnderTest.getJson(f'{baseUrl}/json/second')
+
+        # then
+
+        assert secondResponse == { 'path': '/json/second' }
+        assert fakePortal.connectionsAccepted == 2
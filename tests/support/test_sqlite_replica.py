@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: tests/support/test_sqlite_replica.py
+# Purpose: Testing harness for support/sqlite_replica.py
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+import datetime
+import sqlite3
+
+import pytest
+
+from support.sqlite_replica import SQLiteReplica, isSQLiteReplica
+
+
+def createReplica(replicaPath, creationDates):
+    connection = sqlite3.connect(replicaPath)
+    connection.execute('CREATE TABLE survey (objectid INTEGER PRIMARY KEY, CreationDate DATETIME, SYS_TRANSFER_DATE DATETIME)')
+    connection.executemany('INSERT INTO survey (CreationDate) VALUES (?)', [[d] for d in creationDates])
+    connection.commit()
+    connection.close()
+
+
+def creationDatesIn(replicaPath):
+    connection = sqlite3.connect(replicaPath)
+    rows = connection.execute('SELECT CreationDate, SYS_TRANSFER_DATE FROM survey ORDER BY objectid').fetchall()
+    connection.close()
+    return rows
+
+
+@pytest.mark.usefixtures("resetArcpy", "resetMessengerSingleton")
+class TestSQLiteReplica:
+
+    def test_isSQLiteReplica(self):
+        assert isSQLiteReplica('C:/temp/survey.geodatabase')
+        assert not isSQLiteReplica('C:/temp/survey.gdb')
+
+    def test_SQLiteReplica_deletes_records_outside_sync_window(self, tmp_path):
+        # given
+
+        replicaPath = str(tmp_path.joinpath('survey.geodatabase'))
+        createReplica(replicaPath, ['2024-06-01 08:00:00', '2024-06-01T09:00:00', '2024-06-02 10:00:00', None])
+
+        lastSyncTime = datetime.datetime(2024, 6, 1, 8, 0, 0)
+        processTime = datetime.datetime(2024, 6, 2, 0, 0, 0)
+
+        # when
+
+        with SQLiteReplica(replicaPath) as replica:
+            deleted = replica.deleteRecordsOutside('main.survey', lastSyncTime, processTime)
+
+        # then
+
+        assert deleted == 2
+        assert creationDatesIn(replicaPath) == [('2024-06-01T09:00:00', None), (None, None)]
+
+    def test_SQLiteReplica_deletes_attachments_of_deleted_records(self, tmp_path):
+        # given
+
+        replicaPath = str(tmp_path.joinpath('survey.geodatabase'))
+        connection = sqlite3.connect(replicaPath)
+        connection.execute('CREATE TABLE survey (objectid INTEGER PRIMARY KEY, GlobalID TEXT, CreationDate DATETIME)')
+        connection.execute('CREATE TABLE survey__ATTACH (ATTACHMENTID INTEGER PRIMARY KEY, REL_GLOBALID TEXT, ATT_NAME TEXT)')
+        connection.executemany('INSERT INTO survey (GlobalID, CreationDate) VALUES (?, ?)', \
+            [['{old}', '2024-06-01 08:00:00'], ['{kept}', '2024-06-01 09:00:00'], ['{late}', '2024-06-02 10:00:00']])
+        connection.executemany('INSERT INTO survey__ATTACH (REL_GLOBALID, ATT_NAME) VALUES (?, ?)', \
+            [['{old}', 'old.jpg'], ['{kept}', 'kept1.jpg'], ['{kept}', 'kept2.jpg'], ['{late}', 'late.jpg']])
+        connection.commit()
+        connection.close()
+
+        lastSyncTime = datetime.datetime(2024, 6, 1, 8, 0, 0)
+        processTime = datetime.datetime(2024, 6, 2, 0, 0, 0)
+
+        # when
+
+        with SQLiteReplica(replicaPath) as replica:
+            deleted = replica.deleteRecordsOutside('main.survey', lastSyncTime, processTime)
+
+        # then
+
+        assert deleted == 2
+
+        connection = sqlite3.connect(replicaPath)
+        assert connection.execute('SELECT GlobalID FROM survey').fetchall() == [('{kept}',)]
+        assert connection.execute('SELECT REL_GLOBALID, ATT_NAME FROM survey__ATTACH ORDER BY ATTACHMENTID').fetchall() == \
+            [('{kept}', 'kept1.jpg'), ('{kept}', 'kept2.jpg')]
+        connection.close()
+
+    def test_SQLiteReplica_keeps_older_records_without_last_sync(self, tmp_path):
+        # given
+
+        replicaPath = str(tmp_path.joinpath('survey.geodatabase'))
+        createReplica(replicaPath, ['2020-01-01 00:00:00', '2024-06-02 10:00:00'])
+
+        # when
+
+        with SQLiteReplica(replicaPath) as replica:
+            replica.deleteRecordsOutside('survey', None, datetime.datetime(2024, 6, 2, 0, 0, 0))
+
+        # then
+
+        assert creationDatesIn(replicaPath) == [('2020-01-01 00:00:00', None)]
+
+    def test_SQLiteReplica_sets_column_on_every_row(self, tmp_path):
+        # given
+
+        replicaPath = str(tmp_path.joinpath('survey.geodatabase'))
+        createReplica(replicaPath, ['2024-06-01 08:00:00', '2024-06-01 09:00:00'])
+
+        # when
+
+        with SQLiteReplica(replicaPath) as replica:
+            updated = replica.setColumn('survey', 'SYS_TRANSFER_DATE', datetime.datetime(2024, 6, 2, 0, 0, 0))
+
+        # then
+
+        assert updated == 2
+        assert [row[1] for row in creationDatesIn(replicaPath)] == ['2024-06-02 00:00:00'] * 2
+
+    def test_SQLiteReplica_rolls_back_on_error(self, tmp_path):
+        # given
+
+        replicaPath = str(tmp_path.joinpath('survey.geodatabase'))
+        createReplica(replicaPath, ['2024-06-01 08:00:00'])
+
+        # when
+
+        with pytest.raises(RuntimeError):
+            with SQLiteReplica(replicaPath) as replica:
+                replica.setColumn('survey', 'SYS_TRANSFER_DATE', datetime.datetime(2024, 6, 2, 0, 0, 0))
+                raise RuntimeError('interrupted')
+
+        # then
+
+        assert creationDatesIn(replicaPath) == [('2024-06-01 08:00:00', None)]
+
+    def test_SQLiteReplica_integrity(self, tmp_path):
+        # given
+
+        goodPath = str(tmp_path.joinpath('good.geodatabase'))
+        createReplica(goodPath, ['2024-06-01 08:00:00'])
+
+        badPath = tmp_path.joinpath('bad.geodatabase')
+        badPath.write_bytes(b'definitely not a mobile geodatabase' * 100)
+
+        # when/then
+
+        assert SQLiteReplica(goodPath).integrityProblem() == None
+        assert SQLiteReplica(str(badPath)).integrityProblem() != None
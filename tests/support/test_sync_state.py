@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: tests/support/test_sync_state.py
+# Purpose: Testing harness for support/sync_state.py
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+import pytest
+
+from support.sync_state import SyncStateStore, establishWatermarks, overallWatermarkOf
+
+import datetime
+import pytz
+
+DESTINATION = 'c:/connections/survey.sde'
+PROCESS_TIME = datetime.datetime(2024, 6, 30, 12, 0, 0, tzinfo=pytz.utc)
+
+
+class FakeArcpyProxy():
+    def __init__(self, lastSyncTime):
+        self.lastSyncTime = lastSyncTime
+        self.tablesScanned = []
+
+    def getLastSynchronizationTime(self, workspace, tables):
+        self.tablesScanned.append(tables)
+        return self.lastSyncTime
+
+
+@pytest.mark.usefixtures("resetArcpy", "resetMessengerSingleton")
+class TestSyncStateStore:
+
+    def test_SyncStateStore_round_trip_per_destination_and_prefix(self, tmp_path):
+        # given
+
+        SyncStateStore(str(tmp_path)).recordLoad(DESTINATION, 'prefix', ['prefix_survey', 'owner.prefix_repeat'], PROCESS_TIME)
+
+        # when
+
+        storeUnderTest = SyncStateStore(str(tmp_path))
+        watermarks = storeUnderTest.watermarksFor(DESTINATION, 'prefix', ['owner.prefix_survey', 'prefix_repeat', 'prefix_new'])
+
+        # then
+
+        assert watermarks == {
+            'prefix_survey': datetime.datetime(2024, 6, 30, 12, 0, 0),
+            'prefix_repeat': datetime.datetime(2024, 6, 30, 12, 0, 0)
+        }
+        assert storeUnderTest.watermarksFor(DESTINATION, 'other', ['prefix_survey']) == {}
+        assert storeUnderTest.watermarksFor('c:/connections/other.sde', 'prefix', ['prefix_survey']) == {}
+
+    def test_SyncStateStore_advances_only_tables_loaded(self, tmp_path):
+        # given
+
+        storeUnderTest = SyncStateStore(str(tmp_path))
+        storeUnderTest.recordLoad(DESTINATION, 'prefix', ['prefix_survey', 'prefix_repeat'], PROCESS_TIME)
+
+        # when
+
+        storeUnderTest.recordLoad(DESTINATION, 'prefix', ['prefix_survey'], PROCESS_TIME + datetime.timedelta(days=1))
+
+        # then
+
+        assert storeUnderTest.watermarksFor(DESTINATION, 'prefix', ['prefix_survey', 'prefix_repeat']) == {
+            'prefix_survey': datetime.datetime(2024, 7, 1, 12, 0, 0),
+            'prefix_repeat': datetime.datetime(2024, 6, 30, 12, 0, 0)
+        }
+
+    def test_establishWatermarks_scans_destination_only_for_tables_not_held(self, tmp_path):
+        # given
+
+        syncState = SyncStateStore(str(tmp_path))
+        syncState.recordLoad(DESTINATION, 'prefix', ['prefix_survey'], PROCESS_TIME)
+        fakeProxy = FakeArcpyProxy(datetime.datetime(2024, 6, 1, 8, 30, 0))
+
+        # when
+
+        watermarks = establishWatermarks(syncState, fakeProxy, DESTINATION, 'prefix', ['prefix_survey', 'prefix_repeat'])
+
+        # then
+
+        assert fakeProxy.tablesScanned == [['prefix_repeat']]
+        assert watermarks == {
+            'prefix_survey': datetime.datetime(2024, 6, 30, 12, 0, 0),
+            'prefix_repeat': datetime.datetime(2024, 6, 1, 8, 30, 0)
+        }
+        assert overallWatermarkOf(watermarks) == datetime.datetime(2024, 6, 1, 8, 30, 0)
+
+    def test_establishWatermarks_skips_scan_when_all_tables_held(self, tmp_path):
+        # given
+
+        syncState = SyncStateStore(str(tmp_path))
+        syncState.recordLoad(DESTINATION, 'prefix', ['prefix_survey', 'prefix_repeat'], PROCESS_TIME)
+        fakeProxy = FakeArcpyProxy(None)
+
+        # when
+
+        watermarks = establishWatermarks(syncState, fakeProxy, DESTINATION, 'prefix', ['prefix_survey', 'prefix_repeat'])
+
+        # then
+
+        assert fakeProxy.tablesScanned == []
+        assert overallWatermarkOf(watermarks) == datetime.datetime(2024, 6, 30, 12, 0, 0)
+
+    def test_overallWatermarkOf_is_none_while_any_table_unsynchronised(self):
+        # when
+
+        watermarks = { 'prefix_survey': datetime.datetime(2024, 6, 30, 12, 0, 0), 'prefix_repeat': None }
+
+        # then
+
+        assert overallWatermarkOf(watermarks) == None
+        assert overallWatermarkOf({}) == None
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: tests/support/test_token_cache.py
+# Purpose: Testing harness for support/token_cache.py
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+import os
+import stat
+
+import pytest
+from unittest.mock import patch
+
+from support.token_cache import TokenCache, TOKEN_CACHE_FILE
+import support.time as time
+
+PORTAL = 'https://www.not.really.arcgis.com'
+
+
+@pytest.mark.usefixtures("resetArcpy", "resetMessengerSingleton")
+class TestTokenCache:
+
+    def test_TokenCache_round_trip(self, tmp_path):
+        # given
+
+        expires = time.epochSeconds() + 3600
+        TokenCache(str(tmp_path)).put(PORTAL, 'TheUser', 'someToken', expires)
+
+        # when
+
+        cached = TokenCache(str(tmp_path)).get(PORTAL, 'TheUser')
+
+        # then
+
+        assert cached == { 'token': 'someToken', 'expires': expires }
+        assert TokenCache(str(tmp_path)).get(PORTAL, 'SomeoneElse') == None
+
+    def test_TokenCache_ignores_nearly_expired_tokens(self, tmp_path):
+        # given
+
+        cacheUnderTest = TokenCache(str(tmp_path))
+        cacheUnderTest.put(PORTAL, 'TheUser', 'someToken', time.epochSeconds() + 60)
+
+        # when
+
+        cached = cacheUnderTest.get(PORTAL, 'TheUser')
+
+        # then
+
+        assert cached == None
+
+    def test_TokenCache_evict(self, tmp_path):
+        # given
+
+        cacheUnderTest = TokenCache(str(tmp_path))
+        cacheUnderTest.put(PORTAL, 'TheUser', 'someToken', time.epochSeconds() + 3600)
+
+        # when
+
+        cacheUnderTest.evict(PORTAL, 'TheUser')
+
+        # then
+
+        assert cacheUnderTest.get(PORTAL, 'TheUser') == None
+
+    def test_TokenCache_survives_damaged_file(self, tmp_path):
+        # given
+
+        tmp_path.joinpath(TOKEN_CACHE_FILE).write_text('{ not json')
+        cacheUnderTest = TokenCache(str(tmp_path))
+
+        # when
+
+        cacheUnderTest.put(PORTAL, 'TheUser', 'someToken', time.epochSeconds() + 3600)
+
+        # then
+
+        assert cacheUnderTest.get(PORTAL, 'TheUser')['token'] == 'someToken'
+
+    @pytest.mark.skipif(os.name != 'posix', reason='file modes are POSIX only')
+    def test_TokenCache_file_is_private(self, tmp_path):
+        # given
+
+        cacheDirectory = tmp_path.joinpath('cache')
+
+        # when
+
+        TokenCache(str(cacheDirectory)).put(PORTAL, 'TheUser', 'someToken', time.epochSeconds() + 3600)
+
+        # then
+
+        assert stat.S_IMODE(cacheDirectory.joinpath(TOKEN_CACHE_FILE).stat().st_mode) == 0o600
+        assert stat.S_IMODE(cacheDirectory.stat().st_mode) == 0o700
+
+    def test_TokenCache_stores_tokens_only_in_protected_form(self, tmp_path):
+        # given
+
+        def fakeProtect(data):
+            return bytes(reversed(data))
+
+        # when
+
+        with patch('support.token_cache.protect', fakeProtect), patch('support.token_cache.unprotect', fakeProtect):
+            TokenCache(str(tmp_path)).put(PORTAL, 'TheUser', 'someToken', time.epochSeconds() + 3600)
+            entry = TokenCache(str(tmp_path)).get(PORTAL, 'TheUser')
+
+        # then
+
+        assert entry['token'] == 'someToken'
+        assert b'someToken' not in tmp_path.joinpath(TOKEN_CACHE_FILE).read_bytes()
+        assert TokenCache(str(tmp_path)).get(PORTAL, 'TheUser') == None
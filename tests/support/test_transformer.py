@@ -11,10 +11,14 @@ from support.parameters import *
 import support.time as time
 
 from enum import Enum
+import datetime
+import os
+import sqlite3
 import pytest
 from unittest.mock import patch
 
 from support.transformer import FGDBReprojectionTransformer
+import support.metrics as metrics
 
 ResponseType = Enum('ResponseType', \
     ['NO_TABLES', 'NO_DESTINATION_TABLES', 'NO_REPLICA_TABLES', \
@@ -33,6 +37,92 @@ class FakeCursor(arcpy.da.Cursor):
             raise StopIteration
 
 
+class FakeUpdateCursor():
+    def __init__(self, rows, fieldCount):
+        self.rows = rows
+        self.fieldCount = fieldCount
+        self.current = None
+
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exception_type, exception_value, exception_traceback):
+        pass
+
+    def __iter__(self):
+        for row in list(self.rows):
+            self.current = row
+            yield row + [None] * (self.fieldCount - len(row))
+
+    def updateRow(self, row):
+        self.current[:] = row
+
+    def deleteRow(self):
+        self.rows[:] = [row for row in self.rows if row is not self.current]
+
+
+class FakeEditor():
+    def __init__(self, tables):
+        self.tables = tables
+
+    def __enter__(self):
+        self.tables.editing = True
+        return self
+
+    def __exit__(self, exception_type, exception_value, exception_traceback):
+        self.tables.editing = False
+
+
+class FakeReplicaTables():
+    '''Holds the rows of each replica table, handing out update cursors over them'''
+
+    def __init__(self, rows, tablesWithRowsOutsideWindow = []):
+        self.rows = rows
+        self.tablesWithRowsOutsideWindow = tablesWithRowsOutsideWindow
+        self.fieldsUsed = {}
+        self.cursorsOpened = 0
+        self.windowFilters = {}
+        self.fieldsCalculated = {}
+        self.countsTaken = 0
+        self.editing = False
+        self.calculatedWhileEditing = False
+
+    def Editor(self, workspace, multiuser_mode = True):
+        return FakeEditor(self)
+
+    def UpdateCursor(self, FQtable, fieldNames, where_clause = None):
+        table = os.path.basename(FQtable)
+        self.fieldsUsed[table] = fieldNames
+        self.cursorsOpened += 1
+        return FakeUpdateCursor(self.rows.setdefault(table, []), len(fieldNames))
+
+    def SearchCursor(self, FQtable, fieldNames, where_clause = None):
+        table = os.path.basename(FQtable)
+        if where_clause == 'rowid IS NULL':
+            return FakeUpdateCursor([row for row in self.rows.get(table, []) if len(row) < 3 or row[2] == None], len(fieldNames))
+
+        self.windowFilters[table] = where_clause
+        outsideRows = [[None]] if table in self.tablesWithRowsOutsideWindow else []
+        return FakeUpdateCursor(outsideRows, len(fieldNames))
+
+    def CalculateFields(self, FQtable, expressionType, fields, codeBlock):
+        self.calculatedWhileEditing = self.calculatedWhileEditing or self.editing
+        self.fieldsCalculated[os.path.basename(FQtable)] = fields
+
+    def GetCount(self, FQtable):
+        self.countsTaken += 1
+        return [str(len(self.rows.get(os.path.basename(FQtable), [])))]
+
+
+class FakeDescription():
+    def __init__(self, name, datatype = 'Workspace', children = [], isAttachmentRelationship = False, originClassNames = []):
+        self.name = name
+        self.datatype = datatype
+        self.children = children
+        self.isAttachmentRelationship = isAttachmentRelationship
+        self.originClassNames = originClassNames
+
+
 class FakeArcpyBridge():
     def __init__(self, params):
         self.params = params
@@ -112,9 +202,9 @@ class FakeArcpyBridge():
                 return [1]
         return [0]
     
-    def SearchCursor(self, tableName, columns):
+    def SearchCursor(self, tableName, columns, where_clause = None, sql_clause = None):
         cursor = FakeCursor()
-        cursor.timestamp = self.params['destinationTimestamp']
+        cursor.timestamp = self.params.get('destinationTimestamp', None)
         return cursor
 
     def Statistics_analysis(self, tableName, workspace, analysisType):
@@ -158,8 +248,8 @@ class TestFGDReprojectionTransformer:
             transformerUnderTest = FGDBReprojectionTransformer(parameters).withContext(context)
             transformerUnderTest.transform(fakeReplicatedGeodatabase)
             
-        assert fakeBridge.ListTablesCalled == 3
-        assert fakeBridge.ListFeatureClassesCalled == 3
+        assert fakeBridge.ListTablesCalled == 2
+        assert fakeBridge.ListFeatureClassesCalled == 2
 
     def test_FGDBReprojectionTransformer_transform_no_destination_data(self):
         # given
@@ -194,8 +284,8 @@ class TestFGDReprojectionTransformer:
             transformerUnderTest = FGDBReprojectionTransformer(parameters).withContext(context)
             transformerUnderTest.transform(fakeReplicatedGeodatabase)
             
-        assert fakeBridge.ListTablesCalled == 3
-        assert fakeBridge.ListFeatureClassesCalled == 3
+        assert fakeBridge.ListTablesCalled == 2
+        assert fakeBridge.ListFeatureClassesCalled == 2
 
     def test_FGDBReprojectionTransformer_transform_matching_tables(self):
         # given
@@ -231,8 +321,8 @@ class TestFGDReprojectionTransformer:
             transformerUnderTest = FGDBReprojectionTransformer(parameters).withContext(context)
             transformerUnderTest.transform(fakeReplicatedGeodatabase)
             
-        assert fakeBridge.ListTablesCalled == 4
-        assert fakeBridge.ListFeatureClassesCalled == 4
+        assert fakeBridge.ListTablesCalled == 2
+        assert fakeBridge.ListFeatureClassesCalled == 2
 
     def test_FGDBReprojectionTransformer_transform_mismatching_tables(self):
         # given
@@ -274,3 +364,370 @@ class TestFGDReprojectionTransformer:
             assert fakeBridge.ListFeatureClassesCalled == 2
             assert 'Mismatch of expected destination tables' in str(e_info.value)
 
+    def test_FGDBReprojectionTransformer_reuses_extracted_watermark(self):
+        # given
+           
+        parameters = {
+            PORTAL: 'https://www.not.really.arcgis.com',
+            PORTAL_USER_NAME: 'TheUser',
+            PORTAL_PASSWORD: 'NopeNopeNopeNope',
+            SERVICE_URL: 'https://yaddayaddayadda.com/rest-of-url',
+
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'some_destination.gdb',
+            DESTINATION_CRS: 'GDA2020 MGA Zone 56',
+            'destinationTimestamp': time.dummyTimestamp()
+        }
+
+        lastSyncTime = time.getUTCTimestamp(parameters[TIMEZONE])
+        
+        context = {
+            PROCESS_TIME: time.getUTCTimestamp(parameters[TIMEZONE]),
+            EXISTING_TABLES: [parameters[PREFIX] + '_featureClass1', parameters[PREFIX] + '_featureClass2',
+                              parameters[PREFIX] + '_table1', parameters[PREFIX] + '_table2'],
+            LAST_SYNC_TIME: lastSyncTime
+        }
+        
+        fakeReplicatedGeodatabase = 'fakeReplicant.gdb'
+
+        fakeBridge = FakeArcpyBridge(parameters).\
+                        usingReplicaGeodatabase(fakeReplicatedGeodatabase).\
+                        withMatchingTables()
+        
+        with patch('support.transformer.arcpy.ListFeatureClasses', fakeBridge.ListFeatureClasses),\
+             patch('support.transformer.arcpy.ListTables', fakeBridge.ListTables),\
+             patch('support.transformer.arcpy.management.GetCount', fakeBridge.GetCount),\
+             patch('support.transformer.arcpy.da.SearchCursor', fakeBridge.SearchCursor):
+
+            transformerUnderTest = FGDBReprojectionTransformer(parameters).withContext(context)
+
+            # when
+
+            transformerUnderTest.transform(fakeReplicatedGeodatabase)
+
+        # then
+
+        assert fakeBridge.GetCountCalled == 0
+        assert fakeBridge.ListTablesCalled == 1
+        assert context[LAST_SYNC_TIME] == lastSyncTime
+
+    def test_FGDBReprojectionTransformer_filters_and_stamps_sqlite_replica_with_sql(self, tmp_path):
+        # given
+           
+        parameters = {
+            PORTAL: 'https://www.not.really.arcgis.com',
+            PORTAL_USER_NAME: 'TheUser',
+            PORTAL_PASSWORD: 'NopeNopeNopeNope',
+            SERVICE_URL: 'https://yaddayaddayadda.com/rest-of-url',
+
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'some_destination.gdb',
+            DESTINATION_CRS: 'GDA2020 MGA Zone 56',
+        }
+
+        context = {
+            PROCESS_TIME: datetime.datetime(2024, 6, 2, 0, 0, 0),
+            EXISTING_TABLES: []
+        }
+
+        replicaPath = str(tmp_path.joinpath('survey.geodatabase'))
+        connection = sqlite3.connect(replicaPath)
+        connection.execute('CREATE TABLE survey (objectid INTEGER PRIMARY KEY, CreationDate DATETIME, SYS_TRANSFER_DATE DATETIME)')
+        connection.executemany('INSERT INTO survey (CreationDate) VALUES (?)', [['2024-06-01 08:00:00'], ['2024-06-03 08:00:00']])
+        connection.commit()
+        connection.close()
+
+        fakeTables = FakeReplicaTables({})
+        
+        with patch('support.transformer.arcpy.ListFeatureClasses', lambda wildcard: ['survey']),\
+             patch('support.transformer.arcpy.ListTables', lambda wildcard: ['missing_repeat']),\
+             patch('support.transformer.arcpy.da.UpdateCursor', fakeTables.UpdateCursor):
+
+            transformerUnderTest = FGDBReprojectionTransformer(parameters).withContext(context)
+
+            # when
+
+            transformerUnderTest.transform(replicaPath)
+
+        # then
+
+        connection = sqlite3.connect(replicaPath)
+        rows = connection.execute('SELECT CreationDate, SYS_TRANSFER_DATE FROM survey').fetchall()
+        connection.close()
+
+        assert rows == [('2024-06-01 08:00:00', '2024-06-02 00:00:00')]
+
+        # Only the table SQLite could not find was left to arcpy.
+        assert list(fakeTables.fieldsUsed.keys()) == ['missing_repeat']
+
+    def test_FGDBReprojectionTransformer_filters_stamps_and_keys_in_one_pass(self):
+        # given
+           
+        parameters = {
+            PORTAL: 'https://www.not.really.arcgis.com',
+            PORTAL_USER_NAME: 'TheUser',
+            PORTAL_PASSWORD: 'NopeNopeNopeNope',
+            SERVICE_URL: 'https://yaddayaddayadda.com/rest-of-url',
+
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'some_destination.gdb',
+            DESTINATION_CRS: 'GDA2020 MGA Zone 56',
+        }
+
+        processTime = datetime.datetime(2024, 6, 30, 12, 0, 0)
+        context = {
+            PROCESS_TIME: processTime,
+            EXISTING_TABLES: [],
+            LAST_SYNC_TIME: datetime.datetime(2024, 6, 1, 8, 30, 0),
+            TABLE_WATERMARKS: {
+                'myprefix_survey': datetime.datetime(2024, 6, 20, 0, 0, 0),
+                'myprefix_repeat': datetime.datetime(2024, 6, 1, 8, 30, 0)
+            }
+        }
+
+        fakeTables = FakeReplicaTables({
+            'survey': [[datetime.datetime(2024, 6, 10, 0, 0, 0)], [datetime.datetime(2024, 6, 25, 0, 0, 0)]],
+            'repeat': [[datetime.datetime(2024, 6, 10, 0, 0, 0)], [datetime.datetime(2024, 7, 1, 0, 0, 0)], [None]]
+        }, ['survey', 'repeat'])
+        descriptions = {
+            'replica.gdb': FakeDescription('replica.gdb', children=[FakeDescription('survey__ATTACHREL', 'RelationshipClass')]),
+            'survey__ATTACHREL': FakeDescription('survey__ATTACHREL', 'RelationshipClass', isAttachmentRelationship=True, originClassNames=['survey'])
+        }
+        
+        with patch('support.transformer.arcpy.ListFeatureClasses', lambda wildcard: ['survey']),\
+             patch('support.transformer.arcpy.ListTables', lambda wildcard: ['repeat']),\
+             patch('support.transformer.arcpy.Describe', lambda name: descriptions[os.path.basename(name)]),\
+             patch('support.transformer.arcpy.da.SearchCursor', fakeTables.SearchCursor),\
+             patch('support.transformer.arcpy.da.UpdateCursor', fakeTables.UpdateCursor):
+
+            transformerUnderTest = FGDBReprojectionTransformer(parameters).withContext(context)
+
+            # when
+
+            transformerUnderTest.transform('replica.gdb')
+
+        # then
+
+        assert fakeTables.windowFilters == {
+            'survey': "CreationDate > date '2024-06-30 12:00:00' OR CreationDate <= date '2024-06-20 00:00:00'",
+            'repeat': "CreationDate > date '2024-06-30 12:00:00' OR CreationDate <= date '2024-06-01 08:30:00'"
+        }
+        assert fakeTables.cursorsOpened == 2
+        assert fakeTables.fieldsUsed == {
+            'survey': ['CreationDate', 'SYS_TRANSFER_DATE', 'rowid'],
+            'repeat': ['CreationDate', 'SYS_TRANSFER_DATE']
+        }
+
+        surveyRows = fakeTables.rows['survey']
+        assert [row[:2] for row in surveyRows] == [[datetime.datetime(2024, 6, 25, 0, 0, 0), processTime]]
+        assert surveyRows[0][2].startswith('{') and surveyRows[0][2].endswith('}')
+
+        assert fakeTables.rows['repeat'] == [[datetime.datetime(2024, 6, 10, 0, 0, 0), processTime], [None, processTime]]
+
+        assert metrics.valueOf(context, 'ReplicaRowsKept') == 3
+        assert metrics.valueOf(context, 'ReplicaRowsDeleted') == 2
+
+    def test_FGDBReprojectionTransformer_strips_main_qualifier_of_mobile_replica_tables(self):
+        # given
+           
+        parameters = {
+            PORTAL: 'https://www.not.really.arcgis.com',
+            PORTAL_USER_NAME: 'TheUser',
+            PORTAL_PASSWORD: 'NopeNopeNopeNope',
+            SERVICE_URL: 'https://yaddayaddayadda.com/rest-of-url',
+
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'some_destination.gdb',
+            DESTINATION_CRS: 'GDA2020 MGA Zone 56',
+        }
+
+        processTime = datetime.datetime(2024, 6, 30, 12, 0, 0)
+        context = {
+            PROCESS_TIME: processTime,
+            EXISTING_TABLES: ['myprefix_survey', 'myprefix_repeat'],
+            LAST_SYNC_TIME: datetime.datetime(2024, 6, 1, 8, 30, 0),
+            TABLE_WATERMARKS: {
+                'myprefix_survey': datetime.datetime(2024, 6, 20, 0, 0, 0),
+                'myprefix_repeat': datetime.datetime(2024, 6, 1, 8, 30, 0)
+            }
+        }
+
+        fakeTables = FakeReplicaTables({
+            'main.survey': [[datetime.datetime(2024, 6, 10, 0, 0, 0)], [datetime.datetime(2024, 6, 25, 0, 0, 0)]],
+            'main.repeat': [[datetime.datetime(2024, 6, 10, 0, 0, 0)]]
+        }, ['main.survey'])
+        descriptions = {
+            'replica.gdb': FakeDescription('replica.gdb', children=[FakeDescription('survey__ATTACHREL', 'RelationshipClass')]),
+            'survey__ATTACHREL': FakeDescription('survey__ATTACHREL', 'RelationshipClass', isAttachmentRelationship=True, originClassNames=['survey'])
+        }
+        
+        with patch('support.transformer.arcpy.ListFeatureClasses', lambda wildcard: ['main.survey']),\
+             patch('support.transformer.arcpy.ListTables', lambda wildcard: ['main.repeat']),\
+             patch('support.transformer.arcpy.Describe', lambda name: descriptions[os.path.basename(name)]),\
+             patch('support.transformer.arcpy.da.SearchCursor', fakeTables.SearchCursor),\
+             patch('support.transformer.arcpy.da.UpdateCursor', fakeTables.UpdateCursor),\
+             patch('support.transformer.arcpy.management.CalculateFields', fakeTables.CalculateFields):
+
+            transformerUnderTest = FGDBReprojectionTransformer(parameters).withContext(context)
+
+            # when
+
+            transformerUnderTest.transform('replica.gdb')
+
+        # then
+
+        assert fakeTables.windowFilters == {
+            'main.survey': "CreationDate > date '2024-06-30 12:00:00' OR CreationDate <= date '2024-06-20 00:00:00'",
+            'main.repeat': "CreationDate > date '2024-06-30 12:00:00' OR CreationDate <= date '2024-06-01 08:30:00'"
+        }
+        assert fakeTables.fieldsUsed == { 'main.survey': ['CreationDate', 'SYS_TRANSFER_DATE', 'rowid'] }
+        assert [row[:2] for row in fakeTables.rows['main.survey']] == [[datetime.datetime(2024, 6, 25, 0, 0, 0), processTime]]
+        assert list(fakeTables.fieldsCalculated.keys()) == ['main.repeat']
+
+    def test_FGDBReprojectionTransformer_calculates_fields_when_no_rows_need_deleting(self):
+        # given
+           
+        parameters = {
+            PORTAL: 'https://www.not.really.arcgis.com',
+            PORTAL_USER_NAME: 'TheUser',
+            PORTAL_PASSWORD: 'NopeNopeNopeNope',
+            SERVICE_URL: 'https://yaddayaddayadda.com/rest-of-url',
+
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'some_destination.gdb',
+            DESTINATION_CRS: 'GDA2020 MGA Zone 56',
+        }
+
+        context = {
+            PROCESS_TIME: datetime.datetime(2024, 6, 30, 12, 0, 0, 250000),
+            EXISTING_TABLES: []
+        }
+
+        fakeTables = FakeReplicaTables({ 'survey': [[datetime.datetime(2024, 6, 10, 0, 0, 0)], [datetime.datetime(2024, 6, 25, 0, 0, 0)]] })
+
+        with patch('support.transformer.arcpy.ListFeatureClasses', lambda wildcard: ['survey']),\
+             patch('support.transformer.arcpy.ListTables', lambda wildcard: []),\
+             patch('support.transformer.arcpy.da.SearchCursor', fakeTables.SearchCursor),\
+             patch('support.transformer.arcpy.da.UpdateCursor', fakeTables.UpdateCursor),\
+             patch('support.transformer.arcpy.management.CalculateFields', fakeTables.CalculateFields),\
+             patch('support.transformer.arcpy.management.GetCount', fakeTables.GetCount),\
+             patch('support.transformer.arcpy.da.Editor', fakeTables.Editor):
+
+            transformerUnderTest = FGDBReprojectionTransformer(parameters).withContext(context)
+
+            # when
+
+            transformerUnderTest.transform('replica.gdb')
+
+        # then
+
+        assert fakeTables.windowFilters == { 'survey': "CreationDate > date '2024-06-30 12:00:00'" }
+        assert fakeTables.cursorsOpened == 0
+        assert fakeTables.fieldsCalculated == { 'survey': [['SYS_TRANSFER_DATE', 'datetime.datetime(2024, 6, 30, 12, 0, 0)']] }
+        assert not fakeTables.calculatedWhileEditing
+        assert metrics.valueOf(context, 'ReplicaRowsKept') == 2
+
+    def test_FGDBReprojectionTransformer_falls_back_to_cursor_when_calculation_fails(self):
+        # given
+           
+        parameters = {
+            PORTAL: 'https://www.not.really.arcgis.com',
+            PORTAL_USER_NAME: 'TheUser',
+            PORTAL_PASSWORD: 'NopeNopeNopeNope',
+            SERVICE_URL: 'https://yaddayaddayadda.com/rest-of-url',
+
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'some_destination.gdb',
+            DESTINATION_CRS: 'GDA2020 MGA Zone 56',
+        }
+
+        processTime = datetime.datetime(2024, 6, 30, 12, 0, 0)
+        context = {
+            PROCESS_TIME: processTime,
+            EXISTING_TABLES: []
+        }
+
+        def failingCalculateFields(FQtable, expressionType, fields, codeBlock):
+            raise arcpy.ExecuteError('some fake calculation error')
+
+        fakeTables = FakeReplicaTables({ 'survey': [[datetime.datetime(2024, 6, 10, 0, 0, 0)]] })
+
+        with patch('support.transformer.arcpy.ListFeatureClasses', lambda wildcard: ['survey']),\
+             patch('support.transformer.arcpy.ListTables', lambda wildcard: []),\
+             patch('support.transformer.arcpy.da.SearchCursor', fakeTables.SearchCursor),\
+             patch('support.transformer.arcpy.da.UpdateCursor', fakeTables.UpdateCursor),\
+             patch('support.transformer.arcpy.management.CalculateFields', failingCalculateFields):
+
+            transformerUnderTest = FGDBReprojectionTransformer(parameters).withContext(context)
+
+            # when
+
+            transformerUnderTest.transform('replica.gdb')
+
+        # then
+
+        assert fakeTables.cursorsOpened == 1
+        assert fakeTables.rows['survey'] == [[datetime.datetime(2024, 6, 10, 0, 0, 0), processTime]]
+
+    def test_FGDBReprojectionTransformer_keys_only_rows_without_one(self):
+        # given
+           
+        parameters = {
+            PORTAL: 'https://www.not.really.arcgis.com',
+            PORTAL_USER_NAME: 'TheUser',
+            PORTAL_PASSWORD: 'NopeNopeNopeNope',
+            SERVICE_URL: 'https://yaddayaddayadda.com/rest-of-url',
+
+            PREFIX: 'myprefix',
+            TIMEZONE: 'Australia/Brisbane',
+            SDE_CONNECTION: 'some_destination.gdb',
+            DESTINATION_CRS: 'GDA2020 MGA Zone 56',
+        }
+
+        processTime = datetime.datetime(2024, 6, 30, 12, 0, 0)
+        context = {
+            PROCESS_TIME: processTime,
+            EXISTING_TABLES: []
+        }
+
+        existingKey = '{00000000-0000-4000-8000-000000000001}'
+        fakeTables = FakeReplicaTables({
+            'survey': [[datetime.datetime(2024, 6, 10, 0, 0, 0), None, existingKey], [datetime.datetime(2024, 6, 25, 0, 0, 0), None, None]],
+            'repeat': [[datetime.datetime(2024, 6, 10, 0, 0, 0), None, existingKey]]
+        })
+        descriptions = {
+            'replica.gdb': FakeDescription('replica.gdb', children=[FakeDescription('survey__ATTACHREL', 'RelationshipClass'), FakeDescription('repeat__ATTACHREL', 'RelationshipClass')]),
+            'survey__ATTACHREL': FakeDescription('survey__ATTACHREL', 'RelationshipClass', isAttachmentRelationship=True, originClassNames=['survey']),
+            'repeat__ATTACHREL': FakeDescription('repeat__ATTACHREL', 'RelationshipClass', isAttachmentRelationship=True, originClassNames=['repeat'])
+        }
+        
+        with patch('support.transformer.arcpy.ListFeatureClasses', lambda wildcard: ['survey']),\
+             patch('support.transformer.arcpy.ListTables', lambda wildcard: ['repeat']),\
+             patch('support.transformer.arcpy.ListFields', lambda table: [arcpy.Field('rowid')]),\
+             patch('support.transformer.arcpy.Describe', lambda name: descriptions[os.path.basename(name)]),\
+             patch('support.transformer.arcpy.da.SearchCursor', fakeTables.SearchCursor),\
+             patch('support.transformer.arcpy.da.UpdateCursor', fakeTables.UpdateCursor),\
+             patch('support.transformer.arcpy.management.CalculateFields', fakeTables.CalculateFields),\
+             patch('support.transformer.arcpy.management.GetCount', fakeTables.GetCount):
+
+            transformerUnderTest = FGDBReprojectionTransformer(parameters).withContext(context)
+
+            # when
+
+            transformerUnderTest.transform('replica.gdb')
+
+        # then
+
+        assert fakeTables.fieldsUsed == { 'survey': ['CreationDate', 'SYS_TRANSFER_DATE', 'rowid'] }
+        surveyKeys = [row[2] for row in fakeTables.rows['survey']]
+        assert surveyKeys[0] == existingKey
+        assert surveyKeys[1] != None and surveyKeys[1] != existingKey
+
+        # Its keys already populated, the repeat is only stamped.
+        assert list(fakeTables.fieldsCalculated.keys()) == ['repeat']
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+# ---------------------------------------------------------------------------
+# Name: tests/support/test_unzipper.py
+# Purpose: Testing harness for support/unzipper.py
+# Author: Lindsay Bradford, Truii.com, 2024.
+# Release History:
+# ---------------------------------------------------------------------------
+# V1: Initial release
+
+from io import BytesIO
+from pathlib import Path
+
+import os
+import zipfile
+
+import pytest
+
+from support.unzipper import StreamingUnzipper, UnsupportedZipStreamError, CorruptZipStreamError, TruncatedZipStreamError
+
+MEMBERS = {
+    'survey.gdb/a00000001.gdbtable': b'table rows ' * 5000,
+    'survey.gdb/a00000001.gdbtablx': os.urandom(3000),
+    'survey.gdb/timestamps': b'',
+}
+
+
+class UnseekableStream(BytesIO):
+    '''Forces zipfile to write data descriptors, as it must when streaming an archive out'''
+
+    def seekable(self):
+        return False
+
+    def seek(self, *args):
+        raise OSError('not seekable')
+
+    def tell(self):
+        raise OSError('not seekable')
+
+
+def zipOf(members, compression = zipfile.ZIP_DEFLATED, stream = None):
+    stream = stream or BytesIO()
+    with zipfile.ZipFile(stream, 'w', compression) as archive:
+        for name, content in members.items():
+            archive.writestr(name, content)
+    return stream.getvalue()
+
+
+def extracted(outDir):
+    return { str(path.relative_to(outDir).as_posix()): path.read_bytes() for path in Path(outDir).rglob('*') if path.is_file() }
+
+
+@pytest.mark.usefixtures("resetArcpy", "resetMessengerSingleton")
+class TestStreamingUnzipper:
+
+    def test_StreamingUnzipper_deflated_members(self, tmp_path):
+        # given
+
+        archive = BytesIO(zipOf(MEMBERS))
+
+        # when
+
+        names = StreamingUnzipper(chunkBytes = 512).extract(archive, str(tmp_path))
+
+        # then
+
+        assert names == list(MEMBERS.keys())
+        assert extracted(tmp_path) == MEMBERS
+
+    def test_StreamingUnzipper_stored_members(self, tmp_path):
+        # given
+
+        archive = BytesIO(zipOf(MEMBERS, zipfile.ZIP_STORED))
+
+        # when
+
+        StreamingUnzipper(chunkBytes = 100).extract(archive, str(tmp_path))
+
+        # then
+
+        assert extracted(tmp_path) == MEMBERS
+
+    def test_StreamingUnzipper_data_descriptors(self, tmp_path):
+        # given
+
+        archive = BytesIO(zipOf(MEMBERS, stream = UnseekableStream()))
+
+        # when
+
+        StreamingUnzipper(chunkBytes = 256).extract(archive, str(tmp_path))
+
+        # then
+
+        assert extracted(tmp_path) == MEMBERS
+
+    def test_StreamingUnzipper_stored_members_of_unknown_size(self, tmp_path):
+        # given
+
+        archive = BytesIO(zipOf(MEMBERS, zipfile.ZIP_STORED, UnseekableStream()))
+
+        # when/then
+
+        with pytest.raises(UnsupportedZipStreamError):
+            StreamingUnzipper(chunkBytes = 256).extract(archive, str(tmp_path))
+
+    def test_StreamingUnzipper_corrupt_member(self, tmp_path):
+        # given
+
+        content = zipOf({ 'survey.gdb/a00000001.gdbtable': b'0123456789' * 10 }, zipfile.ZIP_STORED)
+        corrupted = content.replace(b'0123456789', b'9876543210', 1)
+
+        # when/then
+
+        with pytest.raises(CorruptZipStreamError, match='failed CRC check'):
+            StreamingUnzipper(chunkBytes = 64).extract(BytesIO(corrupted), str(tmp_path))
+
+    def test_StreamingUnzipper_truncated_stream(self, tmp_path):
+        # given
+
+        content = zipOf(MEMBERS)
+
+        # when/then
+
+        with pytest.raises(TruncatedZipStreamError):
+            StreamingUnzipper(chunkBytes = 512).extract(BytesIO(content[:len(content) // 2]), str(tmp_path))
+
+    def test_StreamingUnzipper_rejects_paths_outside_target(self, tmp_path):
+        # given
+
+        archive = BytesIO(zipOf({ '../escaped.txt': b'gotcha' }))
+        outDir = tmp_path.joinpath('out')
+        outDir.mkdir()
+
+        # when/then
+
+        with pytest.raises(CorruptZipStreamError, match='would extract outside'):
+            StreamingUnzipper(chunkBytes = 512).extract(archive, str(outDir))
+
+        assert not tmp_path.joinpath('escaped.txt').exists()